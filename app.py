@@ -1,10 +1,19 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, make_response, g
 from flask_cors import CORS
 from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.test import EnvironBuilder
 import database as db
 import database_social as social
+import database_writer
+import json
+import json_stream
+import metrics
+import password_hashing
 import secrets
 import os
+import time
+from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,10 +24,83 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 # Google Analytics Measurement ID (set in environment variables)
 app.config['GA_MEASUREMENT_ID'] = os.environ.get('GA_MEASUREMENT_ID', '')
+# Maximum number of sub-requests accepted by /api/batch
+app.config['BATCH_MAX_REQUESTS'] = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+app.config['CHECKOUT_MAX_ITEMS'] = int(os.environ.get('CHECKOUT_MAX_ITEMS', 50))
+app.config['SYNC_MAX_ACTIONS'] = int(os.environ.get('SYNC_MAX_ACTIONS', 100))
+# Send DB_TRACE results as response headers even outside debug mode (benchmarks read them)
+app.config['DB_TRACE_HEADERS'] = os.environ.get('DB_TRACE_HEADERS', '') == '1'
+# When set, /metrics requires 'Authorization: Bearer <token>'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Proxies in front of the app (Render's load balancer is one); their X-Forwarded-For
+# gives request.remote_addr the client's address, which login throttling buckets on.
+# Set 0 when clients connect directly, or they could pick their own address.
+app.config['PROXY_FIX_X_FOR'] = int(os.environ.get('PROXY_FIX_X_FOR', 1))
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 CORS(app)
 
 # Initialize database on startup
 db.init_db()
+db.start_replica_refresher()
+metrics.start_flusher()
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the latency histogram"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and its latency under its route pattern (not the raw path, which has ids)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        route=route, method=request.method)
+        metrics.inc('http_requests_total', route=route, method=request.method, status=str(response.status_code))
+        if response.status_code >= 500:
+            metrics.inc('http_request_errors_total', route=route, method=request.method)
+    return response
+
+@app.before_request
+def route_to_shard():
+    """Send this request's unkeyed database calls to the logged-in user's shard (when sharded)"""
+    db.set_shard_key(session.get('user_id'))
+
+@app.before_request
+def start_db_trace():
+    """Record this request's SQL when DB_TRACE is set"""
+    if db.DB_TRACE:
+        g.db_trace = db.start_trace()
+
+@app.after_request
+def report_db_trace(response):
+    """Report the request's statement count, DB time and repeated statements
+    
+    As X-DB-* headers in debug mode (or with DB_TRACE_HEADERS=1), otherwise as one
+    JSON log line. Rows a streamed response fetches after this point aren't included.
+    """
+    trace = g.pop('db_trace', None)
+    if trace is None:
+        return response
+    db.stop_trace(trace)
+    summary = trace.summary()
+    if app.debug or app.config['DB_TRACE_HEADERS']:
+        response.headers['X-DB-Statements'] = str(summary['statements'])
+        response.headers['X-DB-Time'] = f"{summary['db_ms']:.2f}"
+        response.headers['X-DB-Repeated'] = str(sum(entry['count'] for entry in summary['repeated']))
+    else:
+        print('db_trace ' + json.dumps(dict(summary, method=request.method, path=request.path,
+                                            status=response.status_code), separators=(',', ':')))
+    return response
+
+@app.teardown_request
+def end_db_trace(error=None):
+    """Stop a trace that after_request never saw (the request raised)"""
+    trace = g.pop('db_trace', None)
+    if trace is not None:
+        db.stop_trace(trace)
 
 # Authentication decorator
 def login_required(f):
@@ -29,6 +111,144 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Request-scoped identity
+def current_character():
+    """Load the logged-in user's character at most once per request
+    
+    The cached row is read-only display data: write helpers take the character
+    id and re-read the row inside their own transaction.
+    """
+    if 'character' not in g:
+        user_id = session['user_id']
+        char = None
+        
+        # The session remembers the character id, so this is a primary-key read
+        character_id = session.get('character_id')
+        if character_id is not None:
+            char = db.get_character(character_id)
+            if char and char.get('user_id') != user_id:
+                char = None
+        
+        if char is None:
+            char = db.get_character_by_user_id(user_id)
+        
+        set_current_character(char)
+    return g.character
+
+def set_current_character(char):
+    """Replace the request's character with a fresh copy returned by a write"""
+    g.character = char
+    if char:
+        session['character_id'] = char['id']
+
+def current_character_id():
+    """Get the logged-in user's character id, from the session when already resolved"""
+    if 'character' in g:
+        return g.character['id'] if g.character else None
+    character_id = session.get('character_id')
+    if character_id is None:
+        char = current_character()
+        character_id = char['id'] if char else None
+    return character_id
+
+# Conditional GET decorator (use after login_required)
+def conditional_get(f):
+    """Tag per-user responses with an ETag and answer 304 when it still matches"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user_id = session['user_id']
+        version = db.get_data_version(user_id)
+        if version is None:
+            return f(*args, **kwargs)
+        
+        # Daily challenges and weekly stats roll over with the date
+        etag = f"{user_id}.{version}.{datetime.now().strftime('%Y%m%d')}"
+        fresh = request.if_none_match.contains_weak(etag)
+        metrics.count_cache('etag', fresh)
+        if fresh:
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
+def read_only_route(f):
+    """Serve a public route from read-only connections (the snapshot replica when configured),
+    so bursts of anonymous reads never take locks the game's writers wait on"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with db.replica_reads():
+            response = make_response(f(*args, **kwargs))
+        lag = db.replica_lag()
+        if lag is not None:
+            response.headers['X-Replica-Lag'] = f'{lag:.1f}'
+        return response
+    return decorated_function
+
+def requested_fields(resource: str):
+    """Parse ?fields=a,b for a resource; None means every field
+    
+    Raises ValueError naming the first field outside the resource's whitelist.
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    for field in fields:
+        if field not in db.FIELD_WHITELISTS[resource]:
+            raise ValueError(f"Unknown {resource} field: {field}")
+    return fields or None
+
+def idempotent(f):
+    """Replay the stored response when a request repeats its Idempotency-Key header
+    
+    The first request runs in one transaction together with recording its response,
+    so a retry either sees the recorded result or runs from scratch. Server errors
+    aren't recorded. Keys are per user and per route, and expire after IDEMPOTENCY_TTL.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is limited to 255 characters'}), 400
+        
+        user_id = session['user_id']
+        request_key = f"idem:{request.method} {request.path}:{key}"
+        
+        def replay(applied):
+            metrics.count_cache('idempotency', True)
+            response = jsonify(applied['body'])
+            response.status_code = applied['status']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        # Fast path: a retry of a finished request only reads the key store
+        applied = db.get_applied_request(user_id, request_key)
+        if applied:
+            return replay(applied)
+        
+        def run_once():
+            with db.shared_connection(transactional=True):
+                # A concurrent duplicate may have committed while this one waited for the lock
+                applied = db.get_applied_request(user_id, request_key)
+                if applied:
+                    return replay(applied)
+                
+                metrics.count_cache('idempotency', False)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code < 500 and response.is_json:
+                    db.record_applied_request(user_id, request_key, response.status_code, response.get_json())
+                return response
+        return database_writer.run_with_busy_retry(f.__name__, run_once)
+    return decorated_function
+
 @app.route('/')
 def index():
     """Serve the landing page or main app"""
@@ -74,6 +294,13 @@ def sitemap_xml():
     return send_from_directory('static', 'sitemap.xml', mimetype='application/xml')
 
 # Auth API endpoints
+def hashing_unavailable(retry_after: float):
+    """Response for login/register attempts turned away before hashing"""
+    response = jsonify({'error': 'Too many attempts, please try again shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.5)))
+    return response
+
 @app.route('/api/register', methods=['POST'])
 def register():
     """Register a new user"""
@@ -91,10 +318,18 @@ def register():
     if len(password) < 6:
         return jsonify({'error': 'Password must be at least 6 characters'}), 400
     
+    allowed, retry_after = password_hashing.admit_login(request.remote_addr)
+    if not allowed:
+        return hashing_unavailable(retry_after)
+    
     # Create user
-    user = db.create_user(username, password)
+    try:
+        user = db.create_user(username, password)
+    except password_hashing.HashingBusy:
+        return hashing_unavailable(1)
     if not user:
         return jsonify({'error': 'Username already exists'}), 400
+    db.set_shard_key(user['id'])
     
     # Create character for user
     character = db.create_character_for_user(user['id'], character_name)
@@ -102,6 +337,7 @@ def register():
     # Log them in
     session['user_id'] = user['id']
     session['username'] = user['username']
+    session['character_id'] = character['id']
     
     return jsonify({'success': True, 'user': user, 'character': character}), 201
 
@@ -115,13 +351,21 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
     
-    user_id = db.verify_password(username, password)
+    allowed, retry_after = password_hashing.admit_login(request.remote_addr, username)
+    if not allowed:
+        return hashing_unavailable(retry_after)
+    
+    try:
+        user_id = db.verify_password(username, password)
+    except password_hashing.HashingBusy:
+        return hashing_unavailable(1)
     if not user_id:
         return jsonify({'error': 'Invalid username or password'}), 401
     
     # Set session
     session['user_id'] = user_id
     session['username'] = username
+    db.set_shard_key(user_id)
     
     return jsonify({'success': True, 'message': 'Logged in successfully'})
 
@@ -134,32 +378,56 @@ def logout():
 # Character endpoints
 @app.route('/api/character', methods=['GET'])
 @login_required
+@conditional_get
 def get_character():
-    """Get the logged-in user's character"""
+    """Get the logged-in user's character
+    
+    Query params:
+        fields: comma-separated character fields to return (default: all)
+    """
     user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    try:
+        fields = requested_fields('character')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # A stale session id reads nothing; it then resolves the same way as the full row
+    character_id = current_character_id() if fields else None
+    if character_id:
+        projected = db.get_character_fields(character_id, fields)
+        if projected is not None:
+            return jsonify(projected)
+        session.pop('character_id', None)
+        g.pop('character', None)
+    
+    char = current_character()
     
     if not char:
         # Log this event for debugging
         print(f"WARNING: No character found for user_id {user_id} ({session.get('username')}), creating new character")
         # Create default character if doesn't exist
         char = db.create_character_for_user(user_id, session.get('username', 'Hero'))
+        set_current_character(char)
     
+    if fields:
+        char = {field: char[field] for field in fields}
     return jsonify(char)
 
 @app.route('/api/character/stats', methods=['GET'])
 @login_required
+@conditional_get
 def get_character_with_stats():
     """Get character with full statistics"""
     user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    char = current_character()
     
     if not char:
         # Log this event for debugging
         print(f"WARNING: No character found for user_id {user_id} ({session.get('username')}), creating new character")
         char = db.create_character_for_user(user_id, session.get('username', 'Hero'))
+        set_current_character(char)
     
-    stats = db.get_statistics(char['id'])
+    stats = db.get_statistics(char['id'], user_id)
     inventory = db.get_inventory(char['id'])
     
     return jsonify({
@@ -168,18 +436,274 @@ def get_character_with_stats():
         'inventory': inventory
     })
 
+# Bootstrap endpoint
+BOOTSTRAP_SECTIONS = (
+    'character', 'template_categories', 'templates', 'quests', 'shop_items',
+    'inventory', 'battle_history', 'achievements', 'daily_challenges', 'weekly_stats'
+)
+
+@app.route('/api/bootstrap', methods=['GET'])
+@login_required
+@conditional_get
+def bootstrap():
+    """Load everything the main app shell needs in one request
+    
+    Query params:
+        sections: comma-separated subset of BOOTSTRAP_SECTIONS (default: all)
+        completed: quest filter, same as /api/quests
+    """
+    user_id = session['user_id']
+    
+    requested = request.args.get('sections')
+    if requested:
+        sections = [name.strip() for name in requested.split(',') if name.strip()]
+    else:
+        sections = list(BOOTSTRAP_SECTIONS)
+    
+    unknown = [name for name in sections if name not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        return jsonify({'error': f"Unknown sections: {', '.join(unknown)}"}), 400
+    
+    completed = request.args.get('completed')
+    if completed is not None:
+        completed = completed.lower() == 'true'
+    
+    result = {}
+    with db.shared_connection():
+        # Read first so anything changed while loading shows up in the next sync
+        result['sync_token'] = db.get_sync_token(user_id)
+        char = current_character()
+        if not char:
+            print(f"WARNING: No character found for user_id {user_id} ({session.get('username')}), creating new character")
+            char = db.create_character_for_user(user_id, session.get('username', 'Hero'))
+            set_current_character(char)
+        
+        if 'character' in sections:
+            result['character'] = char
+        if 'template_categories' in sections:
+            result['template_categories'] = db.get_template_categories()
+        if 'templates' in sections:
+            result['templates'] = db.get_all_templates(popular_only=True)
+        if 'quests' in sections:
+            result['quests'] = db.get_all_quests(user_id, completed)
+        if 'shop_items' in sections:
+            result['shop_items'] = db.get_all_items()
+        if 'inventory' in sections:
+            result['inventory'] = db.get_inventory(char['id'])
+        if 'battle_history' in sections:
+            result['battle_history'] = db.get_battle_history(char['id'])
+        if 'achievements' in sections:
+            result['achievements'] = db.get_all_achievements()
+        if 'daily_challenges' in sections:
+            result['daily_challenges'] = db.get_daily_challenges(user_id)
+        if 'weekly_stats' in sections:
+            result['weekly_stats'] = db.get_weekly_comparison(user_id, char['id'])
+    
+    return jsonify(result)
+
+# Batch endpoint
+# Routes that touch the session itself can't run as sub-requests
+BATCH_EXCLUDED_PATHS = {'/api/batch', '/api/login', '/api/logout', '/api/register'}
+
+class BatchAborted(Exception):
+    """Raised to roll back an atomic batch after a failed sub-request"""
+
+def dispatch_subrequest(method: str, path: str, body=None, headers=None):
+    """Run one sub-request through the app in-process with the caller's session
+    
+    It gets its own app context, so its g (timer, DB trace, cached character) is
+    separate from the outer request's.
+    """
+    sub_headers = dict(headers or {})
+    sub_headers['Cookie'] = request.headers.get('Cookie', '')
+    
+    builder = EnvironBuilder(
+        path=path,
+        method=method,
+        json=body,
+        headers=sub_headers,
+        base_url=request.host_url
+    )
+    with app.app_context(), app.request_context(builder.get_environ()):
+        return app.full_dispatch_request()
+
+def subrequest_body(response):
+    """Decode a sub-request response body for embedding in a JSON envelope"""
+    return response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch():
+    """Run an ordered list of API sub-requests in one round trip
+    
+    Body:
+        requests: [{"method": "POST", "path": "/api/shop/purchase", "body": {...}, "headers": {...}}, ...]
+        atomic: roll back every sub-request if any of them fails (default false)
+    """
+    data = request.json or {}
+    items = data.get('requests')
+    atomic = bool(data.get('atomic', False))
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    
+    max_requests = app.config['BATCH_MAX_REQUESTS']
+    if len(items) > max_requests:
+        return jsonify({'error': f'Batch is limited to {max_requests} requests'}), 413
+    
+    for item in items:
+        if not isinstance(item, dict) or not str(item.get('path', '')).startswith('/api/'):
+            return jsonify({'error': 'Each request needs an /api/ path'}), 400
+        if item['path'].split('?')[0] in BATCH_EXCLUDED_PATHS:
+            return jsonify({'error': f"{item['path']} can't be batched"}), 400
+    
+    def run_batch():
+        # Rebuilt on every attempt: a busy retry re-runs the whole batch
+        responses = []
+        try:
+            with db.shared_connection(transactional=True) as conn:
+                for index, item in enumerate(items):
+                    method = item.get('method', 'GET').upper()
+                    try:
+                        with db.savepoint(conn, 'batch_item'):
+                            response = dispatch_subrequest(method, item['path'], item.get('body'), item.get('headers'))
+                    except Exception as e:
+                        if database_writer.is_busy_error(e):
+                            raise
+                        print(f"Error in batch request {method} {item['path']}: {e}")
+                        response = jsonify({'error': 'Internal server error'})
+                        response.status_code = 500
+                    
+                    entry = {'id': item.get('id', index), 'status': response.status_code}
+                    if response.status_code != 304:
+                        entry['body'] = subrequest_body(response)
+                    if response.headers.get('ETag'):
+                        entry['headers'] = {'ETag': response.headers['ETag']}
+                    responses.append(entry)
+                    
+                    if atomic and response.status_code >= 400:
+                        raise BatchAborted()
+        except BatchAborted:
+            return False, responses
+        return True, responses
+    
+    committed, responses = database_writer.run_with_busy_retry('batch', run_batch)
+    if not committed:
+        return jsonify({'committed': False, 'responses': responses}), 409
+    
+    return jsonify({'committed': True, 'responses': responses})
+
+# Delta sync endpoints
+@app.route('/api/sync', methods=['GET'])
+@login_required
+@conditional_get
+def get_sync():
+    """Get everything that changed since a sync token
+    
+        since: token from bootstrap or the previous sync (default 0: a full snapshot)
+        since: token from bootstrap or the previous sync (default 0: everything)
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since must be a sync token'}), 400
+    
+    return jsonify(db.get_changes_since(session['user_id'], since))
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def post_sync():
+    """Apply a queue of offline actions in one transaction, each at most once
+    
+    Body:
+        actions: [{"id": "<client-generated unique id>", "method": "POST", "path": "/api/quests/1/complete", "body": {...}}, ...]
+        since: optional sync token; the response then includes the changes since it
+    
+    A replayed action id returns its recorded result without running again. An action
+    that fails with a server error isn't recorded, so the client can retry it later.
+    """
+    user_id = session['user_id']
+    data = request.json or {}
+    actions = data.get('actions')
+    
+    if not isinstance(actions, list):
+        return jsonify({'error': 'actions must be a list'}), 400
+    
+    since = data.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'since must be a sync token'}), 400
+    
+    max_actions = app.config['SYNC_MAX_ACTIONS']
+    if len(actions) > max_actions:
+        return jsonify({'error': f'Sync is limited to {max_actions} actions'}), 413
+    
+    for action in actions:
+        if not isinstance(action, dict) or not action.get('id') or not str(action.get('path', '')).startswith('/api/'):
+            return jsonify({'error': 'Each action needs an id and an /api/ path'}), 400
+        if action['path'].split('?')[0] in BATCH_EXCLUDED_PATHS | {'/api/sync'}:
+            return jsonify({'error': f"{action['path']} can't be synced"}), 400
+    
+    def apply_actions():
+        # Rebuilt on every attempt: a busy retry re-runs the whole queue
+        results = []
+        with db.shared_connection(transactional=True) as conn:
+            for action in actions:
+                key = f"{db.SYNC_KEY_PREFIX}{action['id']}"
+                applied = db.get_applied_request(user_id, key)
+                if applied:
+                    results.append({'id': action['id'], 'replayed': True, **applied})
+                    continue
+                
+                method = action.get('method', 'POST').upper()
+                try:
+                    with db.savepoint(conn, 'sync_action'):
+                        response = dispatch_subrequest(method, action['path'], action.get('body'), action.get('headers'))
+                        body = subrequest_body(response)
+                        if response.status_code >= 500:
+                            raise BatchAborted()
+                        db.record_applied_request(user_id, key, response.status_code, body)
+                except BatchAborted:
+                    pass
+                except Exception as e:
+                    if database_writer.is_busy_error(e):
+                        raise
+                    print(f"Error in sync action {method} {action['path']}: {e}")
+                    response, body = None, {'error': 'Internal server error'}
+                
+                results.append({'id': action['id'], 'status': response.status_code if response else 500, 'body': body})
+        return results
+    
+    result = {'results': database_writer.run_with_busy_retry('sync', apply_actions)}
+    
+    if since is not None:
+        result['changes'] = db.get_changes_since(user_id, since)
+    
+    return jsonify(result)
+
 # Quest endpoints
 @app.route('/api/quests', methods=['GET'])
 @login_required
+@conditional_get
 def get_quests():
-    """Get all quests for logged-in user"""
+    """Get all quests for logged-in user
+    
+    Query params:
+        completed: 'true' or 'false' to filter by status
+        fields: comma-separated quest fields to return (default: all)
+    """
     user_id = session['user_id']
     completed = request.args.get('completed')
     if completed is not None:
         completed = completed.lower() == 'true'
+    try:
+        fields = requested_fields('quest')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    quests = db.get_all_quests(user_id, completed)
-    return jsonify(quests)
+    return json_stream.stream_rows(*db.iter_all_quests(user_id, completed, fields))
 
 @app.route('/api/quests', methods=['POST'])
 @login_required
@@ -199,25 +723,23 @@ def create_quest():
 
 @app.route('/api/quests/<int:quest_id>/complete', methods=['POST'])
 @login_required
+@idempotent
 def complete_quest(quest_id):
     """Complete a quest"""
     user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
-    result = db.complete_quest(quest_id, char['id'], user_id)
+    result = db.complete_quest(quest_id, character_id, user_id)
     
     if not result:
         return jsonify({'error': 'Quest not found or already completed'}), 404
+    set_current_character(result['character'])
     
     # Increment quest counter for leaderboard
-    social.increment_quest_counter(char['id'])
-    
-    # Check for newly unlocked achievements
-    newly_unlocked = db.check_and_unlock_achievements(char['id'])
-    result['newly_unlocked_achievements'] = newly_unlocked
+    social.increment_quest_counter(character_id)
     
     return jsonify(result)
 
@@ -240,103 +762,170 @@ def get_shop_items():
 
 @app.route('/api/shop/purchase', methods=['POST'])
 @login_required
+@idempotent
 def purchase_item():
     """Purchase an item"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
     data = request.json
     item_id = data.get('item_id')
     
-    result = db.purchase_item(char['id'], item_id)
+    result = db.purchase_item(character_id, item_id)
     
     if 'error' in result:
         return jsonify(result), 400
+    set_current_character(result['character'])
+    
+    return jsonify(result)
+
+@app.route('/api/shop/checkout', methods=['POST'])
+@login_required
+@idempotent
+def checkout():
+    """Buy a basket of items at once; nothing is bought unless the whole basket is affordable
+    
+    Body:
+        items: [{"item_id": 1, "quantity": 2}, ...]
+    """
+    character_id = current_character_id()
+    
+    if character_id is None:
+        return jsonify({'error': 'Character not found'}), 404
+    
+    data = request.json or {}
+    cart = data.get('items')
+    
+    if not isinstance(cart, list) or not all(isinstance(line, dict) for line in cart):
+        return jsonify({'error': 'items must be a list of {item_id, quantity}'}), 400
     
-    # Check for achievements
-    newly_unlocked = db.check_and_unlock_achievements(char['id'])
-    result['newly_unlocked_achievements'] = newly_unlocked
+    try:
+        item_count = sum(int(line.get('quantity', 1)) for line in cart)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'quantity must be a whole number'}), 400
+    
+    max_items = app.config['CHECKOUT_MAX_ITEMS']
+    if item_count > max_items:
+        return jsonify({'error': f'Checkout is limited to {max_items} items'}), 413
+    
+    result = db.checkout_cart(character_id, cart)
+    
+    if 'error' in result:
+        return jsonify(result), 400
+    set_current_character(result['character'])
     
     return jsonify(result)
 
 # Inventory endpoints
 @app.route('/api/inventory', methods=['GET'])
 @login_required
+@conditional_get
 def get_inventory():
-    """Get character inventory"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    """Get character inventory
     
-    if not char:
+    Query params:
+        fields: comma-separated item definition fields to return (default: all)
+    """
+    character_id = current_character_id()
+    
+    if not character_id:
         return jsonify({'error': 'Character not found'}), 404
+    try:
+        fields = requested_fields('item')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    inventory = db.get_inventory(char['id'])
+    inventory = db.get_inventory(character_id, fields)
     return jsonify(inventory)
 
 @app.route('/api/inventory/<int:inventory_id>/equip', methods=['POST'])
 @login_required
 def equip_item(inventory_id):
     """Equip an item"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
-    result = db.equip_item(inventory_id, char['id'])
+    result = db.equip_item(inventory_id, character_id)
     
     if 'error' in result:
         return jsonify(result), 400
+    set_current_character(result['character'])
+    
+    return jsonify(result)
+
+@app.route('/api/inventory/<int:inventory_id>/unequip', methods=['POST'])
+@login_required
+def unequip_item(inventory_id):
+    """Unequip an item"""
+    character_id = current_character_id()
+    
+    if character_id is None:
+        return jsonify({'error': 'Character not found'}), 404
+    
+    result = db.unequip_item(inventory_id, character_id)
+    
+    if 'error' in result:
+        return jsonify(result), 400
+    set_current_character(result['character'])
     
     return jsonify(result)
 
 # Battle endpoints
 @app.route('/api/battle', methods=['POST'])
 @login_required
+@idempotent
 def battle_monster():
     """Battle a monster"""
     user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
     data = request.json
     monster_name = data.get('monster_name', 'Goblin')
     monster_level = data.get('monster_level', 1)
     
-    result = db.battle_monster(char['id'], monster_name, monster_level, user_id)
+    result = db.battle_monster(character_id, monster_name, monster_level, user_id)
+    set_current_character(result['character'])
     
     # Increment monster counter if victory
     if result.get('won'):
-        social.increment_monster_counter(char['id'])
-    
-    # Check for achievements
-    newly_unlocked = db.check_and_unlock_achievements(char['id'])
-    result['newly_unlocked_achievements'] = newly_unlocked
+        social.increment_monster_counter(character_id)
     
     return jsonify(result)
 
 @app.route('/api/battle/history', methods=['GET'])
 @login_required
+@conditional_get
 def get_battle_history():
-    """Get battle history"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    """Get battle history
     
-    if not char:
+    Query params:
+        limit: number of battles (default 10)
+        fields: comma-separated battle fields to return (default: all)
+    """
+    character_id = current_character_id()
+    
+    if not character_id:
         return jsonify([])
+    try:
+        fields = requested_fields('battle')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     limit = request.args.get('limit', 10, type=int)
-    history = db.get_battle_history(char['id'], limit)
+    history = db.get_battle_history(character_id, limit, fields)
     return jsonify(history)
 
 # Achievement endpoints
 @app.route('/api/achievements', methods=['GET'])
 @login_required
+@conditional_get
 def get_achievements():
     """Get all achievements"""
     achievements = db.get_all_achievements()
@@ -346,13 +935,12 @@ def get_achievements():
 @login_required
 def check_achievements():
     """Manually check for unlocked achievements"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
-    newly_unlocked = db.check_and_unlock_achievements(char['id'])
+    newly_unlocked = db.check_and_unlock_achievements(character_id)
     return jsonify({
         'newly_unlocked': newly_unlocked,
         'all_achievements': db.get_all_achievements()
@@ -391,20 +979,21 @@ def create_from_template(template_id):
 # Statistics endpoint
 @app.route('/api/stats', methods=['GET'])
 @login_required
+@conditional_get
 def get_stats():
     """Get comprehensive statistics"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if not character_id:
         return jsonify({'error': 'Character not found'}), 404
     
-    stats = db.get_statistics(char['id'])
+    stats = db.get_statistics(character_id, session['user_id'])
     return jsonify(stats)
 
 # Daily Challenges endpoints
 @app.route('/api/challenges/daily', methods=['GET'])
 @login_required
+@conditional_get
 def get_daily_challenges_api():
     """Get today's daily challenges with user progress"""
     user_id = session['user_id']
@@ -413,48 +1002,50 @@ def get_daily_challenges_api():
 
 @app.route('/api/challenges/daily/<int:challenge_id>/claim', methods=['POST'])
 @login_required
+@idempotent
 def claim_daily_challenge_api(challenge_id):
     """Claim rewards for a completed daily challenge"""
     user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if character_id is None:
         return jsonify({'error': 'Character not found'}), 404
     
-    result = db.claim_daily_challenge(user_id, challenge_id, char['id'])
+    result = db.claim_daily_challenge(user_id, challenge_id, character_id)
     
     if 'error' in result:
         return jsonify(result), 400
+    set_current_character(result['character'])
     
     return jsonify(result)
 
 # Weekly Summary endpoints
 @app.route('/api/stats/weekly', methods=['GET'])
 @login_required
+@conditional_get
 def get_weekly_summary_api():
     """Get weekly summary with comparison to last week"""
     user_id = session['user_id']
-    summary = db.get_weekly_comparison(user_id)
+    summary = db.get_weekly_comparison(user_id, current_character_id())
     return jsonify(summary)
 
 @app.route('/api/stats/weekly/history', methods=['GET'])
 @login_required
+@conditional_get
 def get_weekly_history_api():
     """Get past N weeks of summary data"""
     user_id = session['user_id']
     weeks = request.args.get('weeks', 4, type=int)
-    history = db.get_weekly_history(user_id, weeks)
-    return jsonify(history)
+    return json_stream.stream_objects(db.iter_weekly_history(user_id, weeks, current_character_id()))
 
 # Character customization endpoint
 @app.route('/api/character/customize', methods=['POST'])
 @login_required
 def customize_character():
     """Update character customization"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if not character_id:
         return jsonify({'error': 'Character not found'}), 404
     
     data = request.json
@@ -464,7 +1055,7 @@ def customize_character():
     bio = data.get('bio', '')
     
     result = db.update_character_customization(
-        char['id'], 
+        character_id, 
         character_class, 
         avatar_id, 
         color_theme, 
@@ -478,15 +1069,26 @@ def customize_character():
 
 # Social/Leaderboard endpoints
 @app.route('/api/leaderboard', methods=['GET'])
+@read_only_route
 def get_leaderboard():
-    """Get leaderboard data"""
+    """Get leaderboard data
+    
+    Query params:
+        timeframe: 'daily', 'weekly', 'monthly', or 'all'
+        limit: number of players (default 100)
+        fields: comma-separated leaderboard fields to return (default: all)
+    """
     timeframe = request.args.get('timeframe', 'all')
     limit = request.args.get('limit', 100, type=int)
+    try:
+        fields = requested_fields('leaderboard')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    leaderboard = social.get_leaderboard(timeframe, limit)
-    return jsonify(leaderboard)
+    return json_stream.stream_rows(*social.iter_leaderboard(timeframe, limit, fields))
 
 @app.route('/api/profile/<username>', methods=['GET'])
+@read_only_route
 def get_public_profile_api(username):
     """Get public profile by username"""
     profile = social.get_public_profile_by_username(username)
@@ -501,20 +1103,37 @@ def public_profile_page(username):
     """Serve public profile page"""
     return render_template('profile.html', username=username)
 
+@app.route('/api/status/replica', methods=['GET'])
+def replica_status():
+    """Get the read replica's lag (seconds since its snapshot) and refresh counters"""
+    return jsonify(db.replica_status())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose request, database and cache metrics (summed over every worker) for Prometheus"""
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Not authorized'}), 401
+    
+    gauges = {}
+    lag = db.replica_lag()
+    if lag is not None:
+        gauges['replica_lag_seconds'] = ('Seconds since the read replica snapshot was taken', {(): lag})
+    return app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/profile/toggle', methods=['POST'])
 @login_required
 def toggle_profile_visibility():
     """Toggle public profile visibility"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if not character_id:
         return jsonify({'error': 'Character not found'}), 404
     
     data = request.json
     public = data.get('public', True)
     
-    result = social.toggle_public_profile(char['id'], public)
+    result = social.toggle_public_profile(character_id, public)
     
     if result:
         return jsonify({'success': True, 'public': public})
@@ -525,13 +1144,12 @@ def toggle_profile_visibility():
 @login_required
 def get_my_rank():
     """Get current user's rank"""
-    user_id = session['user_id']
-    char = db.get_character_by_user_id(user_id)
+    character_id = current_character_id()
     
-    if not char:
+    if not character_id:
         return jsonify({'error': 'Character not found'}), 404
     
-    rank = social.get_user_rank(char['id'])
+    rank = social.get_user_rank(character_id)
     return jsonify({'rank': rank})
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+"""
+Quest & Battle Archiver
+Moves completed quests and battles older than the horizon out of the hot database
+into per-month archive databases (archive/quest_master_archive_YYYY_MM.db), so the
+tables every request scans stay small enough to live in the page cache.
+
+Each batch runs in two transactions, each writing a single database file, because
+SQLite doesn't commit a WAL database and its attached databases atomically. The
+first copies the rows into the month's archive and commits. The second takes the
+rows that the archive now holds, folds them into archived_quest_totals /
+archived_battle_totals and deletes them from the hot tables. Statistics and
+achievements don't move. Date-ranged reads (weekly summaries, activity graphs,
+streaks) attach the archived months their range reaches through
+database.query_range.
+
+A crash between the two can only leave a batch copied but still in the hot tables
+(reads that span both may count it twice until then); nothing is deleted before its
+copy has committed. Just run the job again: the copy overwrites the earlier one and
+the totals come from the rows being deleted.
+
+Usage: python archive_records.py [--horizon-days 180] [--batch 2000] [--vacuum] [--dry-run]
+"""
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List
+
+import database
+from database_writer import run_with_busy_retry
+
+# Completed quests and battles older than this many days are archived
+ARCHIVE_HORIZON_DAYS = float(os.environ.get('ARCHIVE_HORIZON_DAYS', 180))
+# Rows moved per transaction, so writers only ever wait for one batch
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 2000))
+
+# Archive tables match the hot ones; ids are kept so a re-run can't duplicate rows
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS quest (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        difficulty TEXT,
+        xp_reward INTEGER NOT NULL,
+        gold_reward INTEGER NOT NULL,
+        completed BOOLEAN,
+        created_at TIMESTAMP,
+        completed_at TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS battle (
+        id INTEGER PRIMARY KEY,
+        character_id INTEGER NOT NULL,
+        monster_name TEXT NOT NULL,
+        monster_level INTEGER NOT NULL,
+        won BOOLEAN NOT NULL,
+        xp_gained INTEGER,
+        gold_gained INTEGER,
+        battled_at TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_quest_user_completed ON quest(user_id, completed_at)',
+    'CREATE INDEX IF NOT EXISTS idx_battle_character ON battle(character_id, battled_at)',
+]
+
+# Rows of each table that may be archived
+ARCHIVE_FILTERS = {'quest': 'completed = 1 AND ', 'battle': ''}
+
+# Counters folded in before rows leave the hot table
+TOTALS_UPSERTS = {
+    'quest': '''
+        INSERT INTO main.archived_quest_totals (user_id, quests_completed, xp_earned, gold_earned)
+        SELECT user_id, COUNT(*), COALESCE(SUM(xp_reward), 0), COALESCE(SUM(gold_reward), 0)
+        FROM main.quest WHERE id IN (SELECT value FROM json_each(?))
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            quests_completed = quests_completed + excluded.quests_completed,
+            xp_earned = xp_earned + excluded.xp_earned,
+            gold_earned = gold_earned + excluded.gold_earned
+    ''',
+    'battle': '''
+        INSERT INTO main.archived_battle_totals (character_id, battles_won, battles_lost)
+        SELECT character_id, SUM(won = 1), SUM(won = 0)
+        FROM main.battle WHERE id IN (SELECT value FROM json_each(?))
+        GROUP BY character_id
+        ON CONFLICT(character_id) DO UPDATE SET
+            battles_won = battles_won + excluded.battles_won,
+            battles_lost = battles_lost + excluded.battles_lost
+    ''',
+}
+
+# Users whose cached views change when rows leave their lists
+OWNER_QUERIES = {
+    'quest': 'SELECT DISTINCT user_id FROM main.quest WHERE id IN (SELECT value FROM json_each(?))',
+    'battle': '''
+        SELECT DISTINCT c.user_id FROM main.battle b JOIN main.character c ON c.id = b.character_id
+        WHERE b.id IN (SELECT value FROM json_each(?))
+    ''',
+}
+
+def create_archive(month: str) -> str:
+    """Create a month's archive database if needed and return its path"""
+    path = database.archive_path(month)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+def months_to_archive(table: str, cutoff: str) -> List[str]:
+    """Get the months ('YYYY-MM') that have rows of table older than cutoff, oldest first"""
+    date_column = database.ARCHIVE_DATE_COLUMNS[table]
+    conn = database.get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT MIN({date_column}) FROM {table} WHERE {ARCHIVE_FILTERS[table]}{date_column} < ?
+    ''', (cutoff,))
+    oldest = cursor.fetchone()[0]
+    conn.close()
+    if oldest is None:
+        return []
+
+    months = []
+    month = datetime.strptime(oldest[:7], '%Y-%m')
+    while month.strftime('%Y-%m-%d') < cutoff:
+        months.append(month.strftime('%Y-%m'))
+        month = (month + timedelta(days=32)).replace(day=1)
+    return months
+
+def move_month(table: str, month: str, cutoff: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move one month of a table's archivable rows (older than cutoff) into its archive; returns rows moved"""
+    date_column = database.ARCHIVE_DATE_COLUMNS[table]
+    columns = ', '.join(database.ARCHIVE_COLUMNS[table])
+    month_start = f'{month}-01'
+    month_end = min((datetime.strptime(month_start, '%Y-%m-%d') + timedelta(days=32)).strftime('%Y-%m-01'), cutoff)
+
+    conn = database.open_connection()
+    conn.isolation_level = None
+    conn.execute('ATTACH DATABASE ? AS archive', (create_archive(month),))
+
+    def select_batch(cursor) -> str:
+        cursor.execute(f'''
+            SELECT id FROM main.{table}
+            WHERE {ARCHIVE_FILTERS[table]}{date_column} >= ? AND {date_column} < ?
+            ORDER BY {date_column}
+            LIMIT ?
+        ''', (month_start, month_end, batch_size))
+        return json.dumps([row[0] for row in cursor.fetchall()])
+
+    def copy_batch() -> str:
+        """Copy the next batch into the archive (the only file written) and commit it"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.cursor()
+            ids = select_batch(cursor)
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO archive.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE id IN (SELECT value FROM json_each(?))
+            ''', (ids,))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return ids
+
+    def delete_batch(copied: str) -> int:
+        """Fold the copied rows into the totals and delete them from the hot tables (only main is written)"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.cursor()
+            # Only rows whose copy has committed, whatever happened since the copy
+            cursor.execute(f'''
+                SELECT id FROM main.{table}
+                WHERE id IN (SELECT value FROM json_each(?)) AND id IN (SELECT id FROM archive.{table})
+            ''', (copied,))
+            id_list = [row[0] for row in cursor.fetchall()]
+            moved = len(id_list)
+            if not moved:
+                conn.execute('ROLLBACK')
+                return 0
+            ids = json.dumps(id_list)
+
+            # Counters first, from exactly the rows about to be deleted
+            cursor.execute(TOTALS_UPSERTS[table], (ids,))
+            cursor.execute(f'''
+                INSERT INTO main.archive_month (month, {table}s) VALUES (?, ?)
+                ON CONFLICT(month) DO UPDATE SET {table}s = {table}s + excluded.{table}s, archived_at = CURRENT_TIMESTAMP
+            ''', (month, moved))
+
+            cursor.execute(OWNER_QUERIES[table], (ids,))
+            owners = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'DELETE FROM main.{table} WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+            if table == 'quest':
+                # Archiving isn't a deletion clients should sync; they keep their copies
+                cursor.execute('''
+                    DELETE FROM main.change_log WHERE entity = 'quest' AND entity_id IN (SELECT value FROM json_each(?))
+                ''', (ids,))
+            cursor.execute('''
+                UPDATE main.user SET data_version = data_version + 1 WHERE id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(owners),))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return moved
+
+    def drop_orphans(copied: str):
+        """Remove copies of rows deleted from the hot table between the two transactions"""
+        conn.execute(f'''
+            DELETE FROM archive.{table}
+            WHERE id IN (SELECT value FROM json_each(?)) AND id NOT IN (SELECT id FROM main.{table})
+        ''', (copied,))
+
+    total = 0
+    try:
+        while True:
+            copied = run_with_busy_retry('archive_records', copy_batch)
+            if copied == '[]':
+                return total
+            moved = run_with_busy_retry('archive_records', lambda: delete_batch(copied))
+            if moved < len(json.loads(copied)):
+                run_with_busy_retry('archive_records', lambda: drop_orphans(copied))
+            total += moved
+    finally:
+        conn.close()
+
+def hot_database_size() -> dict:
+    """Get the hot database's size, free pages and the page cache it would need"""
+    conn = database.get_db()
+    cursor = conn.cursor()
+    page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+    pages = cursor.execute('PRAGMA page_count').fetchone()[0]
+    free = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    cache_size = cursor.execute('PRAGMA cache_size').fetchone()[0]
+    conn.close()
+    # Negative cache_size is KiB, positive is pages
+    cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+    return {'bytes': pages * page_size, 'live_bytes': (pages - free) * page_size, 'cache_bytes': cache_bytes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--horizon-days', type=float, default=ARCHIVE_HORIZON_DAYS)
+    parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE, help='rows moved per transaction')
+    parser.add_argument('--vacuum', action='store_true', help='shrink the hot database file afterwards (blocks writers)')
+    parser.add_argument('--dry-run', action='store_true', help='only list the months that would be archived')
+    args = parser.parse_args()
+
+    if database.DB_SHARDS:
+        print("✗ Archiving supports the single-file layout only (DB_SHARDS is set)")
+        raise SystemExit(1)
+
+    database.init_db()
+    cutoff = (datetime.now() - timedelta(days=args.horizon_days)).strftime('%Y-%m-%d')
+    print(f"🗃️  Archiving completed quests and battles before {cutoff}")
+
+    for table in ('quest', 'battle'):
+        for month in months_to_archive(table, cutoff):
+            if args.dry_run:
+                print(f"  {table}: {month} -> {database.archive_path(month)}")
+                continue
+            moved = move_month(table, month, cutoff, args.batch)
+            if moved:
+                print(f"  ✓ {table}: moved {moved} rows from {month}")
+
+    if args.vacuum and not args.dry_run:
+        conn = database.get_db()
+        conn.execute('VACUUM')
+        conn.close()
+
+    size = hot_database_size()
+    print(f"\n✓ Hot database: {size['bytes'] / 1024 / 1024:.1f} MB "
+          f"({size['live_bytes'] / 1024 / 1024:.1f} MB in use, page cache {size['cache_bytes'] / 1024 / 1024:.1f} MB)")
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,184 @@
 """
 Database Backup Script
 Run this daily to prevent data loss
+
+Copies the live database with SQLite's online backup API (consistent, includes
+WAL contents), a few pages per step so live writers keep going, checks the copy
+with PRAGMA integrity_check, gzips it, and prunes old backups by age and total size.
+
+Usage: python backup_database.py [--dir backups] [--pages 256] [--pause 0.005]
+                                 [--keep-days 14] [--max-total-mb 500] [--min-keep 3]
 """
-import shutil
+import argparse
+import gzip
 import os
+import shutil
+import sqlite3
+import time
 from datetime import datetime
 
-# Create backups directory if it doesn't exist
-if not os.path.exists('backups'):
-    os.makedirs('backups')
+import database
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_PREFIX = 'quest_master_backup_'
+# Pages copied per backup step, and the pause between steps that lets writers in
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.005))
+# A write from another connection restarts a stepped backup; after this many
+# restarts the copy is finished in one step instead
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 5))
+# Retention: drop backups older than this or beyond this total size, but always keep the newest few
+BACKUP_KEEP_DAYS = float(os.environ.get('BACKUP_KEEP_DAYS', 14))
+BACKUP_MAX_TOTAL_MB = float(os.environ.get('BACKUP_MAX_TOTAL_MB', 500))
+BACKUP_MIN_KEEP = int(os.environ.get('BACKUP_MIN_KEEP', 3))
+
+class BackupRestarted(Exception):
+    """Raised from the progress callback to stop a stepped backup that keeps restarting"""
+
+def copy_database(source_path: str, destination_path: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  pause: float = BACKUP_STEP_PAUSE) -> dict:
+    """Copy a live database (a path or a file: URI) with the online backup API, pausing between steps"""
+    source = sqlite3.connect(source_path, uri=source_path.startswith('file:'), timeout=database.DB_BUSY_TIMEOUT)
+    destination = sqlite3.connect(destination_path)
+    progress = {'steps': 0, 'restarts': 0, 'pages': 0, 'last_remaining': None}
+
+    def on_progress(status, remaining, total):
+        progress['steps'] += 1
+        progress['pages'] = total
+        # Remaining only grows when another connection wrote and the copy started over
+        if progress['last_remaining'] is not None and remaining > progress['last_remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        progress['last_remaining'] = remaining
+        if pause and remaining:
+            time.sleep(pause)
+
+    try:
+        try:
+            source.backup(destination, pages=pages, progress=on_progress)
+        except BackupRestarted:
+            print(f"  Backup restarted {progress['restarts']} times under write load, finishing in one step")
+            source.backup(destination, pages=-1)
+        progress['pages'] = source.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        source.close()
+        destination.close()
+    return progress
+
+def check_integrity(path: str) -> str:
+    """Run PRAGMA integrity_check on a database file; 'ok' when it's sound"""
+    conn = sqlite3.connect(path)
+    try:
+        return '\n'.join(row[0] for row in conn.execute('PRAGMA integrity_check'))
+    finally:
+        conn.close()
+
+def compress_file(source_path: str, destination_path: str):
+    """Gzip a file, writing to a temporary name first so a partial archive is never left behind"""
+    partial = destination_path + '.partial'
+    with open(source_path, 'rb') as source, gzip.open(partial, 'wb', compresslevel=6) as destination:
+        shutil.copyfileobj(source, destination, 1024 * 1024)
+    os.replace(partial, destination_path)
+
+def restore_backup(archive_path: str, destination_path: str):
+    """Unpack a (gzipped or plain) backup to a database file"""
+    opener = gzip.open if archive_path.endswith('.gz') else open
+    with opener(archive_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        shutil.copyfileobj(source, destination, 1024 * 1024)
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> list:
+    """Get (path, size, modified time) for every backup, newest first"""
+    backups = []
+    for name in os.listdir(backup_dir):
+        if name.startswith(BACKUP_PREFIX) and not name.endswith('.partial'):
+            path = os.path.join(backup_dir, name)
+            stat = os.stat(path)
+            backups.append((path, stat.st_size, stat.st_mtime))
+    return sorted(backups, key=lambda backup: backup[2], reverse=True)
+
+def apply_retention(backup_dir: str = BACKUP_DIR, keep_days: float = BACKUP_KEEP_DAYS,
+                    max_total_mb: float = BACKUP_MAX_TOTAL_MB, min_keep: int = BACKUP_MIN_KEEP) -> list:
+    """Delete backups past the age limit or beyond the size budget, keeping the newest min_keep"""
+    now = time.time()
+    budget = max_total_mb * 1024 * 1024
+    total = 0
+    removed = []
+    for index, (path, size, modified) in enumerate(list_backups(backup_dir)):
+        total += size
+        too_old = now - modified > keep_days * 86400
+        if index >= min_keep and (too_old or total > budget):
+            os.remove(path)
+            removed.append(os.path.basename(path))
+            total -= size
+    return removed
+
+def backup_database(backup_dir: str = BACKUP_DIR, pages: int = BACKUP_PAGES_PER_STEP,
+                    pause: float = BACKUP_STEP_PAUSE) -> dict:
+    """Make one verified, compressed backup and return its report"""
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    snapshot = os.path.join(backup_dir, f'{BACKUP_PREFIX}{timestamp}.db.partial')
+    archive = os.path.join(backup_dir, f'{BACKUP_PREFIX}{timestamp}.db.gz')
+
+    started = time.perf_counter()
+    try:
+        progress = copy_database(database.storage_uri(), snapshot, pages, pause)
+        copied = time.perf_counter()
+
+        integrity = check_integrity(snapshot)
+        if integrity != 'ok':
+            raise RuntimeError(f"integrity check failed on the copy: {integrity}")
+
+        database_size = os.path.getsize(snapshot)
+        compress_file(snapshot, archive)
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'path': archive,
+        'pages': progress['pages'],
+        'steps': progress['steps'],
+        'restarts': progress['restarts'],
+        'database_bytes': database_size,
+        'backup_bytes': os.path.getsize(archive),
+        'copy_seconds': copied - started,
+        'seconds': elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help='pages per backup step (-1: all at once)')
+    parser.add_argument('--pause', type=float, default=BACKUP_STEP_PAUSE, help='seconds between backup steps')
+    parser.add_argument('--keep-days', type=float, default=BACKUP_KEEP_DAYS)
+    parser.add_argument('--max-total-mb', type=float, default=BACKUP_MAX_TOTAL_MB)
+    parser.add_argument('--min-keep', type=int, default=BACKUP_MIN_KEEP)
+    args = parser.parse_args()
+
+    if database.DB_SHARDS:
+        print("✗ Backups support the single-file layout only (DB_SHARDS is set)")
+        raise SystemExit(1)
 
-# Create timestamped backup
-timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-source = 'quest_master.db'
-destination = f'backups/quest_master_backup_{timestamp}.db'
+    try:
+        report = backup_database(args.dir, args.pages, args.pause)
+    except Exception as e:
+        print(f"✗ Backup failed: {e}")
+        raise SystemExit(1)
 
-try:
-    shutil.copy2(source, destination)
-    print(f"✓ Database backed up to: {destination}")
-    
-    # Keep only last 10 backups
-    backups = sorted([f for f in os.listdir('backups') if f.startswith('quest_master_backup_')])
-    if len(backups) > 10:
-        for old_backup in backups[:-10]:
-            os.remove(os.path.join('backups', old_backup))
-            print(f"  Removed old backup: {old_backup}")
-    
-    print(f"\n✓ Total backups: {min(len(backups), 10)}")
-except Exception as e:
-    print(f"✗ Backup failed: {e}")
+    megabytes = report['database_bytes'] / 1024 / 1024
+    print(f"✓ Database backed up to: {report['path']}")
+    print(f"  {report['pages']} pages in {report['steps']} steps ({report['restarts']} restarts), integrity ok")
+    print(f"  {megabytes:.1f} MB -> {report['backup_bytes'] / 1024 / 1024:.1f} MB compressed "
+          f"({report['backup_bytes'] / max(report['database_bytes'], 1):.0%})")
+    print(f"  {report['seconds']:.2f}s total, copy at {megabytes / max(report['copy_seconds'], 1e-9):.1f} MB/s")
 
+    for name in apply_retention(args.dir, args.keep_days, args.max_total_mb, args.min_keep):
+        print(f"  Removed old backup: {name}")
 
+    print(f"\n✓ Total backups: {len(list_backups(args.dir))}")
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+Endpoint load test
+Runs scripted player sessions against the app and reports throughput, latency
+percentiles and SQL statements per request for every endpoint.
+
+Each session logs in once, then repeats: bootstrap, create and complete a few
+quests back to back (so combos build), a battle, a shop purchase, an equip, and
+the leaderboard, a random player's profile and the player's own rank. Players
+come from fixtures.py, seeded into a fresh database in a temp directory.
+
+By default the app runs in-process through the Flask test client; --gunicorn
+starts a local gunicorn on the same database and drives it over HTTP instead.
+Statement counts and DB time come from the X-DB-* headers (DB_TRACE=1 with
+DB_TRACE_HEADERS=1); the leaderboard's streamed rows are fetched after the
+headers are sent, so its numbers cover only the work done before streaming starts.
+
+Results can be saved with --output and compared with a saved run with --baseline:
+
+    python benchmarks/load_test.py --output before.json
+    python benchmarks/load_test.py --baseline before.json
+
+Usage: python benchmarks/load_test.py [--sessions 8] [--iterations 20] [--players 1000] [--gunicorn] [--workers 2]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.request import HTTPCookieProcessor, Request, build_opener, urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Quests created and completed per iteration; completing them back to back builds a combo
+QUESTS_PER_ITERATION = 3
+DIFFICULTIES = ('easy', 'medium', 'hard')
+MONSTERS = ('Goblin', 'Skeleton', 'Orc')
+# Login attempts before a session gives up (the hashing pool sheds load with 503s)
+LOGIN_ATTEMPTS = 20
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+class InProcessClient:
+    """Drives the app through the Flask test client, one source address per player"""
+
+    def __init__(self, app, address):
+        self.client = app.test_client()
+        self.environ = {'REMOTE_ADDR': address}
+
+    def request(self, method, path, body=None):
+        """Send a request; returns (status, headers, body bytes)"""
+        response = self.client.open(path, method=method, json=body, environ_base=self.environ)
+        # Reading the body runs streamed responses to completion
+        data = response.get_data()
+        return response.status_code, response.headers, data
+
+class HttpClient:
+    """Drives a running server over HTTP, keeping the session cookie"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, body=None):
+        """Send a request; returns (status, headers, body bytes)"""
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.headers, response.read()
+        except HTTPError as e:
+            return e.code, e.headers, e.read()
+
+class Recorder:
+    """Collects (endpoint, latency ms, status, statements, DB ms) samples from every session"""
+
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def call(self, client, label, method, path, body=None):
+        """Time one request under an endpoint label; returns (status, decoded JSON or None)"""
+        started = time.perf_counter()
+        status, headers, data = client.request(method, path, body)
+        elapsed = (time.perf_counter() - started) * 1000
+        statements = headers.get('X-DB-Statements')
+        db_time = headers.get('X-DB-Time')
+        with self.lock:
+            self.samples.append((label, elapsed, status, None if statements is None else int(statements),
+                                 None if db_time is None else float(db_time)))
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+def run_session(client, recorder, player, usernames, item_ids, iterations, rng):
+    """Play one scripted session: log in, then loop through the game's main actions"""
+    for _ in range(LOGIN_ATTEMPTS):
+        status, _ = recorder.call(client, 'POST /api/login', 'POST', '/api/login',
+                                  {'username': player['username'], 'password': 'password'})
+        if status == 200:
+            break
+        time.sleep(0.1)
+    else:
+        return
+
+    for _ in range(iterations):
+        recorder.call(client, 'GET /api/bootstrap', 'GET', '/api/bootstrap')
+
+        for index in range(QUESTS_PER_ITERATION):
+            status, quest = recorder.call(client, 'POST /api/quests', 'POST', '/api/quests',
+                                          {'title': f'Bench quest {index + 1}', 'difficulty': rng.choice(DIFFICULTIES)})
+            if status == 201:
+                recorder.call(client, 'POST /api/quests/<id>/complete', 'POST', f"/api/quests/{quest['id']}/complete")
+
+        recorder.call(client, 'POST /api/battle', 'POST', '/api/battle',
+                      {'monster_name': rng.choice(MONSTERS), 'monster_level': rng.randint(1, 5)})
+        recorder.call(client, 'POST /api/shop/purchase', 'POST', '/api/shop/purchase',
+                      {'item_id': rng.choice(item_ids)})
+
+        status, inventory = recorder.call(client, 'GET /api/inventory', 'GET', '/api/inventory')
+        if status == 200:
+            unequipped = [entry for entry in inventory['inventory'] if entry['equipped_count'] < entry['quantity']]
+            if unequipped:
+                recorder.call(client, 'POST /api/inventory/<id>/equip', 'POST',
+                              f"/api/inventory/{rng.choice(unequipped)['inventory_id']}/equip")
+
+        recorder.call(client, 'GET /api/leaderboard', 'GET', '/api/leaderboard?limit=50')
+        recorder.call(client, 'GET /api/profile/<username>', 'GET', f'/api/profile/{rng.choice(usernames)}')
+        recorder.call(client, 'GET /api/my-rank', 'GET', '/api/my-rank')
+
+def run_load(make_client, players, item_ids, sessions, iterations, seed):
+    """Run concurrent sessions (one thread each) and return the samples and wall time"""
+    recorder = Recorder()
+    usernames = [player['username'] for player in players]
+    threads = []
+    for index in range(sessions):
+        rng = random.Random(f'{seed}:{index}')
+        args = (make_client(index), recorder, players[index], usernames, item_ids, iterations, rng)
+        threads.append(threading.Thread(target=run_session, args=args))
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.samples, time.perf_counter() - started
+
+def summarize(samples, seconds):
+    """Reduce samples to overall throughput plus per-endpoint latency and statement counts"""
+    endpoints = {}
+    for label, elapsed, status, statements, db_time in samples:
+        entry = endpoints.setdefault(label, {'latencies': [], 'statements': [], 'db_times': [], 'statuses': {}})
+        entry['latencies'].append(elapsed)
+        if statements is not None:
+            entry['statements'].append(statements)
+        if db_time is not None:
+            entry['db_times'].append(db_time)
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+
+    summary = {}
+    for label, entry in sorted(endpoints.items()):
+        latencies = entry['latencies']
+        counted = entry['statements']
+        db_times = entry['db_times']
+        summary[label] = {
+            'count': len(latencies),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'statements': round(sum(counted) / len(counted), 1) if counted else None,
+            'db_ms': round(sum(db_times) / len(db_times), 2) if db_times else None,
+            'statuses': entry['statuses'],
+        }
+
+    all_latencies = [sample[1] for sample in samples]
+    total = {
+        'requests': len(samples),
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(samples) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(all_latencies, 50), 2),
+        'p95_ms': round(percentile(all_latencies, 95), 2),
+        'p99_ms': round(percentile(all_latencies, 99), 2),
+        'server_errors': sum(1 for sample in samples if sample[2] >= 500),
+    }
+    return total, summary
+
+def print_report(total, endpoints):
+    """Print the per-endpoint table and the totals"""
+    print(f"\n{'endpoint':<34} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'stmts':>6} {'db ms':>7}  statuses")
+    for label, entry in endpoints.items():
+        statements = '-' if entry['statements'] is None else f"{entry['statements']:.1f}"
+        db_time = '-' if entry['db_ms'] is None else f"{entry['db_ms']:.1f}"
+        statuses = ' '.join(f'{code}:{count}' for code, count in sorted(entry['statuses'].items()))
+        print(f"{label:<34} {entry['count']:>6} {entry['p50_ms']:>8.1f} {entry['p95_ms']:>8.1f} "
+              f"{entry['p99_ms']:>8.1f} {statements:>6} {db_time:>7}  {statuses}")
+    print(f"\n✓ {total['requests']} requests in {total['seconds']:.1f}s "
+          f"({total['requests_per_second']:.1f}/s), p50={total['p50_ms']:.1f} ms "
+          f"p95={total['p95_ms']:.1f} ms p99={total['p99_ms']:.1f} ms, {total['server_errors']} server errors")
+
+def change(before, after):
+    """Format the relative change between two numbers"""
+    if not before:
+        return '    n/a'
+    return f'{(after - before) / before * 100:+6.1f}%'
+
+def compare(baseline, total, endpoints):
+    """Print how this run differs from a saved baseline run"""
+    print(f"\nvs baseline ({baseline['meta']['mode']}, {baseline['meta']['sessions']} sessions):")
+    print(f"{'endpoint':<34} {'p50':>8} {'p95':>8} {'p99':>8} {'stmts':>7}")
+    for label, entry in endpoints.items():
+        before = baseline['endpoints'].get(label)
+        if before is None:
+            print(f"{label:<34} (not in baseline)")
+            continue
+        if entry['statements'] is None or before['statements'] is None:
+            statements = '-'
+        else:
+            statements = f"{entry['statements'] - before['statements']:+.1f}"
+        print(f"{label:<34} {change(before['p50_ms'], entry['p50_ms']):>8} {change(before['p95_ms'], entry['p95_ms']):>8} "
+              f"{change(before['p99_ms'], entry['p99_ms']):>8} {statements:>7}")
+    print(f"{'throughput':<34} {change(baseline['total']['requests_per_second'], total['requests_per_second']):>8}")
+
+def free_port():
+    """Ask the OS for an unused local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(database_path, workers):
+    """Start gunicorn on the seeded database and wait until it answers; returns (process, base URL)"""
+    port = free_port()
+    env = dict(os.environ,
+               DATABASE_PATH=database_path,
+               DB_TRACE='1',
+               DB_TRACE_HEADERS='1',
+               # Every session logs in from 127.0.0.1, so lift the per-address login limit
+               LOGIN_IP_BURST=os.environ.get('LOGIN_IP_BURST', '100000'),
+               # Workers must agree on the session signing key
+               SECRET_KEY=os.environ.get('SECRET_KEY', 'load-test-secret'))
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '--chdir', ROOT, '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning']
+    process = subprocess.Popen(command, env=env)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"✗ gunicorn exited with status {process.returncode}")
+        try:
+            with urlopen(base_url + '/robots.txt', timeout=1):
+                return process, base_url
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("✗ gunicorn did not start within 30s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent player sessions')
+    parser.add_argument('--iterations', type=int, default=20, help='script loops per session')
+    parser.add_argument('--players', type=int, default=1000, help='fixture players seeded before the run')
+    parser.add_argument('--history', type=int, default=20, help='quests seeded per player')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help="storage target (default: a file in the temp dir; ':memory:' in-process only)")
+    parser.add_argument('--gunicorn', action='store_true', help='run against a local gunicorn instead of in-process')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a JSON file from an earlier run')
+    args = parser.parse_args()
+
+    if args.sessions > args.players:
+        parser.error('--players must be at least --sessions')
+
+    # Output and baseline paths are relative to where the benchmark was started
+    output = args.output and os.path.abspath(args.output)
+    baseline = args.baseline and os.path.abspath(args.baseline)
+    os.chdir(tempfile.mkdtemp(prefix='quest_master_bench_'))
+    database_path = args.database or os.path.abspath('quest_master.db')
+    if args.gunicorn and database_path == ':memory:':
+        parser.error('gunicorn workers cannot share an in-memory database')
+    # Read at import time, so set before the app and database modules load
+    os.environ['DATABASE_PATH'] = database_path
+    os.environ['DB_TRACE'] = '1'
+    os.environ['DB_TRACE_HEADERS'] = '1'
+
+    import database
+    import fixtures
+
+    database.init_db()
+    started = time.perf_counter()
+    players = fixtures.load_fixtures(args.players, args.history, seed=args.seed)
+    print(f"🌱 Seeded {len(players)} players in {time.perf_counter() - started:.1f}s")
+    # Cheap items only, so purchases mostly succeed on fixture gold
+    item_ids = [item['id'] for item in database.get_all_items()][:5]
+
+    process = None
+    if args.gunicorn:
+        process, base_url = start_gunicorn(database_path, args.workers)
+        make_client = lambda index: HttpClient(base_url)
+        mode = f'gunicorn x{args.workers}'
+    else:
+        import app as app_module
+        make_client = lambda index: InProcessClient(app_module.app, f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}')
+        mode = 'in-process'
+
+    print(f"🏃 {args.sessions} sessions x {args.iterations} iterations ({mode})")
+    try:
+        samples, seconds = run_load(make_client, players, item_ids, args.sessions, args.iterations, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    total, endpoints = summarize(samples, seconds)
+    print_report(total, endpoints)
+
+    results = {
+        'meta': {
+            'mode': mode,
+            'sessions': args.sessions,
+            'iterations': args.iterations,
+            'players': args.players,
+            'history': args.history,
+            'seed': args.seed,
+            'database': args.database or 'file',
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+
+    if baseline:
+        with open(baseline) as f:
+            compare(json.load(f), total, endpoints)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {output}")
+
+if __name__ == '__main__':
+    main()
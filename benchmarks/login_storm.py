@@ -0,0 +1,113 @@
+"""
+Login storm benchmark
+Measures game endpoint latency while attacker threads hammer /api/login,
+first with unbounded inline hashing and then with the bounded hashing pool
+and login admission control.
+
+Usage: python benchmarks/login_storm.py [--attackers 32] [--players 4] [--duration 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_phase(app, label, attackers, players, duration):
+    """Run one storm and return game-endpoint latencies plus login outcomes"""
+    stop = threading.Event()
+    latencies = []
+    login_statuses = {}
+    lock = threading.Lock()
+
+    def attacker(index):
+        client = app.test_client()
+        # Spread attackers over a few source addresses and usernames
+        environ = {'REMOTE_ADDR': f'10.0.0.{index % 8}'}
+        while not stop.is_set():
+            response = client.post('/api/login', json={'username': f'victim{index % 4}', 'password': 'wrong-password'},
+                                   environ_base=environ)
+            with lock:
+                login_statuses[response.status_code] = login_statuses.get(response.status_code, 0) + 1
+
+    def player(index):
+        client = app.test_client()
+        client.post('/api/login', json={'username': f'player{index}', 'password': 'password'},
+                    environ_base={'REMOTE_ADDR': f'192.168.0.{index}'})
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/api/character')
+            client.get('/api/quests')
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=attacker, args=(i,)) for i in range(attackers)]
+    threads += [threading.Thread(target=player, args=(i,)) for i in range(players)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"\n{label}")
+    print(f"  game requests: {len(latencies)} ({len(latencies) / duration:.1f}/s)")
+    print(f"  game latency ms: p50={percentile(latencies, 50):.1f} p95={percentile(latencies, 95):.1f} "
+          f"p99={percentile(latencies, 99):.1f}")
+    print(f"  login responses: {dict(sorted(login_statuses.items()))}")
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attackers', type=int, default=32)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--method', default=None, help='werkzeug hash method (default: PASSWORD_HASH_METHOD)')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='quest_master_bench_'))
+    import password_hashing
+    import app as app_module
+    import database as db
+
+    if args.method:
+        password_hashing.configure(method=args.method)
+
+    for i in range(4):
+        db.create_user(f'victim{i}', 'password')
+    for i in range(args.players):
+        user = db.create_user(f'player{i}', 'password')
+        db.create_character_for_user(user['id'], f'Player {i}')
+
+    app = app_module.app
+    limits = (password_hashing.ip_limiter.capacity, password_hashing.username_limiter.capacity)
+
+    # Baseline: effectively unbounded hashing concurrency and no admission control
+    password_hashing.configure(workers=args.attackers, queue_limit=args.attackers * 4)
+    password_hashing.ip_limiter.capacity = password_hashing.username_limiter.capacity = float('inf')
+    baseline = run_phase(app, 'unbounded inline hashing', args.attackers, args.players, args.duration)
+
+    # Protected: bounded pool plus token-bucket admission
+    password_hashing.configure(workers=int(os.environ.get('HASH_WORKERS', 2)),
+                               queue_limit=int(os.environ.get('HASH_QUEUE_LIMIT', 4)))
+    password_hashing.ip_limiter.capacity, password_hashing.username_limiter.capacity = limits
+    password_hashing.ip_limiter.buckets.clear()
+    password_hashing.username_limiter.buckets.clear()
+    protected = run_phase(app, 'bounded pool + admission control', args.attackers, args.players, args.duration)
+
+    print(f"\np99 game latency: {percentile(baseline, 99):.1f} ms -> {percentile(protected, 99):.1f} ms")
+
+if __name__ == '__main__':
+    main()
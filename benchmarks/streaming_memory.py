@@ -0,0 +1,57 @@
+"""
+Streaming response memory benchmark
+Compares peak Python memory for serving a large quest list with jsonify
+(fetchall, list of dicts, one big string) against the streaming path
+(fetchmany, rows encoded straight to chunks).
+
+Usage: python benchmarks/streaming_memory.py [--rows 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def measure(label, build_response):
+    """Build a response and drain its body, reporting peak traced memory"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = build_response()
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {peak / 1024 / 1024:>10.1f} {size / 1024 / 1024:>10.1f} {elapsed:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='quest_master_bench_'))
+    from flask import jsonify
+    import app as app_module
+    import database as db
+    import json_stream
+
+    conn = db.get_db()
+    conn.executemany('''
+        INSERT INTO quest (user_id, title, description, difficulty, xp_reward, gold_reward)
+        VALUES (1, ?, ?, 'medium', 50, 25)
+    ''', ((f'Quest {i}', f'Description for quest number {i}') for i in range(args.rows)))
+    conn.commit()
+    conn.close()
+
+    print(f"{'path':<10} {'peak MiB':>10} {'body MiB':>10} {'seconds':>8}")
+    with app_module.app.test_request_context():
+        measure('jsonify', lambda: jsonify(db.get_all_quests(1)))
+        measure('streaming', lambda: json_stream.stream_rows(*db.iter_all_quests(1)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Write throughput benchmark
+Compares commits per second and write calls per second for the direct write
+path (every helper commits on its own) against the group-commit writer queue
+in latency-first and throughput-first modes. The "+unit" rows wrap every write in
+its own shared_connection(transactional=True), the way requests with an
+Idempotency-Key, /api/batch and /api/sync run: those units commit on the calling
+thread whatever the write mode.
+
+Usage: python benchmarks/write_throughput.py [--threads 16] [--ops 200]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def run_mode(mode, threads, ops, character_ids, units=False):
+    """Hammer the write helpers from many threads under one write mode
+    
+    Args:
+        units: run each write in its own transactional scope, like an idempotent request
+    """
+    import database as db
+    import database_social as social
+    import database_writer
+
+    database_writer.configure(mode)
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+
+    def write(user_id, op):
+        if op % 2:
+            social.increment_quest_counter(user_id)
+        else:
+            db.create_quest(user_id, f'Bench quest {op}', difficulty='easy')
+
+    def worker(index):
+        user_id = character_ids[index % len(character_ids)]
+        for op in range(ops):
+            try:
+                if units:
+                    def unit():
+                        with db.shared_connection(transactional=True):
+                            write(user_id, op)
+                    database_writer.run_with_busy_retry('unit', unit)
+                else:
+                    write(user_id, op)
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors['locked' if 'locked' in str(e) else 'other'] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    write_queue = database_writer.get_write_queue()
+    total = threads * ops
+    if write_queue and not units:
+        commits = write_queue.stats['commits']
+    else:
+        commits = total - errors['locked'] - errors['other']
+    label = f'{mode}+unit' if units else mode
+    print(f"{label:<16} {total / elapsed:>10.0f} {commits / elapsed:>10.0f} {total / max(commits, 1):>10.1f} "
+          f"{errors['locked']:>8} {elapsed:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=200, help='write calls per thread')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='quest_master_bench_'))
+    import database as db
+    db.init_db()
+
+    # Demo user's character plus a few more, so writes spread over several rows
+    character_ids = [1]
+    for i in range(3):
+        user = db.insert_user(f'writer{i}', 'unused-hash')
+        character_ids.append(db.create_character_for_user(user['id'], f'Writer {i}')['id'])
+
+    print(f"{'mode':<16} {'writes/s':>10} {'commits/s':>10} {'per commit':>10} {'locked':>8} {'seconds':>8}")
+    for mode in ('direct', 'latency', 'throughput'):
+        run_mode(mode, args.threads, args.ops, character_ids)
+    for mode in ('direct', 'throughput'):
+        run_mode(mode, args.threads, args.ops, character_ids, units=True)
+    
+    import database_writer
+    print(f"\n{'call site':<28} {'calls':>8} {'retries':>8} {'failures':>8} {'wait s':>8} {'max wait':>8}")
+    for call_site, stats in sorted(database_writer.contention_stats().items()):
+        print(f"{call_site:<28} {stats['calls']:>8} {stats['retries']:>8} {stats['failures']:>8} "
+              f"{stats['lock_wait_seconds']:>8.2f} {stats['max_lock_wait_seconds']:>8.3f}")
+
+if __name__ == '__main__':
+    main()
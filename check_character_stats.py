@@ -0,0 +1,46 @@
+"""
+Character Stats Checker
+Recomputes every character's stats from level and equipped items and reports
+any drift from the incrementally maintained values. Pass --fix to repair.
+
+Usage: python check_character_stats.py [--fix]
+"""
+import json
+import sys
+
+import database as db
+
+fix = '--fix' in sys.argv
+
+conn = db.get_db()
+cursor = conn.cursor()
+cursor.execute('SELECT id, name, level, attack, defense, max_health, health, equipment_slots FROM character')
+characters = [dict(row) for row in cursor.fetchall()]
+
+drifted = []
+for char in characters:
+    expected = db.expected_character_stats(cursor, char['id'], char['level'])
+    issues = []
+
+    for stat in ('attack', 'defense', 'max_health'):
+        if char[stat] != expected[stat]:
+            issues.append(f"{stat} {char[stat]} != {expected[stat]}")
+    if char['health'] > expected['max_health']:
+        issues.append(f"health {char['health']} > max_health {expected['max_health']}")
+
+    # A NULL map is fine: it's rebuilt from inventory on the next equip
+    if char['equipment_slots'] is not None and json.loads(char['equipment_slots']) != expected['equipment_slots']:
+        issues.append(f"equipment_slots {char['equipment_slots']} != {json.dumps(expected['equipment_slots'])}")
+
+    if issues:
+        drifted.append(char['id'])
+        print(f"✗ Character {char['id']} ({char['name']}): {'; '.join(issues)}")
+conn.close()
+
+if fix and drifted:
+    for character_id in drifted:
+        db.recalculate_character_stats(character_id)
+    print(f"\n✓ Recalculated stats for {len(drifted)} characters")
+
+print(f"\n{'✗' if drifted else '✓'} {len(characters)} characters checked, {len(drifted)} with drift")
+sys.exit(1 if drifted and not fix else 0)
@@ -1,27 +1,790 @@
+import fcntl
+import json
+import os
 import sqlite3
 import random
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from urllib.request import pathname2url
+from database_writer import db_write, is_busy_error, run_with_busy_retry
+import metrics
 
-DATABASE_NAME = 'quest_master.db'
+# Storage target: a file path (a tmpfs one such as /dev/shm/quest_master.db keeps disk I/O out
+# of benchmarks), or ':memory:' for a shared-cache in-memory database that lives as long as the
+# process; change it at runtime with configure_storage()
+DATABASE_NAME = os.environ.get('DATABASE_PATH', 'quest_master.db')
+MEMORY_DATABASE = ':memory:'
+# Seconds sqlite's own busy handler waits for a lock before raising SQLITE_BUSY;
+# kept short so database_writer's jittered retries do the longer waiting
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 1.0))
+# Seconds a recorded response stays replayable for its idempotency key
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+# Seconds offline actions applied through /api/sync stay recorded (0: kept for good).
+# A client may replay its queue long after going offline; once a record is gone
+# the action would be applied again
+SYNC_ACTION_TTL = int(os.environ.get('SYNC_ACTION_TTL', 0))
+SYNC_KEY_PREFIX = 'sync:'
+# Rows fetched per fetchmany() call when streaming a query
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+# When set, wal_archive.py ships WAL frames here and is the only connection that checkpoints
+WAL_ARCHIVE_DIR = os.environ.get('WAL_ARCHIVE_DIR', '')
+# Per-month databases holding completed quests and battles moved out by archive_records.py
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+# Columns copied to the archive, and the date that picks an archived row's month
+ARCHIVE_COLUMNS = {
+    'quest': ('id', 'user_id', 'title', 'description', 'difficulty', 'xp_reward', 'gold_reward',
+              'completed', 'created_at', 'completed_at'),
+    'battle': ('id', 'character_id', 'monster_name', 'monster_level', 'won', 'xp_gained', 'gold_gained', 'battled_at'),
+}
+ARCHIVE_DATE_COLUMNS = {'quest': 'completed_at', 'battle': 'battled_at'}
+# SQLite attaches at most 10 databases per connection by default
+ARCHIVE_MAX_ATTACHED = 10
+# Public read-only routes read this snapshot copy of the database when set (otherwise the
+# live file, opened read-only); it's recopied once it's DB_REPLICA_REFRESH seconds old
+DB_REPLICA_PATH = os.environ.get('DB_REPLICA_PATH', '')
+DB_REPLICA_REFRESH = float(os.environ.get('DB_REPLICA_REFRESH', 10))
+# Optional sharded layout: with DB_SHARDS > 0, user-owned rows live in DB_SHARDS files chosen
+# by user_id hash, and catalog tables in one shared file attached to every connection as 'catalog'
+DB_SHARDS = int(os.environ.get('DB_SHARDS', 0))
+DB_SHARD_DIR = os.environ.get('DB_SHARD_DIR', 'shards')
+# Each shard's AUTOINCREMENT ids start at shard * SHARD_ID_SPACE, so ids stay unique across shards
+SHARD_ID_SPACE = 1 << 40
+# Trace the SQL each request runs: statement count, DB time and repeated statements (see app.py)
+DB_TRACE = os.environ.get('DB_TRACE', '') == '1'
+# A statement run this many times in one request is reported as repeated (a likely N+1)
+DB_TRACE_REPEAT_THRESHOLD = int(os.environ.get('DB_TRACE_REPEAT_THRESHOLD', 3))
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_NAME)
+# Columns each read endpoint may project with ?fields=
+FIELD_WHITELISTS = {
+    'quest': ('id', 'user_id', 'title', 'description', 'difficulty', 'xp_reward', 'gold_reward',
+              'completed', 'created_at', 'completed_at'),
+    'character': ('id', 'user_id', 'name', 'level', 'xp', 'gold', 'health', 'max_health', 'attack', 'defense',
+                  'combo_count', 'last_quest_completed', 'created_at', 'character_class', 'avatar_id',
+                  'color_theme', 'bio', 'public_profile', 'total_quests_completed', 'total_monsters_defeated',
+                  'xp_to_next_level'),
+    'item': ('id', 'name', 'description', 'type', 'price', 'attack_bonus', 'defense_bonus', 'health_bonus', 'rarity'),
+    'battle': ('id', 'character_id', 'monster_name', 'monster_level', 'won', 'xp_gained', 'gold_gained', 'battled_at'),
+    'leaderboard': ('rank', 'character_id', 'name', 'level', 'xp', 'gold', 'character_class', 'avatar_id',
+                    'color_theme', 'total_quests', 'total_monsters', 'username', 'created_at'),
+}
+
+def select_columns(resource: str, fields: Optional[List[str]] = None, prefix: str = '') -> str:
+    """Build a SELECT column list from whitelisted fields (all of them when fields is None)"""
+    columns = fields or FIELD_WHITELISTS[resource]
+    for field in columns:
+        if field not in FIELD_WHITELISTS[resource]:
+            raise ValueError(f"Unknown {resource} field: {field}")
+    return ', '.join(prefix + field for field in columns)
+
+# Per-thread connection shared by every get_db() call inside a connection scope
+_local = threading.local()
+
+class ScopedConnection(sqlite3.Connection):
+    """Connection whose close() (and commit() in a transaction) is deferred while a scope owns it"""
+    
+    def close(self):
+        if getattr(_local, 'conn', None) is self:
+            return
+        super().close()
+    
+    def commit(self):
+        if getattr(_local, 'conn', None) is self and _local.transactional:
+            return
+        super().commit()
+    
+    def cursor(self, factory=None):
+        # Record statements while this thread is tracing
+        trace = getattr(_local, 'trace', None)
+        if trace is not None and factory is None:
+            return super().cursor(lambda conn: TracedCursor(conn, trace))
+        return super().cursor(factory or sqlite3.Cursor)
+    
+    def execute(self, sql, parameters=()):
+        # The C shortcut skips cursor(), so route it there while tracing
+        if getattr(_local, 'trace', None) is not None:
+            return self.cursor().execute(sql, parameters)
+        return super().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        if getattr(_local, 'trace', None) is not None:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        return super().executemany(sql, seq_of_parameters)
+
+# Statement tracing
+class StatementTrace:
+    """SQL run on one thread while the trace is active: statement count, DB time and per-statement repeats"""
+    
+    def __init__(self, parent: Optional['StatementTrace'] = None):
+        self.parent = parent
+        self.statements = 0
+        self.db_time = 0.0
+        self.counts: Dict[str, int] = {}
+    
+    def record(self, sql: str, elapsed: float):
+        """Count one executed statement (and pass it up to the enclosing trace)"""
+        self.statements += 1
+        self.db_time += elapsed
+        pattern = statement_pattern(sql)
+        self.counts[pattern] = self.counts.get(pattern, 0) + 1
+        if self.parent is not None:
+            self.parent.record(sql, elapsed)
+    
+    def add_time(self, elapsed: float):
+        """Add time spent fetching rows of an already-counted statement"""
+        self.db_time += elapsed
+        if self.parent is not None:
+            self.parent.add_time(elapsed)
+    
+    def repeated(self, threshold: int = DB_TRACE_REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """Statements run at least threshold times, most repeated first"""
+        return sorted(((sql, count) for sql, count in self.counts.items() if count >= threshold),
+                      key=lambda item: -item[1])
+    
+    def summary(self) -> Dict[str, Any]:
+        """Get the trace as a JSON-friendly dict"""
+        return {
+            'statements': self.statements,
+            'db_ms': round(self.db_time * 1000, 2),
+            'repeated': [{'sql': sql, 'count': count} for sql, count in self.repeated()],
+        }
+
+def statement_pattern(sql: str) -> str:
+    """Normalize a statement so repeats with different inlined numbers compare equal"""
+    return re.sub(r'\b\d+\b', '?', ' '.join(sql.split()))
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that records its statements and the time spent running and fetching them
+    
+    Recorded here rather than with set_trace_callback, which reports every trigger
+    step again under the triggering statement's text.
+    """
+    
+    def __init__(self, conn, trace: StatementTrace):
+        super().__init__(conn)
+        self.trace = trace
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.trace.record(sql, time.perf_counter() - started)
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.trace.record(sql, time.perf_counter() - started)
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self.trace.add_time(time.perf_counter() - started)
+    
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            self.trace.add_time(time.perf_counter() - started)
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.trace.add_time(time.perf_counter() - started)
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            self.trace.add_time(time.perf_counter() - started)
+
+def current_trace() -> Optional[StatementTrace]:
+    """Get the trace recording this thread's statements, if any"""
+    return getattr(_local, 'trace', None)
+
+def start_trace() -> StatementTrace:
+    """Start recording this thread's statements; an enclosing trace still sees them"""
+    trace = StatementTrace(parent=current_trace())
+    _local.trace = trace
+    return trace
+
+def stop_trace(trace: StatementTrace) -> StatementTrace:
+    """Stop recording into trace and go back to the enclosing one"""
+    _local.trace = trace.parent
+    return trace
+
+@contextmanager
+def statement_budget(limit: int, label: str = 'block'):
+    """Test helper: fail with AssertionError if the block runs more than limit statements
+    
+    Wrap a test-client request to hold an endpoint to its query budget:
+    
+        with db.statement_budget(12, 'POST /api/battle'):
+            client.post('/api/battle', json={'monster_name': 'Goblin'})
+    """
+    trace = start_trace()
+    try:
+        yield trace
+    finally:
+        stop_trace(trace)
+    if trace.statements > limit:
+        repeats = ', '.join(f'{count}x {sql[:80]}' for sql, count in trace.repeated(2)) or 'none'
+        raise AssertionError(f'{label} ran {trace.statements} statements (budget {limit}); repeated: {repeats}')
+
+# Storage target
+_memory_anchor = None
+
+def is_memory_storage() -> bool:
+    """Check whether the configured storage target is the shared in-memory database"""
+    return DATABASE_NAME == MEMORY_DATABASE
+
+def storage_uri(read_only: bool = False) -> str:
+    """Get the SQLite URI of the configured storage target"""
+    global _memory_anchor
+    if is_memory_storage():
+        # A shared-cache memory database is dropped with its last connection, so one stays open
+        uri = f'file:quest_master_{os.getpid()}?mode=memory&cache=shared'
+        if _memory_anchor is None:
+            _memory_anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        return uri
+    uri = f'file:{pathname2url(os.path.abspath(DATABASE_NAME))}'
+    return f'{uri}?mode=ro' if read_only else uri
+
+def configure_storage(path: str):
+    """Point this process at another storage target (a file path or ':memory:'); call init_db() next
+    
+    Switching away from (or back to) ':memory:' starts a fresh empty in-memory database.
+    """
+    global DATABASE_NAME, _memory_anchor, _item_catalog
+    if _memory_anchor is not None:
+        _memory_anchor.close()
+        _memory_anchor = None
+    DATABASE_NAME = path
+    _item_catalog = None
+
+# Shard routing
+def catalog_path() -> str:
+    """Path of the shared catalog database (sharded layout)"""
+    return os.path.join(DB_SHARD_DIR, 'catalog.db')
+
+def shard_path(shard: int) -> str:
+    """Path of one shard's database (sharded layout)"""
+    return os.path.join(DB_SHARD_DIR, f'shard_{shard:02d}.db')
+
+def shard_for_user(user_id: int) -> int:
+    """Pick a user's shard; crc32 rather than hash() so every process agrees"""
+    return zlib.crc32(str(user_id).encode()) % DB_SHARDS
+
+def current_shard(shard_key: Optional[int] = None) -> int:
+    """Resolve a shard key (a user id) to a shard, defaulting to this thread's request user"""
+    if not DB_SHARDS:
+        return 0
+    if shard_key is None:
+        shard_key = getattr(_local, 'shard_key', None)
+    return 0 if shard_key is None else shard_for_user(shard_key)
+
+def set_shard_key(user_id: Optional[int]):
+    """Route this thread's unkeyed get_db() calls to a user's shard (None: the first shard)"""
+    _local.shard_key = user_id
+
+@contextmanager
+def shard_scope(user_id: Optional[int]):
+    """Route unkeyed get_db() calls in this block to a user's shard"""
+    previous = getattr(_local, 'shard_key', None)
+    _local.shard_key = user_id
+    try:
+        yield
+    finally:
+        _local.shard_key = previous
+
+def catalog_uri() -> str:
+    """URI that attaches the catalog read-only"""
+    return f'file:{pathname2url(os.path.abspath(catalog_path()))}?mode=ro'
+
+def open_catalog_connection():
+    """Open a writable connection to the catalog (sharded layout)
+    
+    Shard connections attach the catalog read-only: BEGIN IMMEDIATE takes the
+    write lock on every attached database, so a writable attach would put every
+    shard's writers back behind one lock. Catalog writes come through here instead.
+    """
+    conn = sqlite3.connect(catalog_path(), timeout=DB_BUSY_TIMEOUT, factory=ScopedConnection)
+    conn.row_factory = sqlite3.Row
+    metrics.inc('db_connections_opened_total', kind='catalog')
+    return conn
+
+def open_connection(shard_key: Optional[int] = None, shard: Optional[int] = None):
+    """Open a new database connection, outside any connection scope
+    
+    Sharded, it opens the shard for shard_key (or the given shard number) with the
+    catalog attached read-only; unqualified catalog table names resolve there
+    because shard files don't have those tables.
+    """
+    if not DB_SHARDS:
+        conn = sqlite3.connect(storage_uri(), uri=True, timeout=DB_BUSY_TIMEOUT, factory=ScopedConnection)
+    else:
+        path = shard_path(current_shard(shard_key) if shard is None else shard)
+        conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}', uri=True,
+                               timeout=DB_BUSY_TIMEOUT, factory=ScopedConnection)
+        conn.execute('ATTACH DATABASE ? AS catalog', (catalog_uri(),))
     conn.row_factory = sqlite3.Row
+    if WAL_ARCHIVE_DIR and not DB_SHARDS:
+        conn.execute('PRAGMA wal_autocheckpoint=0')
+    metrics.inc('db_connections_opened_total', kind='write')
     return conn
 
+def open_read_connection(shard_key: Optional[int] = None, shard: Optional[int] = None):
+    """Open a read-only connection: to the snapshot replica when there is one, else the live file"""
+    if DB_SHARDS:
+        path = shard_path(current_shard(shard_key) if shard is None else shard)
+        uri = f'file:{pathname2url(os.path.abspath(path))}?mode=ro'
+    elif DB_REPLICA_PATH and os.path.exists(DB_REPLICA_PATH):
+        # The snapshot is only ever replaced by rename, never modified, so it needs no locking
+        uri = f'file:{pathname2url(os.path.abspath(DB_REPLICA_PATH))}?mode=ro&immutable=1'
+    else:
+        # Memory storage can't also be opened mode=ro; query_only still stops writes
+        uri = storage_uri(read_only=True)
+    conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT, factory=ScopedConnection)
+    conn.row_factory = sqlite3.Row
+    if DB_SHARDS:
+        conn.execute('ATTACH DATABASE ? AS catalog', (catalog_uri(),))
+    conn.execute('PRAGMA query_only = 1')
+    metrics.inc('db_connections_opened_total', kind='read')
+    return conn
+
+def open_private_connection(shard_key: Optional[int] = None, shard: Optional[int] = None):
+    """Open a connection of the kind this thread reads with (read-only inside replica_reads())"""
+    if getattr(_local, 'read_only', False):
+        return open_read_connection(shard_key, shard)
+    return open_connection(shard_key, shard)
+
+def get_db(shard_key: Optional[int] = None):
+    """Get database connection (the scope's shared one inside shared_connection(),
+    a read-only one inside replica_reads())
+    
+    Args:
+        shard_key: user id whose shard to use when sharded (default: this thread's request user)
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and (shard_key is None or current_shard(shard_key) == _local.scope_shard):
+        return conn
+    return open_private_connection(shard_key)
+
+@contextmanager
+def replica_reads():
+    """Serve this thread's get_db() calls from read-only connections, the snapshot replica when configured
+    
+    Anything that tries to write inside fails with 'attempt to write a readonly database'.
+    """
+    previous = getattr(_local, 'read_only', False)
+    _local.read_only = True
+    try:
+        yield
+    finally:
+        _local.read_only = previous
+
+# Snapshot replica
+_replica_stats = {'refreshes': 0, 'failures': 0, 'last_copy_seconds': 0.0}
+
+def replica_lag() -> Optional[float]:
+    """Seconds since the replica's snapshot was taken (None when reads go to the live file)"""
+    if not DB_REPLICA_PATH:
+        return None
+    try:
+        # The snapshot's mtime is set to the moment the copy started
+        return max(0.0, time.time() - os.path.getmtime(DB_REPLICA_PATH))
+    except OSError:
+        return None
+
+def replica_status() -> Dict[str, Any]:
+    """Get the replica's lag and this process's refresh counters"""
+    return {'replica': DB_REPLICA_PATH or None, 'lag_seconds': replica_lag(), 'refresh_seconds': DB_REPLICA_REFRESH,
+            **_replica_stats}
+
+def refresh_replica(force: bool = False) -> bool:
+    """Recopy the live database to the replica path if it's due; returns whether this call copied it
+    
+    One process copies at a time (flock), the copy is consistent (online backup API), and
+    it's swapped in by rename, so readers keep their open snapshot until they're done.
+    """
+    with open(DB_REPLICA_PATH + '.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        lag = replica_lag()
+        if not force and lag is not None and lag < DB_REPLICA_REFRESH:
+            return False
+        
+        started = time.time()
+        partial = f'{DB_REPLICA_PATH}.{os.getpid()}.partial'
+        source = sqlite3.connect(storage_uri(), uri=True, timeout=DB_BUSY_TIMEOUT)
+        destination = sqlite3.connect(partial)
+        try:
+            source.backup(destination)
+            # A rollback-journal file needs no -wal/-shm next to it to be opened read-only
+            destination.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            source.close()
+            destination.close()
+        
+        os.utime(partial, (started, started))
+        os.replace(partial, DB_REPLICA_PATH)
+        _replica_stats['refreshes'] += 1
+        _replica_stats['last_copy_seconds'] = time.time() - started
+        return True
+
+_replica_thread = None
+
+def start_replica_refresher():
+    """Keep the snapshot replica fresh from a daemon thread (no-op without DB_REPLICA_PATH or when sharded)"""
+    global _replica_thread
+    if not DB_REPLICA_PATH or DB_SHARDS or _replica_thread is not None:
+        return
+    
+    def run():
+        while True:
+            try:
+                refresh_replica()
+            except (OSError, sqlite3.Error) as e:
+                _replica_stats['failures'] += 1
+                print(f"WARNING: replica refresh failed: {e}")
+            time.sleep(max(0.1, DB_REPLICA_REFRESH / 10))
+    
+    _replica_thread = threading.Thread(target=run, name='db-replica', daemon=True)
+    _replica_thread.start()
+
+def iter_rows(query: str, params: tuple = (), shard_key: Optional[int] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """Run a query and return its column names plus a lazy iterator over plain row tuples
+    
+    The query runs now, so errors surface before a response starts streaming. Rows are
+    fetched STREAM_BATCH_SIZE at a time on a private connection (it outlives any
+    connection scope) that closes once the iterator is exhausted or discarded.
+    
+    Inside a write transaction (a batch, a sync, an idempotent request) the rows are
+    read on the scope's connection and fetched at once instead: a private connection
+    would not see the transaction's uncommitted writes and would wait on its lock.
+    """
+    if in_transaction_scope() and (shard_key is None or current_shard(shard_key) == _local.scope_shard):
+        cursor = _local.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(query, params)
+        return [column[0] for column in cursor.description], iter(cursor.fetchall())
+    
+    conn = open_private_connection(shard_key)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    try:
+        cursor.execute(query, params)
+    except BaseException:
+        conn.close()
+        raise
+    columns = [column[0] for column in cursor.description]
+    
+    def rows():
+        try:
+            while True:
+                batch = cursor.fetchmany(STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            conn.close()
+    return columns, rows()
+
+def archive_path(month: str) -> str:
+    """Path of the archive database for one month ('YYYY-MM')"""
+    return os.path.join(ARCHIVE_DIR, f"quest_master_archive_{month.replace('-', '_')}.db")
+
+def archived_months(cursor, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+    """Get the archived months that overlap the dates [start, end), oldest first"""
+    cursor.execute('''
+        SELECT month FROM archive_month WHERE month >= ? AND month <= ? ORDER BY month
+    ''', ((start or '')[:7], (end or '9999')[:7]))
+    return [row[0] for row in cursor.fetchall()]
+
+def query_range(query: str, params: tuple, start: Optional[str], end: Optional[str] = None,
+                shard_key: Optional[int] = None) -> List[sqlite3.Row]:
+    """Run a query over {quest} and {battle} rows dated in [start, end)
+    
+    Archived months are attached and unioned in only when the range reaches back
+    to them; otherwise the placeholders are just the hot tables.
+    """
+    conn = get_db(shard_key)
+    months = archived_months(conn.cursor(), start, end)
+    if not months:
+        try:
+            return conn.execute(query.format(quest='quest', battle='battle'), params).fetchall()
+        finally:
+            conn.close()
+    conn.close()
+    
+    # The catalog takes an attach slot when sharded
+    max_months = ARCHIVE_MAX_ATTACHED - (2 if DB_SHARDS else 1)
+    if len(months) > max_months:
+        raise ValueError(f"Date range spans {len(months)} archived months; query at most {max_months}")
+    
+    # A private connection: ATTACH can't run inside a scope's open transaction
+    conn = open_private_connection(shard_key)
+    try:
+        schemas = ['main']
+        for month in months:
+            schema = f"archive_{month.replace('-', '_')}"
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (archive_path(month),))
+            schemas.append(schema)
+        
+        sources = {}
+        for table, columns in ARCHIVE_COLUMNS.items():
+            column_list = ', '.join(columns)
+            union = ' UNION ALL '.join(f'SELECT {column_list} FROM {schema}.{table}' for schema in schemas)
+            sources[table] = f'({union})'
+        return conn.execute(query.format(**sources), params).fetchall()
+    finally:
+        conn.close()
+
+def get_archived_totals(cursor, user_id: Optional[int] = None, character_id: Optional[int] = None) -> Dict[str, int]:
+    """Get the quest (by user) and battle (by character) counters of archived rows"""
+    totals = {'quests_completed': 0, 'xp_earned': 0, 'gold_earned': 0, 'battles_won': 0, 'battles_lost': 0}
+    if user_id is not None:
+        cursor.execute('''
+            SELECT quests_completed, xp_earned, gold_earned FROM archived_quest_totals WHERE user_id = ?
+        ''', (user_id,))
+        row = cursor.fetchone()
+        if row:
+            totals.update(dict(row))
+    if character_id is not None:
+        cursor.execute('SELECT battles_won, battles_lost FROM archived_battle_totals WHERE character_id = ?', (character_id,))
+        row = cursor.fetchone()
+        if row:
+            totals.update(dict(row))
+    return totals
+
+@contextmanager
+def shared_connection(transactional: bool = False):
+    """Route every get_db() call in this thread through one connection
+    
+    Args:
+        transactional: defer helper commits and commit once when the scope exits
+            (rolled back if it exits with an exception)
+    """
+    if getattr(_local, 'conn', None) is not None:
+        if not transactional or _local.transactional or _local.conn.in_transaction:
+            # Join the enclosing scope
+            yield _local.conn
+            return
+        # A write inside a read scope: run it as its own transaction on the scope's
+        # connection, so it still takes the write lock up front
+        conn = _local.conn
+        started = time.monotonic()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        finally:
+            _local.lock_wait = time.monotonic() - started
+        _local.transactional = True
+        pending = len(_local.after_commit)
+        try:
+            yield conn
+            _local.transactional = False
+            conn.commit()
+            metrics.inc('db_transactions_total', outcome='commit')
+        except BaseException:
+            _local.transactional = False
+            conn.rollback()
+            metrics.inc('db_transactions_total', outcome='rollback')
+            del _local.after_commit[pending:]
+            raise
+        return
+
+    conn = get_db()
+    _local.conn = conn
+    _local.scope_shard = current_shard()
+    _local.transactional = transactional
+    _local.after_commit = []
+    try:
+        if transactional:
+            # Take the write lock up front: a deferred transaction that later
+            # upgrades can fail with SQLITE_BUSY without the busy handler waiting
+            started = time.monotonic()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            finally:
+                _local.lock_wait = time.monotonic() - started
+        yield conn
+        if transactional:
+            _local.transactional = False
+            conn.commit()
+            metrics.inc('db_transactions_total', outcome='commit')
+    except BaseException:
+        if transactional:
+            # Not counted when BEGIN itself failed (busy): nothing was started
+            if conn.in_transaction:
+                metrics.inc('db_transactions_total', outcome='rollback')
+            conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        _local.transactional = False
+        callbacks, _local.after_commit = _local.after_commit, []
+        conn.close()
+    # Only reached when the scope committed (or never wrote)
+    for callback in callbacks:
+        callback()
+
+def after_commit(callback):
+    """Run callback once this thread's write transaction commits (now, outside one);
+    dropped if the transaction rolls back"""
+    if in_transaction_scope():
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+def last_lock_wait() -> float:
+    """Seconds this thread's last transactional scope waited to take the write lock"""
+    return getattr(_local, 'lock_wait', 0.0)
+
+def in_transaction_scope() -> bool:
+    """Check whether this thread is inside shared_connection(transactional=True)"""
+    return getattr(_local, 'conn', None) is not None and _local.transactional
+
+@contextmanager
+def savepoint(conn, name: str = 'scope'):
+    """Roll back just this block's writes if it raises, keeping the enclosing transaction"""
+    conn.execute(f'SAVEPOINT {name}')
+    pending = len(getattr(_local, 'after_commit', []))
+    try:
+        yield
+    except BaseException:
+        del _local.after_commit[pending:]
+        conn.execute(f'ROLLBACK TO {name}')
+        conn.execute(f'RELEASE {name}')
+        raise
+    conn.execute(f'RELEASE {name}')
+
+# Data versioning
+def bump_data_version(cursor, user_id: Optional[int] = None, character_id: Optional[int] = None):
+    """Advance a user's data version so cached GET responses revalidate"""
+    if user_id is not None:
+        cursor.execute('UPDATE user SET data_version = data_version + 1 WHERE id = ?', (user_id,))
+    elif character_id is not None:
+        cursor.execute('''
+            UPDATE user SET data_version = data_version + 1
+            WHERE id = (SELECT user_id FROM character WHERE id = ?)
+        ''', (character_id,))
+
+def get_data_version(user_id: int) -> Optional[int]:
+    """Get a user's current data version (single primary-key read)"""
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute('SELECT data_version FROM user WHERE id = ?', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row['data_version'] if row else None
+
 def init_db():
     """Initialize the database with all required tables"""
-    conn = get_db()
+    global _item_catalog
+    if DB_SHARDS:
+        init_shards()
+    else:
+        conn = get_db()
+        create_schema(conn)
+        
+        # Create default demo user if no users exist
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM user')
+        if cursor.fetchone()[0] == 0:
+            create_demo_user(conn)
+        conn.close()
+    
+    # Items may have just been seeded
+    _item_catalog = None
+
+def create_catalog_schema(conn):
+    """Create and seed the shared catalog tables (shop items, templates, daily challenges)"""
+    cursor = conn.cursor()
+    
+    # Equipment/Items table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            description TEXT,
+            price INTEGER NOT NULL,
+            attack_bonus INTEGER DEFAULT 0,
+            defense_bonus INTEGER DEFAULT 0,
+            health_bonus INTEGER DEFAULT 0,
+            rarity TEXT DEFAULT 'common'
+        )
+    ''')
+    
+    # Task templates for quick-add
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_template (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            difficulty TEXT DEFAULT 'medium',
+            icon TEXT,
+            category TEXT,
+            popular BOOLEAN DEFAULT 0
+        )
+    ''')
+    
+    # Daily challenges table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_challenge (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            challenge_date DATE NOT NULL,
+            challenge_type TEXT NOT NULL,
+            target_value INTEGER NOT NULL,
+            reward_xp INTEGER NOT NULL,
+            reward_gold INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            icon TEXT NOT NULL,
+            UNIQUE(challenge_date, challenge_type)
+        )
+    ''')
+    
+    conn.commit()
+    
+    # Populate initial items if shop is empty
+    cursor.execute('SELECT COUNT(*) FROM item')
+    if cursor.fetchone()[0] == 0:
+        populate_initial_items(conn)
+    
+    # Populate task templates if empty
+    cursor.execute('SELECT COUNT(*) FROM task_template')
+    if cursor.fetchone()[0] == 0:
+        populate_task_templates(conn)
+
+def create_schema(conn, catalog: bool = True):
+    """Create or migrate every table on a connection; catalog=False leaves out the
+    catalog tables (a shard, which reads them from the attached catalog)"""
     cursor = conn.cursor()
     
+    # WAL lets readers proceed while a writer commits (persists in the file)
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
+            data_version INTEGER DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -63,30 +826,17 @@ def init_db():
         )
     ''')
     
-    # Equipment/Items table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS item (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL,
-            description TEXT,
-            price INTEGER NOT NULL,
-            attack_bonus INTEGER DEFAULT 0,
-            defense_bonus INTEGER DEFAULT 0,
-            health_bonus INTEGER DEFAULT 0,
-            rarity TEXT DEFAULT 'common'
-        )
-    ''')
-    
     # Character inventory
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS inventory (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             character_id INTEGER NOT NULL,
             item_id INTEGER NOT NULL,
-            equipped BOOLEAN DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            equipped_count INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY (character_id) REFERENCES character(id),
-            FOREIGN KEY (item_id) REFERENCES item(id)
+            FOREIGN KEY (item_id) REFERENCES item(id),
+            UNIQUE(character_id, item_id)
         )
     ''')
     
@@ -119,34 +869,6 @@ def init_db():
         )
     ''')
     
-    # Task templates for quick-add
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS task_template (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            difficulty TEXT DEFAULT 'medium',
-            icon TEXT,
-            category TEXT,
-            popular BOOLEAN DEFAULT 0
-        )
-    ''')
-    
-    # Daily challenges table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS daily_challenge (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            challenge_date DATE NOT NULL,
-            challenge_type TEXT NOT NULL,
-            target_value INTEGER NOT NULL,
-            reward_xp INTEGER NOT NULL,
-            reward_gold INTEGER NOT NULL,
-            description TEXT NOT NULL,
-            icon TEXT NOT NULL,
-            UNIQUE(challenge_date, challenge_type)
-        )
-    ''')
-    
     # User daily challenge progress
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_daily_challenge (
@@ -182,21 +904,14 @@ def init_db():
     
     conn.commit()
     
-    # Populate initial items if shop is empty
-    cursor.execute('SELECT COUNT(*) FROM item')
-    if cursor.fetchone()[0] == 0:
-        populate_initial_items(conn)
+    if catalog:
+        create_catalog_schema(conn)
     
     # Populate initial achievements if empty
     cursor.execute('SELECT COUNT(*) FROM achievement')
     if cursor.fetchone()[0] == 0:
         populate_initial_achievements(conn)
     
-    # Populate task templates if empty
-    cursor.execute('SELECT COUNT(*) FROM task_template')
-    if cursor.fetchone()[0] == 0:
-        populate_task_templates(conn)
-    
     # Add new columns to existing character table if they don't exist
     try:
         cursor.execute('ALTER TABLE character ADD COLUMN combo_count INTEGER DEFAULT 0')
@@ -243,25 +958,171 @@ def init_db():
         # Columns already exist
         pass
     
-    # Create default demo user if no users exist
-    cursor.execute('SELECT COUNT(*) FROM user')
-    if cursor.fetchone()[0] == 0:
-        create_demo_user(conn)
+    # Add per-user data version for conditional GETs
+    try:
+        cursor.execute('ALTER TABLE user ADD COLUMN data_version INTEGER DEFAULT 0')
+        conn.commit()
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
     
+    # Add cached equipment-slot map (NULL until first equip rebuilds it from inventory)
+    try:
+        cursor.execute('ALTER TABLE character ADD COLUMN equipment_slots TEXT')
+        conn.commit()
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    
+    # Collapse the old one-row-per-purchase inventory into stacks
+    cursor.execute('PRAGMA table_info(inventory)')
+    if 'quantity' not in [row['name'] for row in cursor.fetchall()]:
+        migrate_inventory_to_stacks(conn)
+    
+    # Indexes for per-user list views; the quest and battle ones cover the common
+    # list columns so a projected list reads no table rows
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_quest_user_list
+        ON quest(user_id, created_at, completed, title, difficulty, xp_reward, gold_reward, completed_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_battle_character_list
+        ON battle(character_id, battled_at, monster_name, monster_level, won, xp_gained, gold_gained)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_character_leaderboard ON character(public_profile, level, xp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_character_user ON character(user_id)')
+    conn.commit()
+    
+    # Delta sync change log (after the inventory rebuild, which drops its triggers)
+    create_change_log(conn)
+    
+    # Idempotency keys and offline actions already applied, so replays return the recorded result
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS applied_request (
+            user_id INTEGER NOT NULL,
+            request_key TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            response TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, request_key)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_applied_request_created ON applied_request(created_at)')
+    conn.commit()
+    
+    # Archival: counters carried over from rows moved to the per-month archives,
+    # which months have archives, and the date indexes the archiver walks
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_quest_totals (
+            user_id INTEGER PRIMARY KEY,
+            quests_completed INTEGER DEFAULT 0,
+            xp_earned INTEGER DEFAULT 0,
+            gold_earned INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_battle_totals (
+            character_id INTEGER PRIMARY KEY,
+            battles_won INTEGER DEFAULT 0,
+            battles_lost INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_month (
+            month TEXT PRIMARY KEY,
+            quests INTEGER DEFAULT 0,
+            battles INTEGER DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_quest_completed_at ON quest(completed_at) WHERE completed = 1')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_battle_battled_at ON battle(battled_at)')
+    conn.commit()
+
+def init_shards():
+    """Initialize the sharded layout: the catalog file, then every shard file"""
+    os.makedirs(DB_SHARD_DIR, exist_ok=True)
+    
+    conn = open_catalog_connection()
+    conn.execute('PRAGMA journal_mode=WAL')
+    create_catalog_schema(conn)
+    
+    # Usernames and user ids for every shard; login looks users up here before
+    # it knows which shard they're on
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_directory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    
+    for shard in range(DB_SHARDS):
+        conn = open_connection(shard=shard)
+        create_schema(conn, catalog=False)
+        
+        # Start the shard's own ids in its slice of the id space (user ids come from the directory)
+        if shard:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM main.sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'")
+            for (table,) in cursor.fetchall():
+                if table != 'user':
+                    cursor.execute('''
+                        INSERT INTO main.sqlite_sequence (name, seq)
+                        SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = ?)
+                    ''', (table, shard * SHARD_ID_SPACE, table))
+            conn.commit()
+        conn.close()
+    
+    # Create default demo user if no users exist
+    conn = open_connection(shard=0)
+    if conn.execute('SELECT COUNT(*) FROM catalog.user_directory').fetchone()[0] == 0:
+        conn.close()
+        user_id = allocate_user_id('user')
+        conn = open_connection(user_id)
+        create_demo_user(conn, user_id)
+    conn.close()
+
+def allocate_user_id(username: str) -> Optional[int]:
+    """Reserve a user id for a username in the directory (sharded layout only);
+    None when the username is taken"""
+    conn = open_catalog_connection()
+    try:
+        cursor = conn.execute('INSERT INTO user_directory (username) VALUES (?)', (username,))
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.IntegrityError:
+        return None
+    finally:
+        conn.close()
+
+def release_user_id(user_id: int):
+    """Give back a directory entry whose user row was never written"""
+    conn = open_catalog_connection()
+    conn.execute('DELETE FROM user_directory WHERE id = ?', (user_id,))
+    conn.commit()
+    conn.close()
+
+def user_id_for_username(username: str) -> Optional[int]:
+    """Look a username up in the directory (sharded layout only)"""
+    conn = open_catalog_connection()
+    row = conn.execute('SELECT id FROM user_directory WHERE username = ?', (username,)).fetchone()
     conn.close()
+    return row[0] if row else None
 
-def create_demo_user(conn):
+def create_demo_user(conn, user_id: Optional[int] = None):
     """Create a default demo user for easy testing"""
-    from werkzeug.security import generate_password_hash
+    from password_hashing import hash_password
     
     cursor = conn.cursor()
     
     # Create demo user: username "user", password "user"
-    password_hash = generate_password_hash("user")
+    password_hash = hash_password("user")
     cursor.execute('''
-        INSERT INTO user (username, password_hash)
-        VALUES (?, ?)
-    ''', ("user", password_hash))
+        INSERT INTO user (id, username, password_hash)
+        VALUES (?, ?, ?)
+    ''', (user_id, "user", password_hash))
     
     user_id = cursor.lastrowid
     
@@ -306,6 +1167,78 @@ def populate_initial_items(conn):
     ''', items)
     conn.commit()
 
+def migrate_inventory_to_stacks(conn):
+    """Rebuild inventory as one (character, item) row with a quantity"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE inventory_stacked (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            character_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            equipped_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (character_id) REFERENCES character(id),
+            FOREIGN KEY (item_id) REFERENCES item(id),
+            UNIQUE(character_id, item_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO inventory_stacked (id, character_id, item_id, quantity, equipped_count)
+        SELECT MIN(id), character_id, item_id, COUNT(*), MIN(SUM(equipped), 1)
+        FROM inventory
+        GROUP BY character_id, item_id
+    ''')
+    cursor.execute('DROP TABLE inventory')
+    cursor.execute('ALTER TABLE inventory_stacked RENAME TO inventory')
+    
+    # Equipped rows may have changed id, so slot maps rebuild on next equip
+    cursor.execute('UPDATE character SET equipment_slots = NULL')
+    conn.commit()
+    print("📦 Migrated inventory to stacked rows")
+
+# Entities delta sync tracks: table -> (entity name, expression for the owning user_id)
+SYNC_ENTITIES = {
+    'quest': ('quest', '{row}.user_id'),
+    'inventory': ('inventory', '(SELECT user_id FROM character WHERE id = {row}.character_id)'),
+    'user_daily_challenge': ('challenge_progress', '{row}.user_id'),
+    'character': ('character', '{row}.user_id'),
+}
+
+def create_change_log(conn):
+    """Create the change log and the triggers that keep it current
+    
+    Each entity keeps one row; re-logging it replaces the row with a new, higher id,
+    so the log stays one row per live (or deleted) entity and ids work as sync tokens.
+    Triggers rather than helper calls, so every write path is covered. The replace is
+    a DELETE plus INSERT because an outer upsert's conflict policy would override
+    INSERT OR REPLACE inside the trigger.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            deleted BOOLEAN DEFAULT 0,
+            UNIQUE(entity, entity_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log(user_id, id)')
+    
+    for table, (entity, owner) in SYNC_ENTITIES.items():
+        for event, row, deleted in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1)):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS log_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    DELETE FROM change_log WHERE entity = '{entity}' AND entity_id = {row}.id;
+                    INSERT INTO change_log (user_id, entity, entity_id, deleted)
+                    VALUES ({owner.format(row=row)}, '{entity}', {row}.id, {deleted});
+                END
+            ''')
+    conn.commit()
+
 def populate_initial_achievements(conn):
     """Add initial achievements"""
     achievements = [
@@ -393,6 +1326,7 @@ def calculate_quest_rewards(difficulty: str) -> tuple:
     return rewards.get(difficulty, rewards['medium'])
 
 # Character operations
+@db_write
 def create_character(name: str) -> Dict[str, Any]:
     """Create a new character"""
     conn = get_db()
@@ -423,6 +1357,26 @@ def get_character(character_id: int = 1) -> Optional[Dict[str, Any]]:
         return char
     return None
 
+def get_character_fields(character_id: int, fields: List[str]) -> Optional[Dict[str, Any]]:
+    """Get only the given (whitelisted) character fields"""
+    computed = 'xp_to_next_level' in fields
+    columns = [field for field in fields if field != 'xp_to_next_level']
+    if computed and 'level' not in columns:
+        columns.append('level')
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {select_columns("character", columns)} FROM character WHERE id = ?', (character_id,))
+    row = cursor.fetchone()
+    conn.close()
+    
+    if not row:
+        return None
+    char = dict(row)
+    if computed:
+        char['xp_to_next_level'] = calculate_xp_for_next_level(char['level'])
+    return {field: char[field] for field in fields}
+
 def get_or_create_character() -> Dict[str, Any]:
     """Get the main character or create if doesn't exist"""
     char = get_character(1)
@@ -430,6 +1384,7 @@ def get_or_create_character() -> Dict[str, Any]:
         char = create_character("Hero")
     return char
 
+@db_write
 def update_character(character_id: int, **kwargs) -> Dict[str, Any]:
     """Update character attributes"""
     conn = get_db()
@@ -446,17 +1401,16 @@ def update_character(character_id: int, **kwargs) -> Dict[str, Any]:
     query = f"UPDATE character SET {', '.join(fields)} WHERE id = ?"
     
     cursor.execute(query, values)
+    bump_data_version(cursor, character_id=character_id)
     conn.commit()
     conn.close()
     
     return get_character(character_id)
 
-def add_xp_and_gold(character_id: int, xp: int, gold: int) -> Dict[str, Any]:
-    """Add XP and gold to character, handle level ups"""
-    char = get_character(character_id)
-    if not char:
-        return None
-    
+def reward_character(cursor, char: Dict[str, Any], xp: int, gold: int) -> Dict[str, Any]:
+    """Add XP and gold to a character row read inside the caller's write transaction,
+    handling level ups; returns the updated row without reading it again"""
+    character_id = char['id']
     old_level = char['level']
     old_xp = char['xp']
     old_gold = char['gold']
@@ -464,6 +1418,7 @@ def add_xp_and_gold(character_id: int, xp: int, gold: int) -> Dict[str, Any]:
     new_xp = char['xp'] + xp
     new_gold = char['gold'] + gold
     new_level = char['level']
+    stat_updates = {}
     
     # Check for level ups
     while new_xp >= calculate_xp_for_next_level(new_level):
@@ -471,50 +1426,71 @@ def add_xp_and_gold(character_id: int, xp: int, gold: int) -> Dict[str, Any]:
         new_level += 1
         
         # Increase stats on level up
-        new_health = char['max_health'] + 10
-        new_attack = char['attack'] + 3
-        new_defense = char['defense'] + 2
-        
-        char = update_character(
-            character_id,
-            level=new_level,
-            max_health=new_health,
-            health=new_health,
-            attack=new_attack,
-            defense=new_defense
-        )
+        new_health = stat_updates.get('max_health', char['max_health']) + 10
+        stat_updates = {
+            'level': new_level,
+            'max_health': new_health,
+            'health': new_health,
+            'attack': stat_updates.get('attack', char['attack']) + 3,
+            'defense': stat_updates.get('defense', char['defense']) + 2
+        }
         
         # Log level up to audit trail
         try:
-            conn = get_db()
-            cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO character_audit_log 
                 (user_id, character_id, event_type, old_level, new_level, old_xp, new_xp, old_gold, new_gold, triggered_by)
-                VALUES ((SELECT user_id FROM character WHERE id = ?), ?, 'LEVEL_UP', ?, ?, ?, ?, ?, ?, 'add_xp_and_gold')
-            ''', (character_id, character_id, old_level, new_level, old_xp, new_xp, old_gold, new_gold))
-            conn.commit()
-            conn.close()
-        except:
-            pass  # Audit table might not exist
+                VALUES (?, ?, 'LEVEL_UP', ?, ?, ?, ?, ?, ?, 'add_xp_and_gold')
+            ''', (char['user_id'], character_id, old_level, new_level, old_xp, new_xp, old_gold, new_gold))
+        except sqlite3.OperationalError as e:
+            # Audit table might not exist; a locked database must still retry
+            if is_busy_error(e):
+                raise
+    
+    updates = dict(stat_updates, xp=new_xp, gold=new_gold)
+    cursor.execute(f"UPDATE character SET {', '.join(f'{key} = ?' for key in updates)} WHERE id = ?",
+                   (*updates.values(), character_id))
+    bump_data_version(cursor, user_id=char['user_id'])
+    
+    char = dict(char, **updates)
+    char['xp_to_next_level'] = calculate_xp_for_next_level(char['level'])
+    return char
+
+@db_write
+def add_xp_and_gold(character_id: int, xp: int, gold: int) -> Dict[str, Any]:
+    """Add XP and gold to character, handle level ups
+    
+    The character is read inside the write transaction: new totals derived from a
+    row loaded earlier (such as the request's cached character) would undo any
+    gold spent in between.
+    """
+    char = get_character(character_id)
+    if not char:
+        return None
     
-    return update_character(character_id, xp=new_xp, gold=new_gold)
+    conn = get_db()
+    char = reward_character(conn.cursor(), char, xp, gold)
+    conn.commit()
+    conn.close()
+    return char
 
 # Quest operations
+@db_write
 def create_quest(user_id: int, title: str, description: str = "", difficulty: str = "medium") -> Dict[str, Any]:
     """Create a new quest"""
     xp_reward, gold_reward = calculate_quest_rewards(difficulty)
     
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     cursor.execute('''
         INSERT INTO quest (user_id, title, description, difficulty, xp_reward, gold_reward)
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (user_id, title, description, difficulty, xp_reward, gold_reward))
+    quest_id = cursor.lastrowid
+    bump_data_version(cursor, user_id=user_id)
     
     conn.commit()
-    quest_id = cursor.lastrowid
     conn.close()
     
     return get_quest(quest_id)
@@ -530,23 +1506,37 @@ def get_quest(quest_id: int) -> Optional[Dict[str, Any]]:
     
     return dict(row) if row else None
 
-def get_all_quests(user_id: int, completed: Optional[bool] = None) -> List[Dict[str, Any]]:
+def all_quests_query(user_id: int, completed: Optional[bool] = None,
+                     fields: Optional[List[str]] = None) -> Tuple[str, tuple]:
+    """Build the query for a user's quests, optionally filtered by completion status and projected to fields"""
+    columns = select_columns('quest', fields) if fields else '*'
+    if completed is None:
+        return f'SELECT {columns} FROM quest WHERE user_id = ? ORDER BY created_at DESC', (user_id,)
+    return f'SELECT {columns} FROM quest WHERE user_id = ? AND completed = ? ORDER BY created_at DESC', (user_id, completed)
+
+def get_all_quests(user_id: int, completed: Optional[bool] = None,
+                   fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """Get all quests for a user, optionally filtered by completion status"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
-    
-    if completed is None:
-        cursor.execute('SELECT * FROM quest WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-    else:
-        cursor.execute('SELECT * FROM quest WHERE user_id = ? AND completed = ? ORDER BY created_at DESC', (user_id, completed))
-    
+    cursor.execute(*all_quests_query(user_id, completed, fields))
     rows = cursor.fetchall()
     conn.close()
     
     return [dict(row) for row in rows]
 
+def iter_all_quests(user_id: int, completed: Optional[bool] = None,
+                    fields: Optional[List[str]] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """Stream a user's quests as (columns, row tuples), for responses too large to build in memory"""
+    return iter_rows(*all_quests_query(user_id, completed, fields), shard_key=user_id)
+
+@db_write
 def complete_quest(quest_id: int, character_id: int = 1, user_id: int = None) -> Dict[str, Any]:
-    """Mark quest as completed and reward character with enhanced rewards"""
+    """Mark quest as completed and reward character with enhanced rewards
+    
+    Combo and crit are worked out from the character as read inside the write
+    transaction, never from a copy the caller loaded earlier.
+    """
     quest = get_quest(quest_id)
     if not quest or quest['completed']:
         return None
@@ -624,13 +1614,16 @@ def complete_quest(quest_id: int, character_id: int = 1, user_id: int = None) ->
         UPDATE character SET combo_count = ?, last_quest_completed = ?
         WHERE id = ?
     ''', (combo_count, current_time, character_id))
+    bump_data_version(cursor, user_id=user_id, character_id=character_id)
+    char = dict(char, combo_count=combo_count, last_quest_completed=current_time)
+    
+    # Reward character, then unlock achievements, from the row read above
+    char = reward_character(cursor, char, final_xp, final_gold)
+    newly_unlocked = unlock_earned_achievements(cursor, char)
     
     conn.commit()
     conn.close()
     
-    # Reward character
-    char = add_xp_and_gold(character_id, final_xp, final_gold)
-    
     # Update daily challenge progress
     if user_id:
         update_challenge_progress(user_id, 'complete_quests', 1)
@@ -648,6 +1641,7 @@ def complete_quest(quest_id: int, character_id: int = 1, user_id: int = None) ->
     return {
         'quest': get_quest(quest_id),
         'character': char,
+        'newly_unlocked_achievements': newly_unlocked,
         'rewards': {
             'xp': final_xp,
             'gold': final_gold,
@@ -665,16 +1659,162 @@ def complete_quest(quest_id: int, character_id: int = 1, user_id: int = None) ->
         }
     }
 
+@db_write
 def delete_quest(quest_id: int) -> bool:
     """Delete a quest"""
     conn = get_db()
     cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE user SET data_version = data_version + 1
+        WHERE id = (SELECT user_id FROM quest WHERE id = ?)
+    ''', (quest_id,))
     cursor.execute('DELETE FROM quest WHERE id = ?', (quest_id,))
     conn.commit()
     deleted = cursor.rowcount > 0
     conn.close()
     return deleted
 
+# Delta sync
+def get_sync_token(user_id: int) -> int:
+    """Get the token a client holding fresh copies of everything should sync from"""
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute('SELECT MAX(id) as token FROM change_log WHERE user_id = ?', (user_id,))
+    token = cursor.fetchone()['token'] or 0
+    conn.close()
+    return token
+
+def get_changes_since(user_id: int, since: int = 0) -> Dict[str, Any]:
+    """Get the user's quests, inventory stacks, challenge progress and character changed after a sync token
+    
+    Rows are read after the log, so a row may already include a later change;
+    the client sees it again on the next sync, which is harmless. Token 0 returns a
+    full snapshot instead (with 'snapshot': true): rows written before the change
+    log existed never appear in it.
+    """
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    
+    if since <= 0:
+        cursor.execute('SELECT MAX(id) as token FROM change_log WHERE user_id = ?', (user_id,))
+        token = cursor.fetchone()['token'] or 0
+        # Every row the user owns (only today's challenges), logged or not
+        where = {
+            'quest': 'user_id = ?',
+            'inventory': 'c.user_id = ?',
+            'challenge_progress': 'udc.user_id = ? AND dc.challenge_date = ?',
+            'character': 'user_id = ?',
+        }
+        params = {entity: [user_id] for entity in where}
+        params['challenge_progress'].append(datetime.now().strftime('%Y-%m-%d'))
+        deleted = {'quest': [], 'inventory': [], 'challenge_progress': []}
+    else:
+        cursor.execute('''
+            SELECT id, entity, entity_id, deleted FROM change_log
+            WHERE user_id = ? AND id > ?
+            ORDER BY id
+        ''', (user_id, since))
+        log = cursor.fetchall()
+        token = log[-1]['id'] if log else since
+        
+        changed = {'quest': [], 'inventory': [], 'challenge_progress': [], 'character': []}
+        deleted = {'quest': [], 'inventory': [], 'challenge_progress': []}
+        for entry in log:
+            if entry['deleted']:
+                deleted.setdefault(entry['entity'], []).append(entry['entity_id'])
+            else:
+                changed[entry['entity']].append(entry['entity_id'])
+        
+        # Just the logged rows, still checked against the user
+        column = {'quest': 'id', 'inventory': 'inv.id', 'challenge_progress': 'udc.id', 'character': 'id'}
+        owner = {'quest': 'user_id', 'inventory': 'c.user_id', 'challenge_progress': 'udc.user_id', 'character': 'user_id'}
+        where = {entity: f"{column[entity]} IN ({','.join('?' * len(ids))}) AND {owner[entity]} = ?"
+                 for entity, ids in changed.items()}
+        params = {entity: ids + [user_id] if ids else None for entity, ids in changed.items()}
+    
+    def fetch(entity: str, query: str) -> List[Dict[str, Any]]:
+        if params[entity] is None:
+            return []
+        cursor.execute(query.format(where=where[entity]), params[entity])
+        return [dict(row) for row in cursor.fetchall()]
+    
+    quests = fetch('quest', 'SELECT * FROM quest WHERE {where}')
+    inventory = fetch('inventory', '''
+        SELECT inv.id as inventory_id, inv.item_id, inv.quantity, inv.equipped_count
+        FROM inventory inv
+        JOIN character c ON c.id = inv.character_id
+        WHERE {where}
+    ''')
+    challenge_progress = fetch('challenge_progress', '''
+        SELECT dc.*, udc.id as progress_id, udc.progress, udc.completed, udc.claimed
+        FROM user_daily_challenge udc
+        JOIN daily_challenge dc ON dc.id = udc.challenge_id
+        WHERE {where}
+    ''')
+    characters = fetch('character', 'SELECT * FROM character WHERE {where}')
+    conn.close()
+    
+    character = None
+    if characters:
+        character = characters[0]
+        character['xp_to_next_level'] = calculate_xp_for_next_level(character['level'])
+    
+    catalog = get_item_catalog()
+    return {
+        'token': token,
+        'snapshot': since <= 0,
+        'quests': quests,
+        'items': {stack['item_id']: catalog[stack['item_id']] for stack in inventory},
+        'inventory': inventory,
+        'challenge_progress': challenge_progress,
+        'character': character,
+        'deleted': deleted
+    }
+
+def applied_request_ttl(request_key: str) -> Optional[int]:
+    """Seconds a request key's record is kept (None: never expires)"""
+    if request_key.startswith(SYNC_KEY_PREFIX):
+        return SYNC_ACTION_TTL or None
+    return IDEMPOTENCY_TTL
+
+def get_applied_request(user_id: int, request_key: str) -> Optional[Dict[str, Any]]:
+    """Get the recorded result of a request the user already applied, if it hasn't expired"""
+    ttl = applied_request_ttl(request_key)
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT status, response FROM applied_request
+        WHERE user_id = ? AND request_key = ? AND (? IS NULL OR created_at >= datetime('now', ?))
+    ''', (user_id, request_key, ttl, f'-{ttl} seconds'))
+    row = cursor.fetchone()
+    conn.close()
+    
+    if row:
+        return {'status': row['status'], 'body': json.loads(row['response']) if row['response'] else None}
+    return None
+
+@db_write
+def record_applied_request(user_id: int, request_key: str, status: int, body: Any = None):
+    """Remember a request's result so replaying it returns the same response
+    
+    Also evicts expired records; the created_at index keeps that to the expired rows.
+    Offline sync actions (SYNC_KEY_PREFIX) follow SYNC_ACTION_TTL instead.
+    """
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM applied_request
+        WHERE created_at < datetime('now', ?)
+          AND (substr(request_key, 1, ?) != ? OR (? > 0 AND created_at < datetime('now', ?)))
+    ''', (f'-{IDEMPOTENCY_TTL} seconds', len(SYNC_KEY_PREFIX), SYNC_KEY_PREFIX,
+          SYNC_ACTION_TTL, f'-{SYNC_ACTION_TTL} seconds'))
+    cursor.execute('''
+        INSERT OR REPLACE INTO applied_request (user_id, request_key, status, response)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, request_key, status, json.dumps(body, separators=(',', ':'))))
+    conn.commit()
+    conn.close()
+
 # Shop operations
 def get_all_items() -> List[Dict[str, Any]]:
     """Get all shop items"""
@@ -685,136 +1825,293 @@ def get_all_items() -> List[Dict[str, Any]]:
     conn.close()
     return [dict(row) for row in rows]
 
+# Shop items only change when init_db seeds them, so each process caches them once
+_item_catalog: Optional[Dict[int, Dict[str, Any]]] = None
+
+def get_item_catalog() -> Dict[int, Dict[str, Any]]:
+    """Get every shop item keyed by id, cached for the life of the process"""
+    global _item_catalog
+    metrics.count_cache('item_catalog', _item_catalog is not None)
+    if _item_catalog is None:
+        _item_catalog = {item['id']: item for item in get_all_items()}
+    return _item_catalog
+
+def spend_gold(cursor, character_id: int, amount: int) -> bool:
+    """Debit gold only if the character can afford it; False when they can't
+    
+    The balance check and the debit are one statement, so concurrent purchases
+    can't both pass a stale check and overspend.
+    """
+    cursor.execute('''
+        UPDATE character SET gold = gold - ?
+        WHERE id = ? AND gold >= ?
+    ''', (amount, character_id, amount))
+    return cursor.rowcount == 1
+
+@db_write
 def purchase_item(character_id: int, item_id: int) -> Dict[str, Any]:
-    """Purchase an item from the shop"""
-    char = get_character(character_id)
+    """Purchase an item from the shop (the gold check happens in SQL against the current balance)"""
+    result = checkout_cart(character_id, [{'item_id': item_id, 'quantity': 1}])
+    if 'error' in result:
+        return result
+    
+    return {
+        'success': True,
+        'item': result['items'][0],
+        'inventory_id': result['inventory_ids'][0],
+        'character': result['character'],
+        'newly_unlocked_achievements': result['newly_unlocked_achievements']
+    }
+
+@db_write
+def checkout_cart(character_id: int, cart: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Buy a basket of shop items in one transaction, all or nothing
+    
+    Args:
+        cart: [{'item_id': 1, 'quantity': 2}, ...]; quantity defaults to 1
+    
+    Returns inventory_ids with one stack id per distinct item, in cart order.
+    """
+    quantities = {}
+    for line in cart:
+        try:
+            item_id = int(line['item_id'])
+            quantity = int(line.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Each cart line needs an item_id and a whole-number quantity'}
+        if quantity < 1:
+            return {'error': 'Quantity must be at least 1'}
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+    
+    if not quantities:
+        return {'error': 'Cart is empty'}
     
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM item WHERE id = ?', (item_id,))
-    item = cursor.fetchone()
+    placeholders = ','.join('?' * len(quantities))
+    cursor.execute(f'SELECT * FROM item WHERE id IN ({placeholders})', list(quantities))
+    items = {row['id']: dict(row) for row in cursor.fetchall()}
     
-    if not item:
+    if len(items) != len(quantities):
         conn.close()
         return {'error': 'Item not found'}
     
-    item = dict(item)
-    
-    if char['gold'] < item['price']:
+    total = sum(items[item_id]['price'] * quantity for item_id, quantity in quantities.items())
+    if not spend_gold(cursor, character_id, total):
         conn.close()
         return {'error': 'Not enough gold'}
     
-    # Deduct gold
-    new_gold = char['gold'] - item['price']
-    update_character(character_id, gold=new_gold)
-    
-    # Add to inventory
-    cursor.execute('''
-        INSERT INTO inventory (character_id, item_id)
-        VALUES (?, ?)
-    ''', (character_id, item_id))
+    # Add to inventory, stacking onto any copies already owned
+    inventory_ids = []
+    for item_id, quantity in quantities.items():
+        cursor.execute('''
+            INSERT INTO inventory (character_id, item_id, quantity)
+            VALUES (?, ?, ?)
+            ON CONFLICT(character_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', (character_id, item_id, quantity))
+        cursor.execute('SELECT id FROM inventory WHERE character_id = ? AND item_id = ?', (character_id, item_id))
+        inventory_ids.append(cursor.fetchone()['id'])
+    bump_data_version(cursor, character_id=character_id)
+    char = get_character(character_id)
+    newly_unlocked = unlock_earned_achievements(cursor, char)
     conn.commit()
-    inventory_id = cursor.lastrowid
     conn.close()
     
     return {
         'success': True,
-        'item': item,
-        'inventory_id': inventory_id,
-        'character': get_character(character_id)
+        'items': [items[item_id] for item_id in quantities],
+        'total': total,
+        'inventory_ids': inventory_ids,
+        'character': char,
+        'newly_unlocked_achievements': newly_unlocked
     }
 
-def get_inventory(character_id: int) -> List[Dict[str, Any]]:
-    """Get character's inventory"""
+def get_inventory(character_id: int, item_fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Get character's inventory as item stacks plus the definitions of the items in them
+    
+    Args:
+        item_fields: whitelisted item fields to include in each definition (default: all)
+    
+    Returns:
+        {'items': {item_id: item}, 'inventory': [{inventory_id, item_id, quantity, equipped_count}]}
+    """
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT inv.id as inventory_id, inv.equipped, item.*
-        FROM inventory inv
-        JOIN item ON inv.item_id = item.id
-        WHERE inv.character_id = ?
+        SELECT id as inventory_id, item_id, quantity, equipped_count
+        FROM inventory
+        WHERE character_id = ?
+        ORDER BY id
     ''', (character_id,))
     rows = cursor.fetchall()
     conn.close()
-    return [dict(row) for row in rows]
+    
+    catalog = get_item_catalog()
+    inventory = [dict(row) for row in rows]
+    items = {entry['item_id']: catalog[entry['item_id']] for entry in inventory}
+    if item_fields:
+        # Definitions come from the in-memory catalog, so projection is just a key filter
+        select_columns('item', item_fields)
+        items = {item_id: {field: item[field] for field in item_fields} for item_id, item in items.items()}
+    return {'items': items, 'inventory': inventory}
+
+# Equipment
+# Stats an equipped item adds to its character
+EQUIPMENT_BONUSES = {'attack_bonus': 'attack', 'defense_bonus': 'defense', 'health_bonus': 'max_health'}
+
+def load_equipment_slots(cursor, character_id: int, cached: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """Get a character's equipment-slot map: item type -> {inventory_id, item_id}
+    
+    Args:
+        cached: the character's equipment_slots column; rebuilt from inventory when NULL
+    """
+    metrics.count_cache('equipment_slots', cached is not None)
+    if cached is not None:
+        return json.loads(cached)
+    
+    cursor.execute('''
+        SELECT inv.id as inventory_id, inv.item_id, item.type
+        FROM inventory inv
+        JOIN item ON inv.item_id = item.id
+        WHERE inv.character_id = ? AND inv.equipped_count > 0
+    ''', (character_id,))
+    return {row['type']: {'inventory_id': row['inventory_id'], 'item_id': row['item_id']} for row in cursor.fetchall()}
+
+def apply_equipment_change(cursor, character_id: int, slots: Dict[str, Dict[str, int]], slot: str,
+                           new_item: Optional[Dict[str, Any]], inventory_id: Optional[int]):
+    """Swap what's in one slot and shift the character's stats by the bonus difference"""
+    catalog = get_item_catalog()
+    old = slots.get(slot)
+    old_item = catalog.get(old['item_id']) if old else None
+    
+    deltas = {}
+    for bonus, stat in EQUIPMENT_BONUSES.items():
+        deltas[stat] = (new_item[bonus] if new_item else 0) - (old_item[bonus] if old_item else 0)
+    
+    changed = [old['inventory_id']] if old else []
+    if new_item:
+        slots[slot] = {'inventory_id': inventory_id, 'item_id': new_item['id']}
+        changed.append(inventory_id)
+    else:
+        slots.pop(slot, None)
+    
+    placeholders = ','.join('?' * len(changed))
+    cursor.execute(f'''
+        UPDATE inventory SET equipped_count = (id = ?)
+        WHERE id IN ({placeholders})
+    ''', [inventory_id if new_item else 0] + changed)
+    
+    equipment_slots = json.dumps(slots)
+    cursor.execute('''
+        UPDATE character
+        SET attack = attack + ?, defense = defense + ?, max_health = max_health + ?,
+            health = MIN(health, max_health + ?), equipment_slots = ?
+        WHERE id = ?
+    ''', (deltas['attack'], deltas['defense'], deltas['max_health'], deltas['max_health'], equipment_slots, character_id))
+    bump_data_version(cursor, character_id=character_id)
 
+@db_write
 def equip_item(inventory_id: int, character_id: int) -> Dict[str, Any]:
-    """Equip an item from inventory"""
+    """Equip an item from inventory, replacing whatever is in its slot"""
     conn = get_db()
     cursor = conn.cursor()
     
-    # Get the item
+    # The item plus the character's current slots, read inside the write transaction
     cursor.execute('''
-        SELECT inv.*, item.type, item.attack_bonus, item.defense_bonus, item.health_bonus
+        SELECT inv.item_id, c.equipment_slots
         FROM inventory inv
-        JOIN item ON inv.item_id = item.id
+        JOIN character c ON c.id = inv.character_id
         WHERE inv.id = ? AND inv.character_id = ?
     ''', (inventory_id, character_id))
     
-    inv_item = cursor.fetchone()
-    if not inv_item:
+    row = cursor.fetchone()
+    if not row:
         conn.close()
         return {'error': 'Item not found in inventory'}
     
-    inv_item = dict(inv_item)
-    
-    # Unequip other items of same type
-    cursor.execute('''
-        UPDATE inventory SET equipped = 0
-        WHERE character_id = ? AND id IN (
-            SELECT inv.id FROM inventory inv
-            JOIN item ON inv.item_id = item.id
-            WHERE item.type = ? AND inv.character_id = ?
-        )
-    ''', (character_id, inv_item['type'], character_id))
+    item = get_item_catalog()[row['item_id']]
+    slots = load_equipment_slots(cursor, character_id, row['equipment_slots'])
     
-    # Equip this item
-    cursor.execute('UPDATE inventory SET equipped = 1 WHERE id = ?', (inventory_id,))
-    conn.commit()
+    if slots.get(item['type'], {}).get('inventory_id') != inventory_id:
+        apply_equipment_change(cursor, character_id, slots, item['type'], item, inventory_id)
+        conn.commit()
     conn.close()
     
-    # Recalculate character stats
-    recalculate_character_stats(character_id)
-    
     return {'success': True, 'character': get_character(character_id)}
 
-def recalculate_character_stats(character_id: int):
-    """Recalculate character stats based on equipped items"""
-    char = get_character(character_id)
+@db_write
+def unequip_item(inventory_id: int, character_id: int) -> Dict[str, Any]:
+    """Take an equipped item off, removing its bonuses"""
     conn = get_db()
     cursor = conn.cursor()
     
-    # Get base stats (from level)
-    base_attack = 10 + (char['level'] - 1) * 3
-    base_defense = 5 + (char['level'] - 1) * 2
-    base_max_health = 100 + (char['level'] - 1) * 10
+    cursor.execute('''
+        SELECT inv.item_id, c.equipment_slots
+        FROM inventory inv
+        JOIN character c ON c.id = inv.character_id
+        WHERE inv.id = ? AND inv.character_id = ?
+    ''', (inventory_id, character_id))
+    
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        return {'error': 'Item not found in inventory'}
+    
+    item = get_item_catalog()[row['item_id']]
+    slots = load_equipment_slots(cursor, character_id, row['equipment_slots'])
+    
+    if slots.get(item['type'], {}).get('inventory_id') != inventory_id:
+        conn.close()
+        return {'error': 'Item is not equipped'}
+    
+    apply_equipment_change(cursor, character_id, slots, item['type'], None, None)
+    conn.commit()
+    conn.close()
     
-    # Add equipped item bonuses
+    return {'success': True, 'character': get_character(character_id)}
+
+def expected_character_stats(cursor, character_id: int, level: int) -> Dict[str, Any]:
+    """Compute a character's stats from scratch: level base plus equipped item bonuses"""
     cursor.execute('''
         SELECT SUM(item.attack_bonus) as total_attack,
                SUM(item.defense_bonus) as total_defense,
                SUM(item.health_bonus) as total_health
         FROM inventory inv
         JOIN item ON inv.item_id = item.id
-        WHERE inv.character_id = ? AND inv.equipped = 1
+        WHERE inv.character_id = ? AND inv.equipped_count > 0
     ''', (character_id,))
-    
     bonuses = cursor.fetchone()
-    conn.close()
     
-    total_attack = base_attack + (bonuses['total_attack'] or 0)
-    total_defense = base_defense + (bonuses['total_defense'] or 0)
-    total_max_health = base_max_health + (bonuses['total_health'] or 0)
+    return {
+        'attack': 10 + (level - 1) * 3 + (bonuses['total_attack'] or 0),
+        'defense': 5 + (level - 1) * 2 + (bonuses['total_defense'] or 0),
+        'max_health': 100 + (level - 1) * 10 + (bonuses['total_health'] or 0),
+        'equipment_slots': load_equipment_slots(cursor, character_id)
+    }
+
+@db_write
+def recalculate_character_stats(character_id: int) -> Dict[str, Any]:
+    """Recalculate character stats and the equipment-slot map from inventory
+    
+    Equip and unequip apply deltas; this full recompute is the repair path.
+    """
+    char = get_character(character_id)
+    conn = get_db()
+    cursor = conn.cursor()
+    expected = expected_character_stats(cursor, character_id, char['level'])
+    conn.close()
     
-    update_character(
+    return update_character(
         character_id,
-        attack=total_attack,
-        defense=total_defense,
-        max_health=total_max_health,
-        health=min(char['health'], total_max_health)
+        attack=expected['attack'],
+        defense=expected['defense'],
+        max_health=expected['max_health'],
+        health=min(char['health'], expected['max_health']),
+        equipment_slots=json.dumps(expected['equipment_slots'])
     )
 
 # Battle system
+@db_write
 def battle_monster(character_id: int, monster_name: str, monster_level: int, user_id: int = None) -> Dict[str, Any]:
     """Simulate a battle with a monster"""
     char = get_character(character_id)
@@ -842,19 +2139,19 @@ def battle_monster(character_id: int, monster_name: str, monster_level: int, use
     if won:
         xp_gained = 30 * monster_level
         gold_gained = 20 * monster_level
-        add_xp_and_gold(character_id, xp_gained, gold_gained)
     else:
         xp_gained = 5 * monster_level
         gold_gained = 0
-        add_xp_and_gold(character_id, xp_gained, 0)
     
-    # Log battle
+    # Log battle, then reward and unlock achievements from the row read above
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO battle (character_id, monster_name, monster_level, won, xp_gained, gold_gained)
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (character_id, monster_name, monster_level, won, xp_gained, gold_gained))
+    char = reward_character(cursor, char, xp_gained, gold_gained)
+    newly_unlocked = unlock_earned_achievements(cursor, char)
     conn.commit()
     conn.close()
     
@@ -877,15 +2174,17 @@ def battle_monster(character_id: int, monster_name: str, monster_level: int, use
             'xp': xp_gained,
             'gold': gold_gained
         },
-        'character': get_character(character_id)
+        'character': char,
+        'newly_unlocked_achievements': newly_unlocked
     }
 
-def get_battle_history(character_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    """Get recent battle history"""
+def get_battle_history(character_id: int, limit: int = 10, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Get recent battle history, optionally projected to whitelisted fields"""
+    columns = select_columns('battle', fields) if fields else '*'
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM battle
+    cursor.execute(f'''
+        SELECT {columns} FROM battle
         WHERE character_id = ?
         ORDER BY battled_at DESC
         LIMIT ?
@@ -904,34 +2203,39 @@ def get_all_achievements() -> List[Dict[str, Any]]:
     conn.close()
     return [dict(row) for row in rows]
 
+@db_write
 def check_and_unlock_achievements(character_id: int) -> List[Dict[str, Any]]:
     """Check and unlock any earned achievements"""
     char = get_character(character_id)
+    if not char:
+        return []
     
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get user_id from character
-    cursor.execute('SELECT user_id FROM character WHERE id = ?', (character_id,))
-    char_row = cursor.fetchone()
-    if not char_row:
-        conn.close()
-        return []
+    newly_unlocked = unlock_earned_achievements(conn.cursor(), char)
+    conn.commit()
+    conn.close()
     
-    user_id = char_row['user_id']
+    return newly_unlocked
+
+def unlock_earned_achievements(cursor, char: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Unlock the achievements a character row (read inside the caller's write transaction) has earned"""
+    character_id = char['id']
+    user_id = char['user_id']
     
     # Get stats (filtered by user)
+    archived = get_archived_totals(cursor, user_id, character_id)
+    
     cursor.execute('SELECT COUNT(*) as count FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    quests_completed = cursor.fetchone()['count']
+    quests_completed = cursor.fetchone()['count'] + archived['quests_completed']
     
     cursor.execute('SELECT COUNT(*) as count FROM battle WHERE character_id = ? AND won = 1', (character_id,))
-    monsters_defeated = cursor.fetchone()['count']
+    monsters_defeated = cursor.fetchone()['count'] + archived['battles_won']
     
-    cursor.execute('SELECT COUNT(*) as count FROM inventory WHERE character_id = ?', (character_id,))
+    cursor.execute('SELECT COALESCE(SUM(quantity), 0) as count FROM inventory WHERE character_id = ?', (character_id,))
     items_purchased = cursor.fetchone()['count']
     
     cursor.execute('SELECT SUM(gold_reward) as total FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    gold_earned = cursor.fetchone()['total'] or 0
+    gold_earned = (cursor.fetchone()['total'] or 0) + archived['gold_earned']
     
     stats = {
         'quests_completed': quests_completed,
@@ -958,37 +2262,75 @@ def check_and_unlock_achievements(character_id: int) -> List[Dict[str, Any]]:
             ''', (ach['id'],))
             newly_unlocked.append(ach)
     
-    conn.commit()
-    conn.close()
+    if newly_unlocked:
+        # Achievements are shared, so every user's cached view is now stale
+        cursor.execute('UPDATE user SET data_version = data_version + 1')
+        if DB_SHARDS:
+            names = [ach['name'] for ach in newly_unlocked]
+            source = current_shard(user_id)
+            after_commit(lambda: share_unlocked_achievements(names, source))
     
     return newly_unlocked
 
+def share_unlocked_achievements(names: List[str], source_shard: int):
+    """Unlock achievements on every other shard and make its users' cached views revalidate
+    
+    Each shard keeps its own copy of the achievement table. This runs after the
+    unlocking shard commits, one shard at a time, so no transaction ever waits on
+    another shard's lock while holding its own.
+    """
+    for shard in range(DB_SHARDS):
+        if shard == source_shard:
+            continue
+        
+        def unlock(shard=shard):
+            conn = open_connection(shard=shard)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.execute('''
+                    UPDATE achievement SET unlocked = 1, unlocked_at = CURRENT_TIMESTAMP
+                    WHERE unlocked = 0 AND name IN (SELECT value FROM json_each(?))
+                ''', (json.dumps(names),))
+                if cursor.rowcount:
+                    conn.execute('UPDATE user SET data_version = data_version + 1')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        run_with_busy_retry('share_unlocked_achievements', unlock)
+
 # Statistics
-def get_statistics(character_id: int) -> Dict[str, Any]:
+def get_statistics(character_id: int, user_id: Optional[int] = None) -> Dict[str, Any]:
     """Get comprehensive statistics for a character"""
     conn = get_db()
     cursor = conn.cursor()
     
-    # Get user_id from character
-    cursor.execute('SELECT user_id FROM character WHERE id = ?', (character_id,))
-    char_row = cursor.fetchone()
-    if not char_row:
-        conn.close()
-        return {}
+    # Get user_id from character unless the caller already knows it
+    if user_id is None:
+        cursor.execute('SELECT user_id FROM character WHERE id = ?', (character_id,))
+        char_row = cursor.fetchone()
+        if not char_row:
+            conn.close()
+            return {}
+        
+        user_id = char_row['user_id']
     
-    user_id = char_row['user_id']
+    # Rows moved to the archive still count
+    archived = get_archived_totals(cursor, user_id, character_id)
     
     cursor.execute('SELECT COUNT(*) as count FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    quests_completed = cursor.fetchone()['count']
+    quests_completed = cursor.fetchone()['count'] + archived['quests_completed']
     
     cursor.execute('SELECT COUNT(*) as count FROM quest WHERE user_id = ? AND completed = 0', (user_id,))
     quests_pending = cursor.fetchone()['count']
     
     cursor.execute('SELECT COUNT(*) as count FROM battle WHERE character_id = ? AND won = 1', (character_id,))
-    battles_won = cursor.fetchone()['count']
+    battles_won = cursor.fetchone()['count'] + archived['battles_won']
     
     cursor.execute('SELECT COUNT(*) as count FROM battle WHERE character_id = ? AND won = 0', (character_id,))
-    battles_lost = cursor.fetchone()['count']
+    battles_lost = cursor.fetchone()['count'] + archived['battles_lost']
     
     cursor.execute('SELECT COUNT(*) as count FROM achievement WHERE unlocked = 1')
     achievements_unlocked = cursor.fetchone()['count']
@@ -997,10 +2339,10 @@ def get_statistics(character_id: int) -> Dict[str, Any]:
     total_achievements = cursor.fetchone()['count']
     
     cursor.execute('SELECT SUM(gold_reward) as total FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    total_gold_earned = cursor.fetchone()['total'] or 0
+    total_gold_earned = (cursor.fetchone()['total'] or 0) + archived['gold_earned']
     
     cursor.execute('SELECT SUM(xp_reward) as total FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    total_xp_earned = cursor.fetchone()['total'] or 0
+    total_xp_earned = (cursor.fetchone()['total'] or 0) + archived['xp_earned']
     
     conn.close()
     
@@ -1062,18 +2404,29 @@ def create_quest_from_template(template_id: int, user_id: int) -> Dict[str, Any]
 
 # User Authentication
 def create_user(username: str, password: str) -> Optional[Dict[str, Any]]:
-    """Create a new user with hashed password"""
-    from werkzeug.security import generate_password_hash
+    """Create a new user with hashed password (raises HashingBusy when the pool is full)"""
+    from password_hashing import hash_password
     
-    conn = get_db()
+    # Hash before queueing the insert so a slow hash never holds the writer
+    return insert_user(username, hash_password(password))
+
+@db_write
+def insert_user(username: str, password_hash: str) -> Optional[Dict[str, Any]]:
+    """Insert a user row with an already-computed password hash"""
+    user_id = None
+    if DB_SHARDS:
+        # The directory owns usernames and ids; the row then goes to the id's shard
+        user_id = allocate_user_id(username)
+        if user_id is None:
+            return None  # Username already exists
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     try:
-        password_hash = generate_password_hash(password)
         cursor.execute('''
-            INSERT INTO user (username, password_hash)
-            VALUES (?, ?)
-        ''', (username, password_hash))
+            INSERT INTO user (id, username, password_hash)
+            VALUES (?, ?, ?)
+        ''', (user_id, username, password_hash))
         conn.commit()
         user_id = cursor.lastrowid
         conn.close()
@@ -1082,10 +2435,15 @@ def create_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     except sqlite3.IntegrityError:
         conn.close()
         return None  # Username already exists
+    except Exception:
+        conn.close()
+        if DB_SHARDS:
+            release_user_id(user_id)
+        raise
 
 def get_user(user_id: int) -> Optional[Dict[str, Any]]:
     """Get user by ID"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute('SELECT id, username, created_at FROM user WHERE id = ?', (user_id,))
     row = cursor.fetchone()
@@ -1094,7 +2452,12 @@ def get_user(user_id: int) -> Optional[Dict[str, Any]]:
 
 def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Get user by username (including password hash for auth)"""
-    conn = get_db()
+    user_id = None
+    if DB_SHARDS:
+        user_id = user_id_for_username(username)
+        if user_id is None:
+            return None
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM user WHERE username = ?', (username,))
     row = cursor.fetchone()
@@ -1102,20 +2465,34 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     return dict(row) if row else None
 
 def verify_password(username: str, password: str) -> Optional[int]:
-    """Verify password and return user_id if correct"""
-    from werkzeug.security import check_password_hash
+    """Verify password and return user_id if correct (raises HashingBusy when the pool is full)"""
+    from password_hashing import check_password, needs_rehash, hash_password
     
     user = get_user_by_username(username)
     if not user:
         return None
     
-    if check_password_hash(user['password_hash'], password):
-        return user['id']
-    return None
+    if not check_password(user['password_hash'], password):
+        return None
+    
+    # Upgrade hashes made with older cost parameters while we have the plaintext
+    if needs_rehash(user['password_hash']):
+        update_password_hash(user['id'], hash_password(password))
+    
+    return user['id']
+
+@db_write
+def update_password_hash(user_id: int, password_hash: str):
+    """Replace a user's stored password hash"""
+    conn = get_db(user_id)
+    cursor = conn.cursor()
+    cursor.execute('UPDATE user SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+    conn.commit()
+    conn.close()
 
 def get_character_by_user_id(user_id: int) -> Optional[Dict[str, Any]]:
     """Get character for a specific user"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM character WHERE user_id = ?', (user_id,))
     row = cursor.fetchone()
@@ -1127,6 +2504,7 @@ def get_character_by_user_id(user_id: int) -> Optional[Dict[str, Any]]:
         return char
     return None
 
+@db_write
 def update_character_customization(character_id: int, character_class: str, avatar_id: int, color_theme: str, bio: str) -> bool:
     """Update character customization options"""
     conn = get_db()
@@ -1138,17 +2516,22 @@ def update_character_customization(character_id: int, character_class: str, avat
             SET character_class = ?, avatar_id = ?, color_theme = ?, bio = ?
             WHERE id = ?
         ''', (character_class, avatar_id, color_theme, bio, character_id))
+        bump_data_version(cursor, character_id=character_id)
         conn.commit()
         conn.close()
         return True
     except Exception as e:
+        if is_busy_error(e):
+            conn.close()
+            raise
         print(f"Error updating character customization: {e}")
         conn.close()
         return False
 
+@db_write
 def create_character_for_user(user_id: int, name: str) -> Dict[str, Any]:
     """Create a character for a user"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Log character creation for audit trail
@@ -1167,21 +2550,30 @@ def create_character_for_user(user_id: int, name: str) -> Dict[str, Any]:
             (user_id, character_id, event_type, new_level, new_xp, new_gold, triggered_by)
             VALUES (?, ?, 'CHARACTER_CREATED', 1, 0, 0, 'create_character_for_user')
         ''', (user_id, character_id))
-    except:
-        pass  # Audit table might not exist yet
+    except sqlite3.OperationalError as e:
+        # Audit table might not exist yet; a locked database must still retry
+        if is_busy_error(e):
+            raise
     
+    bump_data_version(cursor, user_id=user_id)
     conn.commit()
     conn.close()
     
     return get_character_by_user_id(user_id)
 
 # Daily Challenges System
+@db_write
 def generate_daily_challenges(challenge_date: str = None) -> List[Dict[str, Any]]:
     """Generate 3 random daily challenges for a specific date"""
     if not challenge_date:
         challenge_date = datetime.now().strftime('%Y-%m-%d')
     
-    conn = get_db()
+    if DB_SHARDS:
+        # Challenges are catalog rows; every shard's requests may race to make today's
+        conn = open_catalog_connection()
+        conn.execute('BEGIN IMMEDIATE')
+    else:
+        conn = get_db()
     cursor = conn.cursor()
     
     # Check if challenges already exist for this date
@@ -1259,7 +2651,7 @@ def generate_daily_challenges(challenge_date: str = None) -> List[Dict[str, Any]
 
 def get_challenges_for_date(challenge_date: str) -> List[Dict[str, Any]]:
     """Get all challenges for a specific date"""
-    conn = get_db()
+    conn = open_catalog_connection() if DB_SHARDS else get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM daily_challenge WHERE challenge_date = ?', (challenge_date,))
     rows = cursor.fetchall()
@@ -1267,56 +2659,45 @@ def get_challenges_for_date(challenge_date: str) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 def get_daily_challenges(user_id: int) -> List[Dict[str, Any]]:
-    """Get today's challenges with user progress"""
-    today = datetime.now().strftime('%Y-%m-%d')
+    """Get today's challenges with user progress
     
-    # Ensure challenges exist for today
-    challenges = generate_daily_challenges(today)
+    Read-only unless today's challenges still need generating; progress rows are
+    created by update_challenge_progress, so a missing row just means no progress yet.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
     
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
+    cursor.execute('''
+        SELECT dc.*, udc.progress, udc.completed, udc.claimed
+        FROM daily_challenge dc
+        LEFT JOIN user_daily_challenge udc ON dc.id = udc.challenge_id AND udc.user_id = ?
+        WHERE dc.challenge_date = ?
+    ''', (user_id, today))
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.close()
     
-    result = []
-    for challenge in challenges:
-        # Get or create user progress
-        cursor.execute('''
-            SELECT * FROM user_daily_challenge 
-            WHERE user_id = ? AND challenge_id = ?
-        ''', (user_id, challenge['id']))
-        
-        progress_row = cursor.fetchone()
-        
-        if not progress_row:
-            # Create progress entry
-            cursor.execute('''
-                INSERT INTO user_daily_challenge (user_id, challenge_id, progress)
-                VALUES (?, ?, 0)
-            ''', (user_id, challenge['id']))
-            conn.commit()
-            progress = 0
-            completed = False
-            claimed = False
-        else:
-            progress_data = dict(progress_row)
-            progress = progress_data['progress']
-            completed = bool(progress_data['completed'])
-            claimed = bool(progress_data['claimed'])
-        
-        result.append({
-            **challenge,
-            'progress': progress,
-            'completed': completed,
-            'claimed': claimed
-        })
+    if len(rows) < 3:
+        # Ensure challenges exist for today. New ones have no progress yet, so merge
+        # rather than re-read: an open shard transaction keeps its catalog snapshot
+        progress = {row['id']: row for row in rows}
+        rows = [progress.get(challenge['id'], dict(challenge, progress=None, completed=None, claimed=None))
+                for challenge in generate_daily_challenges(today)]
     
-    conn.close()
+    result = []
+    for challenge in rows:
+        challenge['progress'] = challenge['progress'] or 0
+        challenge['completed'] = bool(challenge['completed'])
+        challenge['claimed'] = bool(challenge['claimed'])
+        result.append(challenge)
     return result
 
+@db_write
 def update_challenge_progress(user_id: int, challenge_type: str, amount: int = 1) -> List[Dict[str, Any]]:
     """Update progress for a specific challenge type"""
     today = datetime.now().strftime('%Y-%m-%d')
     
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Get today's challenges of this type
@@ -1357,14 +2738,16 @@ def update_challenge_progress(user_id: int, challenge_type: str, amount: int = 1
                     WHERE id = ?
                 ''', (progress_id,))
             
+            bump_data_version(cursor, user_id=user_id)
             conn.commit()
     
     conn.close()
     return get_daily_challenges(user_id)
 
+@db_write
 def claim_daily_challenge(user_id: int, challenge_id: int, character_id: int) -> Dict[str, Any]:
     """Claim rewards for a completed challenge"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Get challenge and progress
@@ -1402,6 +2785,7 @@ def claim_daily_challenge(user_id: int, challenge_id: int, character_id: int) ->
         SET claimed = 1
         WHERE user_id = ? AND challenge_id = ?
     ''', (user_id, challenge_id))
+    bump_data_version(cursor, user_id=user_id)
     
     conn.commit()
     conn.close()
@@ -1428,41 +2812,40 @@ def get_week_start_date(offset: int = 0) -> str:
     week_start = monday - timedelta(weeks=abs(offset)) if offset < 0 else monday + timedelta(weeks=offset)
     return week_start.strftime('%Y-%m-%d')
 
-def get_weekly_summary(user_id: int, week_offset: int = 0) -> Dict[str, Any]:
+def get_weekly_summary(user_id: int, week_offset: int = 0, character_id: Optional[int] = None) -> Dict[str, Any]:
     """Get weekly summary for a user"""
     week_start = get_week_start_date(week_offset)
     week_end_dt = datetime.strptime(week_start, '%Y-%m-%d') + timedelta(days=7)
     week_end = week_end_dt.strftime('%Y-%m-%d')
     
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
-    # Get character
-    cursor.execute('SELECT id FROM character WHERE user_id = ?', (user_id,))
-    char_row = cursor.fetchone()
-    if not char_row:
-        conn.close()
-        return {}
-    
-    character_id = char_row['id']
+    # Get character unless the caller already knows it
+    if character_id is None:
+        cursor.execute('SELECT id FROM character WHERE user_id = ?', (user_id,))
+        char_row = cursor.fetchone()
+        if not char_row:
+            conn.close()
+            return {}
+        
+        character_id = char_row['id']
     
-    # Quest stats
-    cursor.execute('''
+    # Quest stats (older weeks may reach into the archive)
+    daily_stats = query_range('''
         SELECT 
             COUNT(*) as quests_completed,
             SUM(xp_reward) as xp_earned,
             SUM(gold_reward) as gold_earned,
             DATE(completed_at) as completion_date
-        FROM quest 
+        FROM {quest} 
         WHERE user_id = ? 
         AND completed = 1 
         AND completed_at >= ? 
         AND completed_at < ?
         GROUP BY DATE(completed_at)
         ORDER BY completion_date
-    ''', (user_id, week_start, week_end))
-    
-    daily_stats = cursor.fetchall()
+    ''', (user_id, week_start, week_end), week_start, week_end, user_id)
     
     total_quests = sum(row['quests_completed'] for row in daily_stats)
     total_xp = sum(row['xp_earned'] or 0 for row in daily_stats)
@@ -1478,16 +2861,14 @@ def get_weekly_summary(user_id: int, week_offset: int = 0) -> Dict[str, Any]:
             most_productive_day = row['completion_date']
     
     # Battle stats
-    cursor.execute('''
+    monsters_defeated = query_range('''
         SELECT COUNT(*) as count
-        FROM battle 
+        FROM {battle} 
         WHERE character_id = ? 
         AND won = 1 
         AND battled_at >= ? 
         AND battled_at < ?
-    ''', (character_id, week_start, week_end))
-    
-    monsters_defeated = cursor.fetchone()['count']
+    ''', (character_id, week_start, week_end), week_start, week_end, user_id)[0]['count']
     
     # Achievement stats (achievements unlocked this week)
     cursor.execute('''
@@ -1514,10 +2895,10 @@ def get_weekly_summary(user_id: int, week_offset: int = 0) -> Dict[str, Any]:
         'most_productive_day': most_productive_day
     }
 
-def get_weekly_comparison(user_id: int) -> Dict[str, Any]:
+def get_weekly_comparison(user_id: int, character_id: Optional[int] = None) -> Dict[str, Any]:
     """Compare current week with last week"""
-    current_week = get_weekly_summary(user_id, 0)
-    last_week = get_weekly_summary(user_id, -1)
+    current_week = get_weekly_summary(user_id, 0, character_id)
+    last_week = get_weekly_summary(user_id, -1, character_id)
     
     def calculate_change(current, previous):
         if previous == 0:
@@ -1551,11 +2932,13 @@ def get_weekly_comparison(user_id: int) -> Dict[str, Any]:
         }
     }
 
-def get_weekly_history(user_id: int, weeks: int = 4) -> List[Dict[str, Any]]:
+def get_weekly_history(user_id: int, weeks: int = 4, character_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """Get past N weeks of summary data"""
-    history = []
+    return list(iter_weekly_history(user_id, weeks, character_id))
+
+def iter_weekly_history(user_id: int, weeks: int = 4, character_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Yield past N weeks of summary data one week at a time"""
     for i in range(weeks):
-        week_data = get_weekly_summary(user_id, -i)
+        week_data = get_weekly_summary(user_id, -i, character_id)
         if week_data:
-            history.append(week_data)
-    return history
+            yield week_data
@@ -4,75 +4,102 @@ Leaderboards, public profiles, and sharing functionality
 """
 
 import sqlite3
-from typing import List, Dict, Any, Optional
-from database import get_db
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from database import (get_db, bump_data_version, iter_rows, select_columns, archived_months, query_range,
+                      get_archived_totals, open_private_connection, user_id_for_username)
+import database
+from database_writer import db_write, is_busy_error
 
-def get_leaderboard(timeframe: str = 'all', limit: int = 100) -> List[Dict[str, Any]]:
-    """Get leaderboard of top players
+# SQL behind each leaderboard field, so ?fields= can project the query itself
+LEADERBOARD_COLUMNS = {
+    'rank': 'ROW_NUMBER() OVER (ORDER BY c.level DESC, c.xp DESC)',
+    'character_id': 'c.id',
+    'name': 'c.name',
+    'level': 'c.level',
+    'xp': 'c.xp',
+    'gold': 'c.gold',
+    'character_class': "COALESCE(c.character_class, 'Warrior')",
+    'avatar_id': 'COALESCE(c.avatar_id, 1)',
+    'color_theme': "COALESCE(c.color_theme, 'orange')",
+    'total_quests': 'COALESCE(c.total_quests_completed, 0)',
+    'total_monsters': 'COALESCE(c.total_monsters_defeated, 0)',
+    'username': 'u.username',
+    'created_at': 'u.created_at',
+}
+
+def leaderboard_query(timeframe: str = 'all', limit: int = 100, fields: Optional[List[str]] = None) -> Tuple[str, tuple]:
+    """Build the leaderboard query, shaped in SQL so rows can be streamed as-is
     
     Args:
         timeframe: 'daily', 'weekly', 'monthly', or 'all'
         limit: Number of players to return
+        fields: whitelisted leaderboard fields to select (default: all)
     """
-    conn = get_db()
-    cursor = conn.cursor()
+    fields = fields or list(LEADERBOARD_COLUMNS)
+    select_columns('leaderboard', fields)
+    columns = ',\n            '.join(f'{LEADERBOARD_COLUMNS[field]} as {field}' for field in fields)
     
-    # Build query based on timeframe
-    query = '''
+    # Filter by timeframe based on character creation date or activity
+    # For now, we'll just order by level and XP
+    # TODO: Add last_active timestamp for better timeframe filtering
+    query = f'''
         SELECT 
-            c.id,
-            c.name,
-            c.level,
-            c.xp,
-            c.gold,
-            c.character_class,
-            c.avatar_id,
-            c.color_theme,
-            c.total_quests_completed,
-            c.total_monsters_defeated,
-            u.username,
-            u.created_at
+            {columns}
         FROM character c
         JOIN user u ON c.user_id = u.id
         WHERE c.public_profile = 1
-    '''
-    
-    # Filter by timeframe based on character creation date or activity
-    # For now, we'll just order by level and XP
-    # TODO: Add last_active timestamp for better timeframe filtering
-    
-    query += '''
         ORDER BY c.level DESC, c.xp DESC
         LIMIT ?
     '''
+    return query, (limit,)
+
+def get_leaderboard(timeframe: str = 'all', limit: int = 100) -> List[Dict[str, Any]]:
+    """Get leaderboard of top players
+    
+    Args:
+        timeframe: 'daily', 'weekly', 'monthly', or 'all'
+        limit: Number of players to return
+    """
+    if database.DB_SHARDS:
+        return merged_leaderboard(timeframe, limit)
     
-    cursor.execute(query, (limit,))
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(*leaderboard_query(timeframe, limit))
     rows = cursor.fetchall()
     conn.close()
     
-    leaderboard = []
-    for idx, row in enumerate(rows, 1):
-        leaderboard.append({
-            'rank': idx,
-            'character_id': row[0],
-            'name': row[1],
-            'level': row[2],
-            'xp': row[3],
-            'gold': row[4],
-            'character_class': row[5] or 'Warrior',
-            'avatar_id': row[6] or 1,
-            'color_theme': row[7] or 'orange',
-            'total_quests': row[8] or 0,
-            'total_monsters': row[9] or 0,
-            'username': row[10],
-            'created_at': row[11]
-        })
+    return [dict(row) for row in rows]
+
+def merged_leaderboard(timeframe: str = 'all', limit: int = 100) -> List[Dict[str, Any]]:
+    """Build the leaderboard from every shard's own top `limit` (sharded layout)"""
+    rows = []
+    for shard in range(database.DB_SHARDS):
+        conn = open_private_connection(shard=shard)
+        cursor = conn.cursor()
+        cursor.execute(*leaderboard_query(timeframe, limit))
+        rows.extend(dict(row) for row in cursor.fetchall())
+        conn.close()
     
-    return leaderboard
+    # Python's sort is stable, so ties keep shard order like the single-file query keeps row order
+    rows.sort(key=lambda row: (-row['level'], -row['xp']))
+    rows = rows[:limit]
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+def iter_leaderboard(timeframe: str = 'all', limit: int = 100,
+                     fields: Optional[List[str]] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """Stream the leaderboard as (columns, row tuples)"""
+    if database.DB_SHARDS:
+        fields = fields or list(LEADERBOARD_COLUMNS)
+        rows = merged_leaderboard(timeframe, limit)
+        return fields, (tuple(row[field] for field in fields) for row in rows)
+    return iter_rows(*leaderboard_query(timeframe, limit, fields))
 
 def get_public_profile(user_id: int) -> Optional[Dict[str, Any]]:
     """Get public profile for a user"""
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -80,7 +107,8 @@ def get_public_profile(user_id: int) -> Optional[Dict[str, Any]]:
             c.*,
             u.username,
             u.created_at as user_created_at,
-            (SELECT COUNT(*) FROM quest WHERE user_id = u.id AND completed = 1) as completed_quests,
+            (SELECT COUNT(*) FROM quest WHERE user_id = u.id AND completed = 1)
+                + COALESCE((SELECT quests_completed FROM archived_quest_totals WHERE user_id = u.id), 0) as completed_quests,
             (SELECT COUNT(*) FROM battle_history WHERE character_id = c.id AND victory = 1) as battles_won,
             (SELECT COUNT(*) FROM character_achievement WHERE character_id = c.id) as achievements_count
         FROM character c
@@ -96,17 +124,31 @@ def get_public_profile(user_id: int) -> Optional[Dict[str, Any]]:
     
     return dict(row)
 
+# Character columns a public profile shows
+PROFILE_CHARACTER_FIELDS = [
+    'id', 'user_id', 'name', 'level', 'xp', 'gold', 'health', 'max_health', 'attack', 'defense',
+    'created_at', 'character_class', 'avatar_id', 'color_theme', 'bio', 'public_profile',
+    'total_quests_completed', 'total_monsters_defeated'
+]
+
 def get_public_profile_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Get enhanced public profile with all stats, achievements, equipment, and activity"""
     from datetime import datetime
     
-    conn = get_db()
+    # Sharded, the directory says whose shard to read
+    user_id = None
+    if database.DB_SHARDS:
+        user_id = user_id_for_username(username)
+        if user_id is None:
+            return None
+    
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Get basic character and user info
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT 
-            c.*,
+            {select_columns('character', PROFILE_CHARACTER_FIELDS, prefix='c.')},
             u.username,
             u.created_at as user_created_at
         FROM character c
@@ -124,13 +166,14 @@ def get_public_profile_by_username(username: str) -> Optional[Dict[str, Any]]:
     user_id = profile['user_id']
     character_id = profile['id']
     
-    # Get quest stats
+    # Get quest stats (including archived quests)
+    archived = get_archived_totals(cursor, user_id, character_id)
     cursor.execute('SELECT COUNT(*) FROM quest WHERE user_id = ? AND completed = 1', (user_id,))
-    profile['completed_quests'] = cursor.fetchone()[0]
+    profile['completed_quests'] = cursor.fetchone()[0] + archived['quests_completed']
     
     # Get battle stats
     cursor.execute('SELECT COUNT(*) FROM battle WHERE character_id = ? AND won = 1', (character_id,))
-    profile['battles_won'] = cursor.fetchone()[0]
+    profile['battles_won'] = cursor.fetchone()[0] + archived['battles_won']
     
     # Get achievements count
     cursor.execute('SELECT COUNT(*) FROM achievement WHERE unlocked = 1')
@@ -145,7 +188,7 @@ def get_public_profile_by_username(username: str) -> Optional[Dict[str, Any]]:
         SELECT i.name, i.type, i.rarity, i.attack_bonus, i.defense_bonus, i.health_bonus
         FROM inventory inv
         JOIN item i ON inv.item_id = i.id
-        WHERE inv.character_id = ? AND inv.equipped = 1
+        WHERE inv.character_id = ? AND inv.equipped_count > 0
     ''', (character_id,))
     profile['equipped_items'] = [dict(row) for row in cursor.fetchall()]
     
@@ -188,7 +231,7 @@ def get_public_profile_by_username(username: str) -> Optional[Dict[str, Any]]:
     profile['daily_challenges_today'] = cursor.fetchone()[0]
     
     # Get their rank
-    profile['rank'] = get_user_rank(character_id)
+    profile['rank'] = get_user_rank(character_id, user_id)
     
     # Get activity streak (consecutive days with completed quests)
     profile['current_streak'] = calculate_streak(user_id)
@@ -199,6 +242,7 @@ def get_public_profile_by_username(username: str) -> Optional[Dict[str, Any]]:
     conn.close()
     return profile
 
+@db_write
 def toggle_public_profile(character_id: int, public: bool) -> bool:
     """Toggle public profile visibility"""
     conn = get_db()
@@ -210,14 +254,19 @@ def toggle_public_profile(character_id: int, public: bool) -> bool:
             SET public_profile = ?
             WHERE id = ?
         ''', (1 if public else 0, character_id))
+        bump_data_version(cursor, character_id=character_id)
         conn.commit()
         conn.close()
         return True
     except Exception as e:
+        if is_busy_error(e):
+            conn.close()
+            raise
         print(f"Error toggling public profile: {e}")
         conn.close()
         return False
 
+@db_write
 def increment_quest_counter(character_id: int):
     """Increment total quests completed counter"""
     conn = get_db()
@@ -229,12 +278,17 @@ def increment_quest_counter(character_id: int):
             SET total_quests_completed = total_quests_completed + 1
             WHERE id = ?
         ''', (character_id,))
+        bump_data_version(cursor, character_id=character_id)
         conn.commit()
         conn.close()
     except Exception as e:
+        if is_busy_error(e):
+            conn.close()
+            raise
         print(f"Error incrementing quest counter: {e}")
         conn.close()
 
+@db_write
 def increment_monster_counter(character_id: int):
     """Increment total monsters defeated counter"""
     conn = get_db()
@@ -246,15 +300,23 @@ def increment_monster_counter(character_id: int):
             SET total_monsters_defeated = total_monsters_defeated + 1
             WHERE id = ?
         ''', (character_id,))
+        bump_data_version(cursor, character_id=character_id)
         conn.commit()
         conn.close()
     except Exception as e:
+        if is_busy_error(e):
+            conn.close()
+            raise
         print(f"Error incrementing monster counter: {e}")
         conn.close()
 
-def get_user_rank(character_id: int) -> int:
-    """Get user's current rank on leaderboard"""
-    conn = get_db()
+def get_user_rank(character_id: int, shard_key: Optional[int] = None) -> int:
+    """Get user's current rank on leaderboard
+    
+    Args:
+        shard_key: the character's user id when sharded (default: this request's user)
+    """
+    conn = get_db(shard_key)
     cursor = conn.cursor()
     
     # Get character's level and XP
@@ -267,15 +329,22 @@ def get_user_rank(character_id: int) -> int:
     
     level, xp = char[0], char[1]
     
-    # Count how many characters are ahead
-    cursor.execute('''
-        SELECT COUNT(*) + 1 as rank
+    # Count how many characters are ahead (on every shard when sharded)
+    ahead_query = '''
+        SELECT COUNT(*)
         FROM character
         WHERE public_profile = 1
         AND (level > ? OR (level = ? AND xp > ?))
-    ''', (level, level, xp))
-    
-    rank = cursor.fetchone()[0]
+    '''
+    if not database.DB_SHARDS:
+        cursor.execute(ahead_query, (level, level, xp))
+        rank = cursor.fetchone()[0] + 1
+    else:
+        rank = 1
+        for shard in range(database.DB_SHARDS):
+            shard_conn = open_private_connection(shard=shard)
+            rank += shard_conn.execute(ahead_query, (level, level, xp)).fetchone()[0]
+            shard_conn.close()
     conn.close()
     
     return rank
@@ -284,7 +353,7 @@ def calculate_streak(user_id: int) -> int:
     """Calculate consecutive days with completed quests"""
     from datetime import datetime, timedelta
     
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Get all distinct dates with completed quests, ordered by date descending
@@ -296,9 +365,9 @@ def calculate_streak(user_id: int) -> int:
     ''', (user_id,))
     
     dates = [row[0] for row in cursor.fetchall()]
-    conn.close()
     
     if not dates:
+        conn.close()
         return 0
     
     # Check if there's activity today or yesterday
@@ -310,6 +379,7 @@ def calculate_streak(user_id: int) -> int:
     
     # Streak is broken if no activity today or yesterday
     if activity_dates[0] not in [today, yesterday]:
+        conn.close()
         return 0
     
     # Count consecutive days
@@ -324,40 +394,66 @@ def calculate_streak(user_id: int) -> int:
         else:
             break
     
+    # A streak reaching back to the oldest hot quest may go on into the archive, a month at a time
+    months = archived_months(cursor, None, current_date.isoformat()) if current_date == activity_dates[-1] else []
+    conn.close()
+    
+    for month in reversed(months):
+        month_start = f'{month}-01'
+        rows = query_range('''
+            SELECT DISTINCT DATE(completed_at) as quest_date
+            FROM {quest}
+            WHERE user_id = ? AND completed = 1 AND completed_at >= ? AND completed_at < ?
+            ORDER BY quest_date DESC
+        ''', (user_id, month_start, current_date.isoformat()), month_start, current_date.isoformat(), user_id)
+        
+        for row in rows:
+            date = datetime.strptime(row[0], '%Y-%m-%d').date()
+            if date != current_date - timedelta(days=1):
+                break
+            streak += 1
+            current_date = date
+        
+        # Only a streak still unbroken at the first of the month can continue into the one before
+        if current_date.isoformat() != month_start:
+            break
+    
     return streak
 
 def get_weekly_activity_graph(user_id: int, weeks: int = 4) -> List[Dict[str, Any]]:
     """Get quest completion activity for the last N weeks"""
     from datetime import datetime, timedelta
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
     activity = []
+    if weeks < 1:
+        return activity
     
     # Get last N weeks
     for week_offset in range(weeks):
         week_start_dt = datetime.now() - timedelta(weeks=week_offset, days=datetime.now().weekday())
-        week_start = week_start_dt.strftime('%Y-%m-%d')
-        week_end = (week_start_dt + timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        # Get quest count for this week
-        cursor.execute('''
-            SELECT COUNT(*) as count
-            FROM quest
-            WHERE user_id = ? AND completed = 1 
-            AND completed_at >= ? AND completed_at < ?
-        ''', (user_id, week_start, week_end))
-        
-        count = cursor.fetchone()[0]
-        
         activity.append({
-            'week_start': week_start,
+            'week_start': week_start_dt.strftime('%Y-%m-%d'),
             'week_label': week_start_dt.strftime('%b %d'),
-            'quests_completed': count
+            'quests_completed': 0
         })
     
-    conn.close()
+    # One query over the whole span (reaching into the archive only if it's that old),
+    # bucketed into weeks here
+    span_start = activity[-1]['week_start']
+    span_end = (datetime.strptime(activity[0]['week_start'], '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
+    rows = query_range('''
+        SELECT DATE(completed_at) as day, COUNT(*) as count
+        FROM {quest}
+        WHERE user_id = ? AND completed = 1 
+        AND completed_at >= ? AND completed_at < ?
+        GROUP BY day
+    ''', (user_id, span_start, span_end), span_start, span_end, user_id)
+    
+    for row in rows:
+        for week in activity:
+            if row['day'] >= week['week_start']:
+                week['quests_completed'] += row['count']
+                break
     
     # Reverse to show oldest to newest
     return list(reversed(activity))
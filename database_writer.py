@@ -0,0 +1,347 @@
+"""
+Write path for Quest Master
+Single writer thread that group-commits mutating database calls, optionally
+hosted in a sidecar process that every gunicorn worker sends its writes to
+"""
+
+import json
+import os
+import queue
+import random
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+# 'direct' runs writes on the calling thread (each helper commits itself),
+# 'latency' and 'throughput' route them through the writer thread
+DB_WRITE_MODE = os.environ.get('DB_WRITE_MODE', 'direct')
+# When set, workers send writes to the sidecar writer listening on this Unix socket
+DB_WRITER_SOCKET = os.environ.get('DB_WRITER_SOCKET', '')
+
+# Write helpers by name; these are the commands the sidecar accepts
+WRITE_COMMANDS: Dict[str, Callable] = {}
+
+# Exceptions re-raised on the worker side when the sidecar reports them
+REMOTE_EXCEPTIONS = {
+    'IntegrityError': sqlite3.IntegrityError,
+    'OperationalError': sqlite3.OperationalError,
+    'ValueError': ValueError,
+    'KeyError': KeyError,
+    'TypeError': TypeError,
+}
+
+# Seconds a transaction keeps retrying SQLITE_BUSY/LOCKED before giving up
+DB_BUSY_DEADLINE = float(os.environ.get('DB_BUSY_DEADLINE', 10))
+# First and largest backoff between retries (jittered)
+DB_BUSY_BASE_DELAY = float(os.environ.get('DB_BUSY_BASE_DELAY', 0.005))
+DB_BUSY_MAX_DELAY = float(os.environ.get('DB_BUSY_MAX_DELAY', 0.5))
+
+# How long the writer waits to grow a group, and how large a group may get
+WRITE_MODES = {
+    'latency': {'window': 0.0, 'max_batch': 16},
+    'throughput': {'window': 0.005, 'max_batch': 256},
+}
+
+# SQLITE_BUSY retry layer
+_contention: Dict[str, Dict[str, float]] = {}
+_contention_lock = threading.Lock()
+
+def is_busy_error(error: Exception) -> bool:
+    """Check whether an error means another connection holds the lock"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+def record_contention(call_site: str, retries: int, lock_wait: float, failed: bool = False):
+    """Add one transaction's retry count and lock-wait time to its call site's totals"""
+    with _contention_lock:
+        stats = _contention.get(call_site)
+        if stats is None:
+            stats = _contention[call_site] = {
+                'calls': 0, 'retries': 0, 'failures': 0, 'lock_wait_seconds': 0.0, 'max_lock_wait_seconds': 0.0
+            }
+        stats['calls'] += 1
+        stats['retries'] += retries
+        stats['failures'] += 1 if failed else 0
+        stats['lock_wait_seconds'] += lock_wait
+        stats['max_lock_wait_seconds'] = max(stats['max_lock_wait_seconds'], lock_wait)
+    metrics.inc('db_busy_retries_total', retries, call_site=call_site)
+    metrics.inc('db_lock_wait_seconds_total', lock_wait, call_site=call_site)
+    if failed:
+        metrics.inc('db_busy_failures_total', call_site=call_site)
+
+def contention_stats() -> Dict[str, Dict[str, float]]:
+    """Get a snapshot of per-call-site retry counts and lock-wait time"""
+    with _contention_lock:
+        return {call_site: dict(stats) for call_site, stats in _contention.items()}
+
+def run_with_busy_retry(call_site: str, fn: Callable) -> Any:
+    """Run a whole transaction, retrying it with jittered exponential backoff while the database is busy
+    
+    fn must roll back its own work on error (shared_connection does), so a retry starts clean.
+    """
+    import database
+
+    started = time.monotonic()
+    retries = 0
+    while True:
+        attempt_started = time.monotonic()
+        try:
+            result = fn()
+        except sqlite3.OperationalError as e:
+            elapsed = time.monotonic() - started
+            if not is_busy_error(e) or elapsed >= DB_BUSY_DEADLINE:
+                if is_busy_error(e):
+                    record_contention(call_site, retries, elapsed, failed=True)
+                    print(f"ERROR: {call_site} gave up after {retries} retries ({elapsed:.2f}s): {e}")
+                raise
+
+            delay = min(DB_BUSY_MAX_DELAY, DB_BUSY_BASE_DELAY * (2 ** retries))
+            time.sleep(min(random.uniform(delay / 2, delay), DB_BUSY_DEADLINE - elapsed))
+            retries += 1
+            continue
+
+        # Time lost to earlier attempts plus time the final attempt waited for the lock
+        lock_wait = (attempt_started - started) + database.last_lock_wait()
+        record_contention(call_site, retries, lock_wait)
+        return result
+
+def run_in_transaction(call_site: str, fn: Callable, args: tuple = (), kwargs: Optional[Dict[str, Any]] = None) -> Any:
+    """Run a helper as one retried write transaction on this thread"""
+    import database
+
+    def attempt():
+        with database.shared_connection(transactional=True):
+            return fn(*args, **(kwargs or {}))
+    return run_with_busy_retry(call_site, attempt)
+
+class WriteJob:
+    """One queued helper call and the future its caller is waiting on"""
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: Dict[str, Any]):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+class WriteQueue:
+    """Serializes write helpers onto one thread and commits each group in a single transaction"""
+
+    def __init__(self, window: float = 0.0, max_batch: int = 16):
+        self.window = window
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.stats = {'jobs': 0, 'commits': 0, 'failed_commits': 0}
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        """Queue a helper call and block until its group commits; re-raises the helper's error"""
+        job = WriteJob(fn, args, kwargs)
+        self.jobs.put(job)
+        return job.future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.monotonic() + self.window
+
+            # Collect whatever else arrives within the window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self.jobs.get(timeout=remaining))
+                    else:
+                        batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._commit_group(batch)
+
+    def _commit_group(self, batch):
+        """Run a group of jobs in one transaction; each job gets a savepoint so its errors stay its own"""
+        import database
+
+        def attempt():
+            outcomes = []
+            with database.shared_connection(transactional=True) as conn:
+                for job in batch:
+                    try:
+                        with database.savepoint(conn, 'write_job'):
+                            outcomes.append((job, job.fn(*job.args, **job.kwargs), None))
+                    except Exception as e:
+                        # A busy error inside a job means the whole group has to retry
+                        if is_busy_error(e):
+                            raise
+                        outcomes.append((job, None, e))
+            return outcomes
+
+        try:
+            outcomes = run_with_busy_retry('write_queue', attempt)
+        except Exception as e:
+            # The commit itself failed, so nothing in the group was written
+            self.stats['failed_commits'] += 1
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        self.stats['jobs'] += len(batch)
+        self.stats['commits'] += 1
+        for job, result, error in outcomes:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+_queue: Optional[WriteQueue] = None
+_queue_lock = threading.Lock()
+
+def configure(mode: str):
+    """Switch write mode ('direct', 'latency' or 'throughput')"""
+    global DB_WRITE_MODE, _queue
+    if mode != 'direct' and mode not in WRITE_MODES:
+        raise ValueError(f"Unknown write mode: {mode}")
+
+    with _queue_lock:
+        DB_WRITE_MODE = mode
+        # A running writer thread keeps draining jobs already submitted to it
+        _queue = None
+
+def get_write_queue() -> Optional[WriteQueue]:
+    """Get this process's writer queue, starting it on first use (None in direct mode)"""
+    global _queue
+    if DB_WRITE_MODE == 'direct':
+        return None
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteQueue(**WRITE_MODES[DB_WRITE_MODE])
+    return _queue
+
+def db_write(fn: Callable) -> Callable:
+    """Mark a database helper as mutating so it runs on the configured write path"""
+    WRITE_COMMANDS[fn.__name__] = fn
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        import database
+
+        # Nested helper calls, the writer thread itself and open transactions run inline
+        if database.in_transaction_scope():
+            return fn(*args, **kwargs)
+
+        # Shards each have their own write lock; funnelling them through one
+        # writer would undo that, and the writer doesn't know the request's shard
+        if database.DB_SHARDS:
+            return run_in_transaction(fn.__name__, fn, args, kwargs)
+
+        if DB_WRITER_SOCKET:
+            try:
+                return send_write_command(fn.__name__, args, kwargs)
+            except WriterUnavailable as e:
+                # Keep serving if the sidecar is down; the write just contends for the lock
+                print(f"WARNING: DB writer unavailable ({e}), writing {fn.__name__} locally")
+
+        write_queue = get_write_queue()
+        if write_queue is None:
+            return run_in_transaction(fn.__name__, fn, args, kwargs)
+        return write_queue.submit(fn, args, kwargs)
+    return wrapper
+
+# Sidecar writer process
+_client = threading.local()
+
+class WriterUnavailable(ConnectionError):
+    """Raised when the sidecar writer can't be reached, before anything was sent"""
+
+def send_write_command(name: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+    """Run a write helper in the sidecar writer and return its result"""
+    stream = getattr(_client, 'stream', None)
+    if stream is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(DB_WRITER_SOCKET)
+        except OSError as e:
+            sock.close()
+            raise WriterUnavailable(str(e))
+        stream = _client.stream = sock.makefile('rwb')
+
+    try:
+        stream.write(json.dumps({'op': name, 'args': args, 'kwargs': kwargs}).encode() + b'\n')
+        stream.flush()
+        line = stream.readline()
+    except OSError as e:
+        line = b''
+    if not line:
+        # The command may or may not have been applied, so it must not be retried locally
+        _client.stream = None
+        raise ConnectionError(f'DB writer connection lost during {name}')
+
+    reply = json.loads(line)
+    if not reply['ok']:
+        raise REMOTE_EXCEPTIONS.get(reply['type'], RuntimeError)(reply['error'])
+    return reply['result']
+
+class WriteCommandHandler(socketserver.StreamRequestHandler):
+    """Serves one worker connection: a JSON command per line, a JSON reply per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                command = json.loads(line)
+                fn = WRITE_COMMANDS[command['op']]
+                result = self.server.write_queue.submit(fn, tuple(command.get('args', ())), command.get('kwargs', {}))
+                reply = {'ok': True, 'result': result}
+            except Exception as e:
+                reply = {'ok': False, 'type': type(e).__name__, 'error': str(e)}
+
+            self.wfile.write(json.dumps(reply, default=str).encode() + b'\n')
+            self.wfile.flush()
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(socket_path: str):
+    """Run the sidecar writer: one process owning every write, group-committed"""
+    global DB_WRITER_SOCKET
+    import database
+    import database_social  # registers the social write helpers
+
+    # The sidecar writes itself rather than forwarding to a socket
+    DB_WRITER_SOCKET = ''
+    database.init_db()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    mode = DB_WRITE_MODE if DB_WRITE_MODE in WRITE_MODES else 'latency'
+    server = WriterServer(socket_path, WriteCommandHandler)
+    server.write_queue = WriteQueue(**WRITE_MODES[mode])
+    # Transactions and busy retries counted here reach /metrics through METRICS_DIR
+    metrics.start_flusher(role='writer')
+    print(f"🖊️  DB writer ({mode}) listening on {socket_path} with {len(WRITE_COMMANDS)} commands")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == '__main__':
+    # Import by name so the helpers register with the same module object
+    import database_writer
+    database_writer.serve(sys.argv[1] if len(sys.argv) > 1 else DB_WRITER_SOCKET or 'quest_master_writer.sock')
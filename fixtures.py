@@ -0,0 +1,168 @@
+"""
+Fixture Loader
+Seeds users, characters, quest histories and battles in bulk so tests and
+benchmarks start from a known population without going through the API.
+
+Rows are built from a seed, so the same arguments give the same data. Every
+user gets the password FIXTURE_PASSWORD. Pair it with an in-memory or tmpfs
+storage target to keep disk I/O out of the numbers:
+
+    import database, fixtures
+    database.configure_storage(':memory:')
+    database.init_db()
+    players = fixtures.load_fixtures(users=5000, quests_per_user=20)
+
+Usage: python fixtures.py [--users 1000] [--quests 20] [--battles 5] [--seed 0] [--database quest_master.db]
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import database
+
+FIXTURE_PASSWORD = 'password'
+FIXTURE_HISTORY_DAYS = 90
+DIFFICULTIES = ('easy', 'medium', 'hard', 'epic')
+MONSTERS = ('Goblin', 'Skeleton', 'Orc', 'Troll', 'Dragon')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def build_player(rng: random.Random, user_id: int, username: str, quests: int, battles: int,
+                 now: datetime) -> Dict[str, Any]:
+    """Build one player's character, quest and battle rows (character ids are filled in later)"""
+    level = rng.randint(1, 20)
+    quest_rows = []
+    for index in range(quests):
+        difficulty = rng.choice(DIFFICULTIES)
+        xp_reward, gold_reward = database.calculate_quest_rewards(difficulty)
+        created = now - timedelta(days=rng.uniform(0, FIXTURE_HISTORY_DAYS))
+        completed_at = None
+        if rng.random() < 0.7:
+            completed_at = min(created + timedelta(hours=rng.uniform(0, 48)), now).strftime(TIMESTAMP_FORMAT)
+        quest_rows.append((user_id, f'Quest {index + 1}', f'Fixture quest {index + 1} for {username}',
+                           difficulty, xp_reward, gold_reward, completed_at is not None,
+                           created.strftime(TIMESTAMP_FORMAT), completed_at))
+
+    battle_rows = []
+    for _ in range(battles):
+        monster_level = max(1, level + rng.randint(-2, 2))
+        won = rng.random() < 0.6
+        battled_at = (now - timedelta(days=rng.uniform(0, FIXTURE_HISTORY_DAYS))).strftime(TIMESTAMP_FORMAT)
+        battle_rows.append([None, rng.choice(MONSTERS), monster_level, won,
+                            (30 if won else 5) * monster_level, 20 * monster_level if won else 0, battled_at])
+
+    return {
+        'user_id': user_id,
+        'username': username,
+        'character': (user_id, username.capitalize(), level,
+                      rng.randrange(database.calculate_xp_for_next_level(level)), rng.randint(0, 5000),
+                      100 + 10 * (level - 1), 10 + 2 * (level - 1), 5 + (level - 1), rng.random() < 0.8,
+                      sum(1 for row in quest_rows if row[6]), sum(1 for row in battle_rows if row[3])),
+        'quests': quest_rows,
+        'battles': battle_rows,
+    }
+
+def insert_players(conn, players: List[Dict[str, Any]], password_hash: str):
+    """Insert players into one database (or shard) in a single transaction, filling in character ids"""
+    cursor = conn.cursor()
+    cursor.executemany('INSERT INTO user (id, username, password_hash) VALUES (?, ?, ?)',
+                       [(player['user_id'], player['username'], password_hash) for player in players])
+    usernames = json.dumps([player['username'] for player in players])
+    cursor.execute('SELECT username, id FROM user WHERE username IN (SELECT value FROM json_each(?))', (usernames,))
+    user_ids = dict(cursor.fetchall())
+    for player in players:
+        player['user_id'] = user_ids[player['username']]
+        player['character'] = (player['user_id'],) + player['character'][1:]
+
+    cursor.executemany('''
+        INSERT INTO character (user_id, name, level, xp, gold, max_health, attack, defense, public_profile,
+                               total_quests_completed, total_monsters_defeated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [player['character'] for player in players])
+    cursor.execute('SELECT user_id, id FROM character WHERE user_id IN (SELECT value FROM json_each(?))',
+                   (json.dumps(list(user_ids.values())),))
+    character_ids = dict(cursor.fetchall())
+
+    cursor.executemany('''
+        INSERT INTO quest (user_id, title, description, difficulty, xp_reward, gold_reward, completed, created_at, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((player['user_id'],) + row[1:] for player in players for row in player['quests']))
+    cursor.executemany('''
+        INSERT INTO battle (character_id, monster_name, monster_level, won, xp_gained, gold_gained, battled_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', ([character_ids[player['user_id']]] + row[1:] for player in players for row in player['battles']))
+    conn.commit()
+
+    for player in players:
+        player['character_id'] = character_ids[player['user_id']]
+
+def load_fixtures(users: int = 1000, quests_per_user: int = 20, battles_per_user: int = 5, seed: int = 0,
+                  prefix: str = 'player', now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Seed users with characters, quests and battles; returns their user_id, username and character_id
+
+    Usernames are prefix + a zero-padded index, so a second load into the same
+    database needs another prefix.
+    """
+    from password_hashing import hash_password
+
+    now = now or datetime.utcnow()
+    # One hash for everyone: hashing thousands of passwords would dominate the load
+    password_hash = hash_password(FIXTURE_PASSWORD)
+    usernames = [f'{prefix}{index:06d}' for index in range(users)]
+
+    # Sharded, the directory hands out the ids and each shard loads its own users
+    user_ids = [None] * users
+    if database.DB_SHARDS:
+        conn = database.open_catalog_connection()
+        conn.executemany('INSERT INTO user_directory (username) VALUES (?)', ((name,) for name in usernames))
+        conn.commit()
+        rows = conn.execute('SELECT username, id FROM user_directory WHERE username IN (SELECT value FROM json_each(?))',
+                            (json.dumps(usernames),)).fetchall()
+        conn.close()
+        directory = dict(rows)
+        user_ids = [directory[name] for name in usernames]
+
+    groups = {}
+    for user_id, username in zip(user_ids, usernames):
+        # Seeded per user, so a player's rows don't depend on which shard they land on
+        rng = random.Random(f'{seed}:{username}')
+        shard = database.shard_for_user(user_id) if database.DB_SHARDS else None
+        groups.setdefault(shard, []).append(build_player(rng, user_id, username, quests_per_user, battles_per_user, now))
+
+    players = []
+    for shard, members in groups.items():
+        conn = database.open_connection(shard=shard)
+        try:
+            insert_players(conn, members, password_hash)
+        finally:
+            conn.close()
+        players.extend(members)
+
+    return [{'user_id': player['user_id'], 'username': player['username'], 'character_id': player['character_id']}
+            for player in players]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--quests', type=int, default=20, help='quests per user')
+    parser.add_argument('--battles', type=int, default=5, help='battles per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='player', help='username prefix')
+    parser.add_argument('--database', help='storage target (default: DATABASE_PATH)')
+    args = parser.parse_args()
+
+    if args.database:
+        database.configure_storage(args.database)
+    database.init_db()
+
+    started = time.perf_counter()
+    players = load_fixtures(args.users, args.quests, args.battles, args.seed, args.prefix)
+    elapsed = time.perf_counter() - started
+    print(f"✓ Loaded {len(players)} users, {len(players) * args.quests} quests and "
+          f"{len(players) * args.battles} battles in {elapsed:.2f}s")
+    print(f"  Log in as {players[0]['username']} / {FIXTURE_PASSWORD}")
+
+if __name__ == '__main__':
+    main()
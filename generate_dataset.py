@@ -0,0 +1,414 @@
+"""
+Synthetic Dataset Generator
+Builds a production-sized Quest Master database for performance work: users with
+power-law activity, quest histories made of streaks and gaps, battles, inventories,
+daily challenge progress and a character audit log. Levels, stats and rewards follow
+the game's own rules (calculate_xp_for_next_level, calculate_quest_rewards, battle
+rewards, per-level stat gains plus equipped item bonuses).
+
+The output is always a fresh file. It's loaded with journaling off, synchronous off
+and an exclusive lock, and without the change-log triggers and secondary indexes.
+Those are rebuilt at the end, followed by ANALYZE. If a run dies mid-load, delete the
+file and start again. Every user's password is fixtures.FIXTURE_PASSWORD.
+
+Rows are built by worker processes, one chunk of users at a time, while the main
+process inserts them. Each chunk is seeded from --seed and its position, so the
+output doesn't depend on the worker count.
+
+Usage: python generate_dataset.py [output.db] [--users 1000000] [--quests 50000000] [--battles 20000000]
+                                  [--days 365] [--public 0.85] [--seed 0] [--workers N] [--force]
+"""
+import argparse
+import bisect
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import database
+from fixtures import FIXTURE_PASSWORD
+
+# Pareto shape for per-user activity (about 1.16 gives the 80/20 rule), capped so one
+# user can't own a visible share of the whole table
+ACTIVITY_ALPHA = 1.16
+ACTIVITY_CAP = 200.0
+QUEST_COMPLETION_RATE = 0.85
+BATTLE_WIN_RATE = 0.65
+# Days of daily challenges (and progress on them) to generate, counting back from today
+CHALLENGE_DAYS = 28
+# Users generated and inserted per executemany batch
+CHUNK_USERS = 5000
+# Tables the generator fills; their triggers and secondary indexes are dropped for the load and rebuilt afterwards
+BULK_TABLES = ('user', 'character', 'quest', 'battle', 'inventory', 'user_daily_challenge', 'character_audit_log')
+MONSTERS = ('Goblin', 'Skeleton', 'Orc', 'Troll', 'Dragon')
+
+# Read by view_audit_log.py and written by the app when present
+AUDIT_LOG_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS character_audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        character_id INTEGER,
+        event_type TEXT NOT NULL,
+        old_level INTEGER,
+        new_level INTEGER,
+        old_xp INTEGER,
+        new_xp INTEGER,
+        old_gold INTEGER,
+        new_gold INTEGER,
+        triggered_by TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Total XP needed to reach each level, for turning lifetime XP into (level, xp)
+LEVEL_THRESHOLDS = [0]
+for _level in range(1, 200):
+    LEVEL_THRESHOLDS.append(LEVEL_THRESHOLDS[-1] + database.calculate_xp_for_next_level(_level))
+
+def level_for_xp(total_xp: int) -> tuple:
+    """Get the (level, xp into that level) a character reaches with total_xp lifetime XP"""
+    level = bisect.bisect_right(LEVEL_THRESHOLDS, total_xp)
+    return level, total_xp - LEVEL_THRESHOLDS[level - 1]
+
+def streak_days(rng: random.Random, needed: int, signup_ago: int, weight: float) -> List[int]:
+    """Pick active days (as days ago, newest first) in runs of consecutive days split by gaps
+
+    Heavier users play longer runs and are more likely to still be on a streak today.
+    """
+    still_active = rng.random() < 0.3 + 0.5 * min(1.0, weight / 10)
+    day = 0 if still_active else rng.randint(1, max(1, signup_ago))
+    run_mean = 2 + min(weight, 30)
+    days = []
+    while len(days) < needed and day <= signup_ago:
+        run = int(rng.expovariate(1 / run_mean)) + 1
+        days.extend(range(day, min(day + run, signup_ago + 1)))
+        day += run + int(rng.expovariate(1 / 3)) + 1
+    return days[:needed] or [signup_ago]
+
+class Generator:
+    """Builds the rows for chunks of users from the catalog and challenge rows already in the file"""
+
+    def __init__(self, conn, days: int, public_ratio: float, seed: int, password_hash: str):
+        self.seed = seed
+        self.days = days
+        self.public_ratio = public_ratio
+        self.password_hash = password_hash
+        self.rng = None
+
+        today = datetime.utcnow().date()
+        self.day_strings = [(today - timedelta(days=ago)).strftime('%Y-%m-%d') for ago in range(days + 1)]
+        self.time_strings = [f' {minute // 60:02d}:{minute % 60:02d}:00' for minute in range(24 * 60)]
+
+        cursor = conn.cursor()
+        cursor.execute('SELECT title, description, difficulty FROM task_template')
+        self.templates = [(row[0], row[1], row[2], *database.calculate_quest_rewards(row[2])) for row in cursor.fetchall()]
+        cursor.execute('SELECT id, type, price, attack_bonus, defense_bonus, health_bonus FROM item ORDER BY price')
+        self.items = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute('SELECT id, challenge_date, challenge_type, target_value FROM daily_challenge')
+        self.challenges = {}
+        for challenge_id, challenge_date, challenge_type, target in cursor.fetchall():
+            self.challenges.setdefault(challenge_date, []).append((challenge_id, challenge_type, target))
+
+    def build_user(self, user_id: int, weight: float, quest_count: int, battle_count: int, rows: Dict[str, list]):
+        """Append one user's rows to the chunk's row lists"""
+        rng = self.rng
+        # random() arithmetic instead of randrange()/choice() in the per-row loops: several times cheaper
+        rand = rng.random
+        days = self.day_strings
+        times = self.time_strings
+        templates = self.templates
+
+        # Older accounts skew active; a user needs enough days to fit their quests at a few a day
+        per_day = rng.randint(1, 5)
+        active_needed = max(1, math.ceil(quest_count / per_day))
+        signup_ago = min(self.days, max(int(self.days * rng.random() ** 0.7), active_needed // 2))
+        active = streak_days(rng, active_needed, signup_ago, weight)
+        signup = days[signup_ago] + times[int(rand() * 1440)]
+
+        # Quests, tallying what each day earned for challenge progress
+        total_xp = total_gold = completed = 0
+        last_completed = None
+        per_day_stats = {}
+        for _ in range(quest_count):
+            ago = active[int(rand() * len(active))]
+            minute = int(rand() * 1380)
+            title, description, difficulty, xp_reward, gold_reward = templates[int(rand() * len(templates))]
+            created_at = days[ago] + times[minute]
+            if rand() < QUEST_COMPLETION_RATE:
+                completed_at = days[ago] + times[minute + 1 + int(rand() * 59)]
+                completed += 1
+                total_xp += xp_reward
+                total_gold += gold_reward
+                if last_completed is None or completed_at > last_completed:
+                    last_completed = completed_at
+                if ago < CHALLENGE_DAYS:
+                    stats = per_day_stats.setdefault(ago, dict.fromkeys(
+                        ('complete_quests', 'earn_xp', 'earn_gold', 'battle_monsters', 'combo_master', 'hard_quest'), 0))
+                    stats['complete_quests'] += 1
+                    stats['earn_xp'] += xp_reward
+                    stats['earn_gold'] += gold_reward
+                    stats['hard_quest'] += difficulty == 'hard'
+                    stats['combo_master'] = max(stats['combo_master'], stats['complete_quests'] >= 3)
+                rows['quest'].append((user_id, title, description, difficulty, xp_reward, gold_reward, 1,
+                                      created_at, completed_at))
+            else:
+                rows['quest'].append((user_id, title, description, difficulty, xp_reward, gold_reward, 0,
+                                      created_at, None))
+
+        # Battles against monsters around the level the quests alone would give
+        quest_level = level_for_xp(total_xp)[0]
+        won_count = 0
+        lowest_monster = max(1, quest_level - 3)
+        monster_levels = quest_level + 2 - lowest_monster
+        for _ in range(battle_count):
+            ago = active[int(rand() * len(active))]
+            monster_level = lowest_monster + int(rand() * monster_levels)
+            won = rand() < BATTLE_WIN_RATE
+            xp_gained = (30 if won else 5) * monster_level
+            gold_gained = 20 * monster_level if won else 0
+            total_xp += xp_gained
+            total_gold += gold_gained
+            won_count += won
+            if won and ago < CHALLENGE_DAYS and ago in per_day_stats:
+                per_day_stats[ago]['battle_monsters'] += 1
+            rows['battle'].append((user_id, MONSTERS[int(rand() * len(MONSTERS))], monster_level, won, xp_gained,
+                                   gold_gained, days[ago] + times[int(rand() * 1440)]))
+
+        level, xp = level_for_xp(total_xp)
+
+        # Spend part of the gold in the shop, equipping the best item of each type
+        budget = int(total_gold * rng.uniform(0.2, 0.9))
+        spent = 0
+        best = {}
+        owned = set()
+        for _ in range(8):
+            affordable = [item for item in self.items if item[2] <= budget - spent and item[0] not in owned]
+            if not affordable:
+                break
+            item = rng.choice(affordable[-6:])
+            owned.add(item[0])
+            spent += item[2]
+            if item[1] not in best or item[2] > best[item[1]][2]:
+                best[item[1]] = item
+        bonus_attack = sum(item[3] for item in best.values())
+        bonus_defense = sum(item[4] for item in best.values())
+        bonus_health = sum(item[5] for item in best.values())
+        equipped = {item[0] for item in best.values()}
+        for item_id in owned:
+            rows['inventory'].append((user_id, item_id, 1, int(item_id in equipped)))
+
+        max_health = 100 + (level - 1) * 10 + bonus_health
+        rows['user'].append((user_id, f'player{user_id:07d}', self.password_hash, 0, signup))
+        rows['character'].append((user_id, user_id, f'Player{user_id:07d}', level, xp, total_gold - spent,
+                                  max_health, max_health, 10 + (level - 1) * 3 + bonus_attack,
+                                  5 + (level - 1) * 2 + bonus_defense, 0, last_completed, signup,
+                                  rng.choice(('Warrior', 'Mage', 'Rogue', 'Ranger')), rng.randint(1, 8),
+                                  rng.choice(('orange', 'blue', 'green', 'purple')), '',
+                                  rng.random() < self.public_ratio, completed, won_count))
+
+        # Challenge progress on recent active days
+        for ago, stats in per_day_stats.items():
+            for challenge_id, challenge_type, target in self.challenges.get(days[ago], ()):
+                progress = stats[challenge_type]
+                if progress:
+                    done = progress >= target
+                    rows['user_daily_challenge'].append((user_id, challenge_id, progress, done,
+                                                         done and rng.random() < 0.7,
+                                                         days[ago] + ' 23:00:00' if done else None))
+
+        # Audit trail: creation, then one row per level gained
+        rows['character_audit_log'].append((user_id, user_id, 'CHARACTER_CREATED', None, 1, None, 0, None, 0,
+                                            'create_character_for_user', signup))
+        level_days = sorted(active, reverse=True)
+        for reached in range(2, level + 1):
+            ago = level_days[min(len(level_days) - 1, (reached - 1) * len(level_days) // level)]
+            rows['character_audit_log'].append((user_id, user_id, 'LEVEL_UP', reached - 1, reached,
+                                                database.calculate_xp_for_next_level(reached - 1), 0, None, None,
+                                                'add_xp_and_gold', days[ago] + times[int(rand() * 1440)]))
+
+    def build_chunk(self, job: tuple) -> Dict[str, list]:
+        """Build the rows for one chunk of users: (first user id, activity weights, quest and battle scale)"""
+        first_id, weights, quest_scale, battle_scale = job
+        self.rng = random.Random(f'{self.seed}:{first_id}')
+        rows = {table: [] for table in BULK_TABLES}
+        for offset, weight in enumerate(weights):
+            # Rounded at random so the totals come out right on average
+            self.build_user(first_id + offset, weight, int(weight * quest_scale + self.rng.random()),
+                            int(weight * battle_scale + self.rng.random()), rows)
+        return rows
+
+# Each worker process builds chunks with its own copy of the generator
+_generator: Optional[Generator] = None
+
+def init_worker(generator: Generator):
+    global _generator
+    _generator = generator
+
+def build_chunk(job: tuple) -> Dict[str, list]:
+    return _generator.build_chunk(job)
+
+def insert_rows(conn, rows: Dict[str, list]):
+    """Write one chunk's rows in one transaction"""
+    cursor = conn.cursor()
+    cursor.executemany('INSERT INTO user (id, username, password_hash, data_version, created_at) VALUES (?, ?, ?, ?, ?)',
+                       rows['user'])
+    cursor.executemany('''
+        INSERT INTO character (id, user_id, name, level, xp, gold, health, max_health, attack, defense, combo_count,
+                               last_quest_completed, created_at, character_class, avatar_id, color_theme, bio,
+                               public_profile, total_quests_completed, total_monsters_defeated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows['character'])
+    cursor.executemany('''
+        INSERT INTO quest (user_id, title, description, difficulty, xp_reward, gold_reward, completed,
+                           created_at, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows['quest'])
+    cursor.executemany('''
+        INSERT INTO battle (character_id, monster_name, monster_level, won, xp_gained, gold_gained, battled_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows['battle'])
+    cursor.executemany('INSERT INTO inventory (character_id, item_id, quantity, equipped_count) VALUES (?, ?, ?, ?)',
+                       rows['inventory'])
+    cursor.executemany('''
+        INSERT INTO user_daily_challenge (user_id, challenge_id, progress, completed, claimed, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows['user_daily_challenge'])
+    cursor.executemany('''
+        INSERT INTO character_audit_log (user_id, character_id, event_type, old_level, new_level, old_xp, new_xp,
+                                         old_gold, new_gold, triggered_by, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows['character_audit_log'])
+    conn.commit()
+
+def load_users(conn, generator: Generator, users: int, quests: int, battles: int, workers: int) -> Dict[str, int]:
+    """Build every user's rows (in worker processes when workers > 1) and insert them chunk by chunk"""
+    rng = random.Random(generator.seed)
+    weights = [min(rng.paretovariate(ACTIVITY_ALPHA), ACTIVITY_CAP) for _ in range(users)]
+    quest_scale = quests / sum(weights)
+    battle_scale = battles / sum(weights)
+    jobs = [(start + 1, weights[start:start + CHUNK_USERS], quest_scale, battle_scale)
+            for start in range(0, users, CHUNK_USERS)]
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(generator,))
+        chunks = pool.imap(build_chunk, jobs)
+    else:
+        chunks = map(generator.build_chunk, jobs)
+
+    counts = dict.fromkeys(BULK_TABLES, 0)
+    started = time.perf_counter()
+    try:
+        for rows in chunks:
+            insert_rows(conn, rows)
+            for table in BULK_TABLES:
+                counts[table] += len(rows[table])
+            elapsed = time.perf_counter() - started
+            print(f"  {counts['user']}/{users} users, {counts['quest']} quests, {counts['battle']} battles "
+                  f"({elapsed:.0f}s, {counts['user'] / elapsed:.0f} users/s)", flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return counts
+
+def generate(output: str, users: int, quests: int, battles: int, days: int = 365, public_ratio: float = 0.85,
+             seed: int = 0, workers: int = 1) -> Dict[str, Any]:
+    """Generate a dataset into a new database file and return row counts and timings"""
+    from password_hashing import hash_password
+
+    started = time.perf_counter()
+    random.seed(seed)
+
+    conn = sqlite3.connect(output)
+    conn.row_factory = sqlite3.Row
+    database.create_schema(conn)
+    conn.execute(AUDIT_LOG_SCHEMA)
+    conn.commit()
+    conn.close()
+
+    # The app's own generator makes the challenge rows
+    database.configure_storage(output)
+    today = datetime.utcnow().date()
+    for ago in range(min(CHALLENGE_DAYS, days + 1)):
+        database.generate_daily_challenges((today - timedelta(days=ago)).strftime('%Y-%m-%d'))
+
+    conn = sqlite3.connect(output)
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.execute('PRAGMA locking_mode=EXCLUSIVE')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-262144')
+
+    # Bulk inserts go faster with no triggers to fire and no secondary indexes to update
+    placeholders = ', '.join('?' for _ in BULK_TABLES)
+    cursor.execute(f'''
+        SELECT type, name FROM sqlite_master
+        WHERE (type = 'trigger' OR (type = 'index' AND sql IS NOT NULL)) AND tbl_name IN ({placeholders})
+    ''', BULK_TABLES)
+    for kind, name in cursor.fetchall():
+        cursor.execute(f'DROP {kind.upper()} {name}')
+    conn.commit()
+
+    # One hash for everyone: hashing a million passwords would take longer than the load
+    generator = Generator(conn, days, public_ratio, seed, hash_password(FIXTURE_PASSWORD))
+    counts = load_users(conn, generator, users, quests, battles, workers)
+    loaded = time.perf_counter()
+
+    # Rebuild the dropped indexes and triggers the way init_db makes them, back in WAL mode
+    print("  Rebuilding indexes and triggers...", flush=True)
+    conn.execute('PRAGMA locking_mode=NORMAL')
+    conn.row_factory = sqlite3.Row
+    database.create_schema(conn)
+    print("  Running ANALYZE...", flush=True)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+    return {
+        'counts': counts,
+        'load_seconds': loaded - started,
+        'seconds': time.perf_counter() - started,
+        'bytes': os.path.getsize(output),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', nargs='?', default='quest_master_synthetic.db')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--quests', type=int, default=5000000, help='total quests')
+    parser.add_argument('--battles', type=int, default=2000000, help='total battles')
+    parser.add_argument('--days', type=int, default=365, help='days of history')
+    parser.add_argument('--public', type=float, default=0.85, help='share of public profiles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes building rows')
+    parser.add_argument('--force', action='store_true', help='replace the output file if it exists')
+    args = parser.parse_args()
+
+    if database.DB_SHARDS:
+        print("✗ The generator builds the single-file layout only (DB_SHARDS is set)")
+        raise SystemExit(1)
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"✗ {args.output} already exists (use --force to replace it)")
+            raise SystemExit(1)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    print(f"🏗️  Generating {args.users} users, ~{args.quests} quests, ~{args.battles} battles into {args.output}")
+    report = generate(args.output, args.users, args.quests, args.battles, args.days, args.public, args.seed,
+                      args.workers)
+
+    print(f"\n✓ Done in {report['seconds']:.0f}s ({report['load_seconds']:.0f}s loading), "
+          f"{report['bytes'] / 1024 / 1024:.0f} MB")
+    for table, count in report['counts'].items():
+        print(f"  {table}: {count}")
+    print(f"  Log in as player0000001 / {FIXTURE_PASSWORD}; serve it with DATABASE_PATH={args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Gunicorn settings for Quest Master
+Runs threaded workers, starts the sidecar DB writer when DB_WRITER_SOCKET is set,
+and the WAL archiver when WAL_ARCHIVE_DIR is set; clears METRICS_DIR
+"""
+import os
+import subprocess
+import sys
+import time
+
+# Threaded workers: a login waiting on the password-hashing pool ties up one thread,
+# not the whole worker, so the worker's other threads keep serving game requests
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+_writer = None
+_archiver = None
+
+def on_starting(server):
+    """Launch the DB writer (so it owns every write) and the WAL archiver before any worker forks"""
+    global _writer, _archiver
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    # Workers' metrics files hold totals since the master started
+    if os.environ.get('METRICS_DIR'):
+        if here not in sys.path:
+            sys.path.insert(0, here)
+        import metrics
+        metrics.clear_directory()
+
+    # Workers stop checkpointing when this is set, so the archiver has to be running
+    archive_dir = os.environ.get('WAL_ARCHIVE_DIR')
+    if archive_dir:
+        _archiver = subprocess.Popen([sys.executable, os.path.join(here, 'wal_archive.py'), 'archive', '--dir', archive_dir])
+
+    socket_path = os.environ.get('DB_WRITER_SOCKET')
+    if not socket_path:
+        return
+
+    writer_script = os.path.join(here, 'database_writer.py')
+    _writer = subprocess.Popen([sys.executable, writer_script, socket_path])
+
+    # Give the writer a moment to create its socket
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+def on_exit(server):
+    """Stop the DB writer and WAL archiver with the master"""
+    for process in (_writer, _archiver):
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
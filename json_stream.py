@@ -0,0 +1,68 @@
+"""
+Streaming JSON responses for Quest Master
+Encodes query rows straight from the cursor and sends them in chunks, so large
+collections don't have to fit in memory as a list of dicts plus one big string
+"""
+
+import json
+import os
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
+
+from flask import Response
+
+# Bytes of encoded JSON collected before a chunk is sent
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 32 * 1024))
+
+def encode_value(value: Any) -> str:
+    """Encode one SQLite column value as JSON (same output as jsonify)
+    
+    Raises ValueError for NaN and infinities, which have no JSON form.
+    """
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return json.dumps(value, allow_nan=False)
+    return json.dumps(value)
+
+def row_encoder(columns: Sequence[str]) -> Callable[[tuple], str]:
+    """Build an encoder that turns a plain row tuple into a JSON object, keys pre-encoded once"""
+    keys = [encode_basestring_ascii(name) + ':' for name in columns]
+
+    def encode(row: tuple) -> str:
+        return '{' + ','.join([key + encode_value(value) for key, value in zip(keys, row)]) + '}'
+    return encode
+
+def json_array_chunks(encoded: Iterable[str]) -> Iterator[str]:
+    """Join encoded elements into a JSON array, yielded in chunks of about STREAM_CHUNK_SIZE"""
+    buffer = ['[']
+    size = 1
+    first = True
+    for element in encoded:
+        if not first:
+            buffer.append(',')
+        first = False
+        buffer.append(element)
+        size += len(element) + 1
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(']')
+    yield ''.join(buffer)
+
+def stream_rows(columns: List[str], rows: Iterable[tuple]) -> Response:
+    """Stream query rows as a JSON array of objects keyed by column name"""
+    encode = row_encoder(columns)
+    return Response(json_array_chunks(encode(row) for row in rows), mimetype='application/json')
+
+def stream_objects(objects: Iterable[Any]) -> Response:
+    """Stream already-built values (e.g. computed summaries) as a JSON array, one at a time"""
+    encoded = (json.dumps(obj, separators=(',', ':')) for obj in objects)
+    return Response(json_array_chunks(encoded), mimetype='application/json')
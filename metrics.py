@@ -0,0 +1,292 @@
+"""
+Prometheus Metrics
+In-process counters and latency histograms for Quest Master, rendered in the
+Prometheus text format at /metrics.
+
+Updates never take a lock: every thread counts into its own dict, and a scrape
+adds the threads' dicts together. When a thread ends, its counts fold into one
+process-wide dict, so threads that come and go don't pile up. Gunicorn workers are separate processes, so
+with METRICS_DIR set each one also writes its totals to METRICS_DIR/metrics_<pid>.json
+every METRICS_FLUSH_INTERVAL seconds (and on exit), and a scrape on any worker sums
+every file. The sidecar DB writer publishes its own file too, with role "writer".
+Counters of processes that have exited stay in the totals; gauges such as RSS are
+reported for live processes only, labelled with their pid and role. gunicorn.conf.py clears the directory
+when the master starts, so totals restart with the server.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+# Directory where each process publishes its metrics so any worker can report them all
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# Seconds between a process's writes to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRIC_PREFIX = 'quest_master_'
+# Request latency histogram bucket bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric a process can record: name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by route, method and status'),
+    'http_request_errors_total': ('counter', 'Requests that ended in a server error (5xx), by route and method'),
+    'http_request_duration_seconds': ('histogram', 'Request latency, by route and method'),
+    'db_connections_opened_total': ('counter', 'SQLite connections opened, by kind (write, read, catalog)'),
+    'db_transactions_total': ('counter', 'Write transactions, by outcome (commit, rollback)'),
+    'db_busy_retries_total': ('counter', 'Transaction retries after SQLITE_BUSY, by call site'),
+    'db_busy_failures_total': ('counter', 'Transactions that gave up while the database stayed busy, by call site'),
+    'db_lock_wait_seconds_total': ('counter', 'Time transactions waited for the write lock, by call site'),
+    'cache_requests_total': ('counter', 'Cache lookups, by cache and result (hit, miss)'),
+}
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_local = threading.local()
+# Live threads' counters by holder id, and the totals of threads that have ended
+_stores: Dict[int, Dict[Key, Any]] = {}
+_retired: Dict[Key, Any] = {}
+_stores_lock = threading.RLock()
+_flusher: Optional[threading.Thread] = None
+# What this process is ('web' for gunicorn workers, 'writer' for the sidecar)
+_role = 'web'
+
+class _ThreadStore:
+    """Holds one thread's counters; dropped with the thread's locals when it ends"""
+    __slots__ = ('counts', '__weakref__')
+
+    def __init__(self):
+        self.counts: Dict[Key, Any] = {}
+
+def _retire(key: int, pid: int):
+    """Fold an ended thread's counters into the process totals"""
+    if pid != os.getpid():
+        # A forked child dropping the parent's thread locals; the parent still counts them
+        return
+    with _stores_lock:
+        for name, value in _stores.pop(key, {}).items():
+            _add(_retired, name, value)
+
+def _store() -> Dict[Key, Any]:
+    """Get this thread's own counters (registered once, the only time a lock is taken)"""
+    holder = getattr(_local, 'holder', None)
+    if holder is None:
+        holder = _local.holder = _ThreadStore()
+        with _stores_lock:
+            _stores[id(holder)] = holder.counts
+        weakref.finalize(holder, _retire, id(holder), os.getpid())
+    return holder.counts
+
+def inc(name: str, amount: float = 1.0, **labels: str):
+    """Add to a counter"""
+    store = _store()
+    key = (name, tuple(sorted(labels.items())))
+    store[key] = store.get(key, 0) + amount
+
+def observe(name: str, value: float, **labels: str):
+    """Record one histogram observation"""
+    store = _store()
+    key = (name, tuple(sorted(labels.items())))
+    # One count per bucket (the last is +Inf), then the sum and the total count
+    histogram = store.get(key)
+    if histogram is None:
+        histogram = store[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+    histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    histogram[-2] += value
+    histogram[-1] += 1
+
+def count_cache(cache: str, hit: bool):
+    """Count one lookup of a named cache"""
+    inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def _add(totals: Dict[Key, Any], key: Key, value: Any):
+    """Add one counter value or histogram (a list) into running totals"""
+    if isinstance(value, list):
+        merged = totals.setdefault(key, [0] * len(value))
+        for index, part in enumerate(value):
+            merged[index] += part
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+def snapshot() -> List[List[Any]]:
+    """Get this process's totals as [name, labels, value] rows (value is a list for histograms)"""
+    # Taken together, so a thread retiring meanwhile is counted exactly once
+    with _stores_lock:
+        stores = list(_stores.values())
+        retired = {key: list(value) if isinstance(value, list) else value for key, value in _retired.items()}
+    totals: Dict[Key, Any] = {}
+    for store in stores + [retired]:
+        # dict() copies in one step under the GIL, so the owning thread can keep counting
+        for key, value in dict(store).items():
+            _add(totals, key, value)
+    return [[name, dict(labels), value] for (name, labels), value in totals.items()]
+
+def resident_memory_bytes() -> int:
+    """This process's resident set size"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Not Linux: peak rather than current RSS (KiB on Linux, bytes on macOS)
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def metrics_file(pid: int) -> str:
+    """Path of one process's published metrics"""
+    return os.path.join(METRICS_DIR, f'metrics_{pid}.json')
+
+def flush():
+    """Publish this process's totals to METRICS_DIR (no-op without it)"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    pid = os.getpid()
+    payload = {'pid': pid, 'role': _role, 'written_at': time.time(), 'rss_bytes': resident_memory_bytes(), 'metrics': snapshot()}
+    # The flusher and a scrape may both write, so each thread uses its own temp file
+    partial = f'{metrics_file(pid)}.{threading.get_ident()}.tmp'
+    with open(partial, 'w') as f:
+        json.dump(payload, f, separators=(',', ':'))
+    # Readers see either the old file or the new one, never half of it
+    os.replace(partial, metrics_file(pid))
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"WARNING: metrics flush failed: {e}")
+
+def start_flusher(role: str = 'web'):
+    """Publish this process's metrics from a daemon thread (no-op without METRICS_DIR)"""
+    global _flusher, _role
+    _role = role
+    if not METRICS_DIR or _flusher is not None:
+        return
+    _flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+def _reset_after_fork():
+    """A forked worker starts from zero with its own flusher (the parent's thread didn't survive)"""
+    global _flusher, _stores, _retired, _local
+    _stores = {}
+    _retired = {}
+    _local = threading.local()
+    if _flusher is not None:
+        _flusher = None
+        start_flusher(_role)
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def clear_directory():
+    """Delete every published metrics file (the gunicorn master calls this on start)"""
+    if not METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def is_alive(pid: int) -> bool:
+    """Check whether a process still exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def collect() -> Tuple[List[List[Any]], Dict[Tuple[int, str], int]]:
+    """Sum every process's metrics; returns the [name, labels, value] rows and live processes' RSS by (pid, role)"""
+    pid = os.getpid()
+    if not METRICS_DIR:
+        return snapshot(), {(pid, _role): resident_memory_bytes()}
+
+    # Publish this process's latest numbers so the scrape includes them
+    flush()
+    totals: Dict[Key, Any] = {}
+    rss = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if is_alive(payload['pid']):
+            rss[payload['pid'], payload.get('role', 'web')] = payload['rss_bytes']
+        for name, labels, value in payload['metrics']:
+            _add(totals, (name, tuple(sorted(labels.items()))), value)
+    return [[name, dict(labels), value] for (name, labels), value in totals.items()], rss
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    """Render a label set as {name="value",...}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def format_number(value: float) -> str:
+    """Render a sample value the way Prometheus expects"""
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def render(extra_gauges: Optional[Dict[str, Tuple[str, Dict[tuple, float]]]] = None) -> str:
+    """Render every process's metrics in the Prometheus text format
+
+    Args:
+        extra_gauges: name -> (help, {label tuple: value}) gauges computed at scrape time
+    """
+    rows, rss = collect()
+    by_name: Dict[str, List[Tuple[Dict[str, Any], Any]]] = {}
+    for name, labels, value in rows:
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        samples = sorted(by_name.get(name, []), key=lambda sample: sorted(sample[0].items()))
+        full_name = METRIC_PREFIX + name
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} {kind}')
+        for labels, value in samples:
+            if kind != 'histogram':
+                lines.append(f'{full_name}{format_labels(labels)} {format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{full_name}_bucket{format_labels(dict(labels, le=le))} {cumulative}')
+            lines.append(f'{full_name}_sum{format_labels(labels)} {format_number(value[-2])}')
+            lines.append(f'{full_name}_count{format_labels(labels)} {value[-1]}')
+
+    # Hit ratio of each cache, from the summed hit and miss counters
+    lookups: Dict[str, Dict[str, float]] = {}
+    for labels, value in by_name.get('cache_requests_total', []):
+        lookups.setdefault(labels['cache'], {}).setdefault(labels['result'], 0)
+        lookups[labels['cache']][labels['result']] += value
+    gauges = {
+        'cache_hit_ratio': ('Share of cache lookups that hit, by cache',
+                            {(('cache', cache),): counts.get('hit', 0) / sum(counts.values())
+                             for cache, counts in sorted(lookups.items()) if sum(counts.values())}),
+        'process_resident_memory_bytes': ('Resident memory of each live process, by pid and role',
+                                          {(('pid', str(pid)), ('role', role)): value
+                                           for (pid, role), value in sorted(rss.items())}),
+    }
+    gauges.update(extra_gauges or {})
+    for name, (help_text, samples) in gauges.items():
+        full_name = METRIC_PREFIX + name
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} gauge')
+        for labels, value in samples.items():
+            lines.append(f'{full_name}{format_labels(dict(labels))} {format_number(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,149 @@
+"""
+Password hashing for Quest Master
+Bounded off-thread hashing pool, login admission control and rehash-on-login
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+# Hashing threads per worker process
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+# Hash jobs (running + waiting) allowed per worker before new ones are refused.
+# Keep it below gunicorn.conf.py's GUNICORN_THREADS (8): logins past the cap are
+# turned away at once, so the worker's other threads stay free for game requests.
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 4))
+# Seconds a request waits for its hash result before giving up
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 5))
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be retried later"""
+
+class HashingPool:
+    """Fixed-size thread pool with a hard cap on queued hash jobs"""
+
+    def __init__(self, workers: int, queue_limit: int, timeout: float):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max(queue_limit, workers))
+        self.timeout = timeout
+
+    def run(self, fn, *args):
+        """Run fn on the pool and wait for it, or raise HashingBusy if the pool is full"""
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # The job still finishes in the background and frees its slot
+            raise HashingBusy()
+
+_pool = HashingPool(HASH_WORKERS, HASH_QUEUE_LIMIT, HASH_TIMEOUT)
+_method_prefix: Optional[str] = None
+
+def configure(method: Optional[str] = None, workers: Optional[int] = None,
+              queue_limit: Optional[int] = None, timeout: Optional[float] = None):
+    """Replace the hashing settings (used by benchmarks and tests)"""
+    global PASSWORD_HASH_METHOD, HASH_WORKERS, HASH_QUEUE_LIMIT, HASH_TIMEOUT, _pool, _method_prefix
+
+    if method is not None:
+        PASSWORD_HASH_METHOD = method
+        _method_prefix = None
+    if workers is not None:
+        HASH_WORKERS = workers
+    if queue_limit is not None:
+        HASH_QUEUE_LIMIT = queue_limit
+    if timeout is not None:
+        HASH_TIMEOUT = timeout
+
+    old_pool = _pool
+    _pool = HashingPool(HASH_WORKERS, HASH_QUEUE_LIMIT, HASH_TIMEOUT)
+    old_pool.executor.shutdown(wait=False)
+
+def hash_password(password: str) -> str:
+    """Hash a password with the configured work factor on the hashing pool"""
+    return _pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def check_password(password_hash: str, password: str) -> bool:
+    """Check a password against its hash on the hashing pool"""
+    return _pool.run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash: str) -> bool:
+    """Check whether a stored hash was made with different cost parameters than today's"""
+    global _method_prefix
+    if _method_prefix is None:
+        # Let werkzeug expand defaults (e.g. 'scrypt' -> 'scrypt:32768:8:1')
+        _method_prefix = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _method_prefix
+
+# Admission control
+class TokenBucketLimiter:
+    """Per-key token buckets: `capacity` attempts in a burst, refilled at `rate` per second"""
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key: str) -> Tuple[bool, float]:
+        """Take one token for key; returns (allowed, seconds until the next token)"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self.buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / self.rate
+
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now: float):
+        """Forget buckets that have refilled completely"""
+        full_after = self.capacity / self.rate
+        for key, (_, updated) in list(self.buckets.items()):
+            if now - updated >= full_after:
+                del self.buckets[key]
+
+# Buckets are per worker process and key on request.remote_addr, the client address
+# once app.py's ProxyFix has read X-Forwarded-For (PROXY_FIX_X_FOR)
+ip_limiter = TokenBucketLimiter(
+    capacity=float(os.environ.get('LOGIN_IP_BURST', 20)),
+    rate=float(os.environ.get('LOGIN_IP_RATE', 1))
+)
+username_limiter = TokenBucketLimiter(
+    capacity=float(os.environ.get('LOGIN_USER_BURST', 5)),
+    rate=float(os.environ.get('LOGIN_USER_RATE', 0.1))
+)
+
+def admit_login(ip: str, username: str = '') -> Tuple[bool, float]:
+    """Decide whether a login/register attempt may spend hashing time"""
+    allowed, retry_after = ip_limiter.allow(ip or 'unknown')
+    if not allowed:
+        return False, retry_after
+
+    if username:
+        allowed, retry_after = username_limiter.allow(username.lower())
+        if not allowed:
+            return False, retry_after
+    return True, 0.0
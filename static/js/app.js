@@ -11,6 +11,12 @@ let currentTemplateCategory = 'all';
 let previousLevel = 0;
 let currentTimeframe = 'all';
 
+// Sections requested from /api/bootstrap on page load
+const BOOTSTRAP_SECTIONS = [
+    'character', 'daily_challenges', 'template_categories', 'templates', 'quests',
+    'shop_items', 'inventory', 'achievements', 'battle_history'
+];
+
 // Initialize app on page load
 document.addEventListener('DOMContentLoaded', () => {
     initializeApp();
@@ -19,14 +25,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
 // Initialize application
 async function initializeApp() {
-    await loadCharacter();
-    await loadDailyChallenges();
-    await loadTemplates();
-    await loadQuests();
-    await loadShopItems();
-    await loadInventory();
-    await loadAchievements();
-    await loadBattleHistory();
+    await loadBootstrap();
     
     // Load leaderboard if tab is visible
     if (currentTab === 'leaderboard') {
@@ -35,6 +34,58 @@ async function initializeApp() {
     }
 }
 
+// Load the whole app shell in one round trip
+async function loadBootstrap() {
+    try {
+        const response = await fetch(`${API_BASE}/bootstrap?sections=${BOOTSTRAP_SECTIONS.join(',')}&completed=false`);
+        
+        if (response.status === 401) {
+            window.location.href = '/login';
+            return;
+        }
+        if (!response.ok) throw new Error('Failed to load app data');
+        
+        const data = await response.json();
+        
+        currentCharacter = data.character;
+        updateCharacterUI();
+        renderDailyChallenges(data.daily_challenges);
+        renderTemplateCategories(data.template_categories);
+        renderTemplates(data.templates);
+        renderQuests(data.quests, false);
+        renderShopItems(data.shop_items);
+        renderInventory(data.inventory);
+        renderAchievements(data.achievements);
+        renderBattleHistory(data.battle_history);
+    } catch (error) {
+        console.error('Error loading app data:', error);
+        showNotification('Error loading app data', 'error');
+    }
+}
+
+// One key per user action, so a retried request replays instead of granting rewards twice
+function idempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Run several API calls in one round trip through /api/batch
+async function batchRequests(requests) {
+    const response = await fetch(`${API_BASE}/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ requests })
+    });
+    
+    if (response.status === 401) {
+        window.location.href = '/login';
+        return null;
+    }
+    
+    const data = await response.json();
+    return data.responses;
+}
+
 // Setup event listeners
 function setupEventListeners() {
     // Tab navigation
@@ -162,25 +213,7 @@ async function loadTemplates() {
         // Load categories
         const categoryResponse = await fetch(`${API_BASE}/templates/categories`);
         const categories = await categoryResponse.json();
-        
-        // Create category tabs
-        const categoryTabs = document.getElementById('category-tabs');
-        categoryTabs.innerHTML = `
-            <div class="category-tab active" data-category="all">⭐ Popular</div>
-            ${categories.map(cat => `
-                <div class="category-tab" data-category="${cat}">${getCategoryIcon(cat)} ${capitalizeFirst(cat)}</div>
-            `).join('')}
-        `;
-        
-        // Add category tab listeners
-        document.querySelectorAll('.category-tab').forEach(tab => {
-            tab.addEventListener('click', (e) => {
-                currentTemplateCategory = e.target.dataset.category;
-                document.querySelectorAll('.category-tab').forEach(t => t.classList.remove('active'));
-                e.target.classList.add('active');
-                loadTemplatesByCategory();
-            });
-        });
+        renderTemplateCategories(categories);
         
         // Load popular templates initially
         await loadTemplatesByCategory();
@@ -189,6 +222,27 @@ async function loadTemplates() {
     }
 }
 
+function renderTemplateCategories(categories) {
+    // Create category tabs
+    const categoryTabs = document.getElementById('category-tabs');
+    categoryTabs.innerHTML = `
+        <div class="category-tab active" data-category="all">⭐ Popular</div>
+        ${categories.map(cat => `
+            <div class="category-tab" data-category="${cat}">${getCategoryIcon(cat)} ${capitalizeFirst(cat)}</div>
+        `).join('')}
+    `;
+    
+    // Add category tab listeners
+    document.querySelectorAll('.category-tab').forEach(tab => {
+        tab.addEventListener('click', (e) => {
+            currentTemplateCategory = e.target.dataset.category;
+            document.querySelectorAll('.category-tab').forEach(t => t.classList.remove('active'));
+            e.target.classList.add('active');
+            loadTemplatesByCategory();
+        });
+    });
+}
+
 async function loadTemplatesByCategory() {
     try {
         let url = `${API_BASE}/templates`;
@@ -200,30 +254,33 @@ async function loadTemplatesByCategory() {
         
         const response = await fetch(url);
         const templates = await response.json();
-        
-        const templateGrid = document.getElementById('template-grid');
-        templateGrid.innerHTML = templates.map(template => `
-            <div class="template-btn" data-template-id="${template.id}">
-                <span class="template-icon">${template.icon}</span>
-                <div class="template-info">
-                    <div class="template-title">${template.title}</div>
-                    <div class="template-difficulty ${template.difficulty}">${template.difficulty}</div>
-                </div>
-            </div>
-        `).join('');
-        
-        // Add click listeners
-        document.querySelectorAll('.template-btn').forEach(btn => {
-            btn.addEventListener('click', (e) => {
-                const templateId = e.currentTarget.dataset.templateId;
-                createQuestFromTemplate(templateId);
-            });
-        });
+        renderTemplates(templates);
     } catch (error) {
         console.error('Error loading templates:', error);
     }
 }
 
+function renderTemplates(templates) {
+    const templateGrid = document.getElementById('template-grid');
+    templateGrid.innerHTML = templates.map(template => `
+        <div class="template-btn" data-template-id="${template.id}">
+            <span class="template-icon">${template.icon}</span>
+            <div class="template-info">
+                <div class="template-title">${template.title}</div>
+                <div class="template-difficulty ${template.difficulty}">${template.difficulty}</div>
+            </div>
+        </div>
+    `).join('');
+    
+    // Add click listeners
+    document.querySelectorAll('.template-btn').forEach(btn => {
+        btn.addEventListener('click', (e) => {
+            const templateId = e.currentTarget.dataset.templateId;
+            createQuestFromTemplate(templateId);
+        });
+    });
+}
+
 async function createQuestFromTemplate(templateId) {
     try {
         const response = await fetch(`${API_BASE}/templates/${templateId}/create`, {
@@ -303,56 +360,64 @@ async function loadQuests() {
         const completed = questFilter === 'completed';
         const response = await fetch(`${API_BASE}/quests?completed=${completed}`);
         const quests = await response.json();
-        
-        const questsList = document.getElementById('quests-list');
-        
-        if (quests.length === 0) {
-            questsList.innerHTML = `
-                <div class="empty-state">
-                    <div class="empty-state-icon">📜</div>
-                    <p>${completed ? 'No completed quests yet' : 'No active quests. Create one to get started!'}</p>
-                </div>
-            `;
-            return;
-        }
-
-        questsList.innerHTML = quests.map(quest => `
-            <div class="quest-card ${quest.completed ? 'completed' : ''}">
-                <div class="quest-header">
-                    <h3 class="quest-title">${escapeHtml(quest.title)}</h3>
-                    <span class="quest-difficulty ${quest.difficulty}">${quest.difficulty}</span>
-                </div>
-                ${quest.description ? `<p class="quest-description">${escapeHtml(quest.description)}</p>` : ''}
-                <div class="quest-rewards">
-                    <span>✨ ${quest.xp_reward} XP</span>
-                    <span>💰 ${quest.gold_reward} Gold</span>
-                </div>
-                <div class="quest-actions">
-                    ${!quest.completed ? `
-                        <button class="btn btn-success btn-small" onclick="completeQuest(${quest.id})">
-                            ✓ Complete
-                        </button>
-                    ` : ''}
-                    <button class="btn btn-danger btn-small" onclick="deleteQuest(${quest.id})">
-                        🗑️ Delete
-                    </button>
-                </div>
-            </div>
-        `).join('');
+        renderQuests(quests, completed);
     } catch (error) {
         console.error('Error loading quests:', error);
         showNotification('Error loading quests', 'error');
     }
 }
 
+function renderQuests(quests, completed) {
+    const questsList = document.getElementById('quests-list');
+    
+    if (quests.length === 0) {
+        questsList.innerHTML = `
+            <div class="empty-state">
+                <div class="empty-state-icon">📜</div>
+                <p>${completed ? 'No completed quests yet' : 'No active quests. Create one to get started!'}</p>
+            </div>
+        `;
+        return;
+    }
+
+    questsList.innerHTML = quests.map(quest => `
+        <div class="quest-card ${quest.completed ? 'completed' : ''}">
+            <div class="quest-header">
+                <h3 class="quest-title">${escapeHtml(quest.title)}</h3>
+                <span class="quest-difficulty ${quest.difficulty}">${quest.difficulty}</span>
+            </div>
+            ${quest.description ? `<p class="quest-description">${escapeHtml(quest.description)}</p>` : ''}
+            <div class="quest-rewards">
+                <span>✨ ${quest.xp_reward} XP</span>
+                <span>💰 ${quest.gold_reward} Gold</span>
+            </div>
+            <div class="quest-actions">
+                ${!quest.completed ? `
+                    <button class="btn btn-success btn-small" onclick="completeQuest(${quest.id})">
+                        ✓ Complete
+                    </button>
+                ` : ''}
+                <button class="btn btn-danger btn-small" onclick="deleteQuest(${quest.id})">
+                    🗑️ Delete
+                </button>
+            </div>
+        </div>
+    `).join('');
+}
+
 async function completeQuest(questId) {
     try {
-        const response = await fetch(`${API_BASE}/quests/${questId}/complete`, {
-            method: 'POST'
-        });
-
-        if (response.ok) {
-            const result = await response.json();
+        const completed = questFilter === 'completed';
+        const responses = await batchRequests([
+            { method: 'POST', path: `${API_BASE}/quests/${questId}/complete`, headers: { 'Idempotency-Key': idempotencyKey() } },
+            { path: `${API_BASE}/character` },
+            { path: `${API_BASE}/quests?completed=${completed}` },
+            { path: `${API_BASE}/challenges/daily` }
+        ]);
+        if (!responses) return;
+
+        if (responses[0].status === 200) {
+            const result = responses[0].body;
             
             // Show enhanced reward popup
             showRewardPopup(result);
@@ -369,9 +434,10 @@ async function completeQuest(questId) {
                 }, 3000);
             }
 
-            await loadCharacter();
-            await loadQuests();
-            await loadDailyChallenges(); // Update challenge progress
+            currentCharacter = responses[1].body;
+            updateCharacterUI();
+            renderQuests(responses[2].body, completed);
+            renderDailyChallenges(responses[3].body); // Update challenge progress
         }
     } catch (error) {
         console.error('Error completing quest:', error);
@@ -402,42 +468,47 @@ async function loadShopItems() {
     try {
         const response = await fetch(`${API_BASE}/shop/items`);
         const items = await response.json();
-        
-        const shopItems = document.getElementById('shop-items');
-        
-        shopItems.innerHTML = items.map(item => `
-            <div class="item-card ${item.rarity}">
-                ${getItemIcon(item.type)}
-                <h3 class="item-name">${escapeHtml(item.name)}</h3>
-                <p class="item-type">${item.type}</p>
-                <p class="item-description">${escapeHtml(item.description)}</p>
-                <div class="item-stats">
-                    ${item.attack_bonus > 0 ? `<div class="item-stat">⚔️ +${item.attack_bonus} Attack</div>` : ''}
-                    ${item.defense_bonus > 0 ? `<div class="item-stat">🛡️ +${item.defense_bonus} Defense</div>` : ''}
-                    ${item.health_bonus > 0 ? `<div class="item-stat">❤️ +${item.health_bonus} Health</div>` : ''}
-                </div>
-                <div class="item-price">💰 ${item.price}</div>
-                <button class="btn btn-primary" onclick="purchaseItem(${item.id})" 
-                    ${currentCharacter && currentCharacter.gold < item.price ? 'disabled' : ''}>
-                    ${currentCharacter && currentCharacter.gold >= item.price ? 'Purchase' : 'Not Enough Gold'}
-                </button>
-            </div>
-        `).join('');
+        renderShopItems(items);
     } catch (error) {
         console.error('Error loading shop items:', error);
         showNotification('Error loading shop', 'error');
     }
 }
 
+function renderShopItems(items) {
+    const shopItems = document.getElementById('shop-items');
+    
+    shopItems.innerHTML = items.map(item => `
+        <div class="item-card ${item.rarity}">
+            ${getItemIcon(item.type)}
+            <h3 class="item-name">${escapeHtml(item.name)}</h3>
+            <p class="item-type">${item.type}</p>
+            <p class="item-description">${escapeHtml(item.description)}</p>
+            <div class="item-stats">
+                ${item.attack_bonus > 0 ? `<div class="item-stat">⚔️ +${item.attack_bonus} Attack</div>` : ''}
+                ${item.defense_bonus > 0 ? `<div class="item-stat">🛡️ +${item.defense_bonus} Defense</div>` : ''}
+                ${item.health_bonus > 0 ? `<div class="item-stat">❤️ +${item.health_bonus} Health</div>` : ''}
+            </div>
+            <div class="item-price">💰 ${item.price}</div>
+            <button class="btn btn-primary" onclick="purchaseItem(${item.id})" 
+                ${currentCharacter && currentCharacter.gold < item.price ? 'disabled' : ''}>
+                ${currentCharacter && currentCharacter.gold >= item.price ? 'Purchase' : 'Not Enough Gold'}
+            </button>
+        </div>
+    `).join('');
+}
+
 async function purchaseItem(itemId) {
     try {
-        const response = await fetch(`${API_BASE}/shop/purchase`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ item_id: itemId })
-        });
+        const responses = await batchRequests([
+            { method: 'POST', path: `${API_BASE}/shop/purchase`, body: { item_id: itemId }, headers: { 'Idempotency-Key': idempotencyKey() } },
+            { path: `${API_BASE}/character` },
+            { path: `${API_BASE}/shop/items` },
+            { path: `${API_BASE}/inventory` }
+        ]);
+        if (!responses) return;
 
-        const result = await response.json();
+        const result = responses[0].body;
 
         if (result.error) {
             showNotification(result.error, 'error');
@@ -451,9 +522,10 @@ async function purchaseItem(itemId) {
             showAchievementUnlock(result.newly_unlocked_achievements);
         }
 
-        await loadCharacter();
-        await loadShopItems();
-        await loadInventory();
+        currentCharacter = responses[1].body;
+        updateCharacterUI();
+        renderShopItems(responses[2].body);
+        renderInventory(responses[3].body);
     } catch (error) {
         console.error('Error purchasing item:', error);
         showNotification('Error purchasing item', 'error');
@@ -464,47 +536,56 @@ async function purchaseItem(itemId) {
 async function loadInventory() {
     try {
         const response = await fetch(`${API_BASE}/inventory`);
-        const items = await response.json();
-        
-        const inventoryItems = document.getElementById('inventory-items');
-        
-        if (items.length === 0) {
-            inventoryItems.innerHTML = `
-                <div class="empty-state">
-                    <div class="empty-state-icon">🎒</div>
-                    <p>Your inventory is empty. Visit the shop to buy items!</p>
-                </div>
-            `;
-            return;
-        }
-
-        inventoryItems.innerHTML = items.map(item => `
-            <div class="item-card ${item.rarity}">
-                ${item.equipped ? '<span class="equipped-badge">⚡ Equipped</span>' : ''}
-                ${getItemIcon(item.type)}
-                <h3 class="item-name">${escapeHtml(item.name)}</h3>
-                <p class="item-type">${item.type}</p>
-                <p class="item-description">${escapeHtml(item.description)}</p>
-                <div class="item-stats">
-                    ${item.attack_bonus > 0 ? `<div class="item-stat">⚔️ +${item.attack_bonus} Attack</div>` : ''}
-                    ${item.defense_bonus > 0 ? `<div class="item-stat">🛡️ +${item.defense_bonus} Defense</div>` : ''}
-                    ${item.health_bonus > 0 ? `<div class="item-stat">❤️ +${item.health_bonus} Health</div>` : ''}
-                </div>
-                ${item.type !== 'consumable' ? `
-                    <button class="btn ${item.equipped ? 'btn-secondary' : 'btn-success'}" 
-                        onclick="equipItem(${item.inventory_id})"
-                        ${item.equipped ? 'disabled' : ''}>
-                        ${item.equipped ? 'Equipped' : 'Equip'}
-                    </button>
-                ` : ''}
-            </div>
-        `).join('');
+        const inventory = await response.json();
+        renderInventory(inventory);
     } catch (error) {
         console.error('Error loading inventory:', error);
         showNotification('Error loading inventory', 'error');
     }
 }
 
+function renderInventory(data) {
+    const inventoryItems = document.getElementById('inventory-items');
+    // Stacks reference item definitions by id
+    const items = data.inventory.map(stack => ({
+        ...data.items[stack.item_id],
+        ...stack,
+        equipped: stack.equipped_count > 0
+    }));
+    
+    if (items.length === 0) {
+        inventoryItems.innerHTML = `
+            <div class="empty-state">
+                <div class="empty-state-icon">🎒</div>
+                <p>Your inventory is empty. Visit the shop to buy items!</p>
+            </div>
+        `;
+        return;
+    }
+
+    inventoryItems.innerHTML = items.map(item => `
+        <div class="item-card ${item.rarity}">
+            ${item.equipped ? '<span class="equipped-badge">⚡ Equipped</span>' : ''}
+            ${item.quantity > 1 ? `<span class="item-quantity">×${item.quantity}</span>` : ''}
+            ${getItemIcon(item.type)}
+            <h3 class="item-name">${escapeHtml(item.name)}</h3>
+            <p class="item-type">${item.type}</p>
+            <p class="item-description">${escapeHtml(item.description)}</p>
+            <div class="item-stats">
+                ${item.attack_bonus > 0 ? `<div class="item-stat">⚔️ +${item.attack_bonus} Attack</div>` : ''}
+                ${item.defense_bonus > 0 ? `<div class="item-stat">🛡️ +${item.defense_bonus} Defense</div>` : ''}
+                ${item.health_bonus > 0 ? `<div class="item-stat">❤️ +${item.health_bonus} Health</div>` : ''}
+            </div>
+            ${item.type !== 'consumable' ? `
+                <button class="btn ${item.equipped ? 'btn-secondary' : 'btn-success'}" 
+                    onclick="${item.equipped ? 'unequipItem' : 'equipItem'}(${item.inventory_id})">
+                    ${item.equipped ? 'Unequip' : 'Equip'}
+                </button>
+            ` : ''}
+        </div>
+    `).join('');
+}
+
 async function equipItem(inventoryId) {
     try {
         const response = await fetch(`${API_BASE}/inventory/${inventoryId}/equip`, {
@@ -519,7 +600,8 @@ async function equipItem(inventoryId) {
         }
 
         showNotification('Item equipped!', 'success');
-        await loadCharacter();
+        currentCharacter = result.character;
+        updateCharacterUI();
         await loadInventory();
     } catch (error) {
         console.error('Error equipping item:', error);
@@ -527,13 +609,36 @@ async function equipItem(inventoryId) {
     }
 }
 
+async function unequipItem(inventoryId) {
+    try {
+        const response = await fetch(`${API_BASE}/inventory/${inventoryId}/unequip`, {
+            method: 'POST'
+        });
+
+        const result = await response.json();
+
+        if (result.error) {
+            showNotification(result.error, 'error');
+            return;
+        }
+
+        showNotification('Item unequipped', 'success');
+        currentCharacter = result.character;
+        updateCharacterUI();
+        await loadInventory();
+    } catch (error) {
+        console.error('Error unequipping item:', error);
+        showNotification('Error unequipping item', 'error');
+    }
+}
+
 // Battle functions
 async function battleMonster(monsterName, monsterLevel) {
     try {
         // Make API call first to get battle result
         const response = await fetch(`${API_BASE}/battle`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey() },
             body: JSON.stringify({ 
                 monster_name: monsterName, 
                 monster_level: monsterLevel 
@@ -786,37 +891,40 @@ async function loadBattleHistory() {
     try {
         const response = await fetch(`${API_BASE}/battle/history`);
         const battles = await response.json();
-        
-        const historyList = document.getElementById('battle-history-list');
-        
-        if (battles.length === 0) {
-            historyList.innerHTML = '<p style="color: var(--text-secondary);">No battles yet. Challenge a monster!</p>';
-            return;
-        }
+        renderBattleHistory(battles);
+    } catch (error) {
+        console.error('Error loading battle history:', error);
+    }
+}
+
+function renderBattleHistory(battles) {
+    const historyList = document.getElementById('battle-history-list');
+    
+    if (battles.length === 0) {
+        historyList.innerHTML = '<p style="color: var(--text-secondary);">No battles yet. Challenge a monster!</p>';
+        return;
+    }
 
-        historyList.innerHTML = battles.map(battle => `
-            <div class="battle-entry ${battle.won ? 'won' : 'lost'}">
-                <div>
-                    <strong>${battle.monster_name}</strong> (Lvl ${battle.monster_level})
-                    <span style="color: var(--text-secondary); font-size: 0.85rem; margin-left: 10px;">
-                        ${new Date(battle.battled_at).toLocaleDateString()}
-                    </span>
+    historyList.innerHTML = battles.map(battle => `
+        <div class="battle-entry ${battle.won ? 'won' : 'lost'}">
+            <div>
+                <strong>${battle.monster_name}</strong> (Lvl ${battle.monster_level})
+                <span style="color: var(--text-secondary); font-size: 0.85rem; margin-left: 10px;">
+                    ${new Date(battle.battled_at).toLocaleDateString()}
+                </span>
+            </div>
+            <div style="text-align: right;">
+                <div style="color: ${battle.won ? 'var(--success-color)' : 'var(--danger-color)'}">
+                    ${battle.won ? 'Victory' : 'Defeat'}
                 </div>
-                <div style="text-align: right;">
-                    <div style="color: ${battle.won ? 'var(--success-color)' : 'var(--danger-color)'}">
-                        ${battle.won ? 'Victory' : 'Defeat'}
+                ${battle.won ? `
+                    <div style="font-size: 0.85rem; color: var(--text-secondary);">
+                        +${battle.xp_gained} XP, +${battle.gold_gained} Gold
                     </div>
-                    ${battle.won ? `
-                        <div style="font-size: 0.85rem; color: var(--text-secondary);">
-                            +${battle.xp_gained} XP, +${battle.gold_gained} Gold
-                        </div>
-                    ` : ''}
-                </div>
+                ` : ''}
             </div>
-        `).join('');
-    } catch (error) {
-        console.error('Error loading battle history:', error);
-    }
+        </div>
+    `).join('');
 }
 
 // Achievement functions
@@ -824,27 +932,30 @@ async function loadAchievements() {
     try {
         const response = await fetch(`${API_BASE}/achievements`);
         const achievements = await response.json();
-        
-        const achievementsList = document.getElementById('achievements-list');
-        
-        achievementsList.innerHTML = achievements.map(ach => `
-            <div class="achievement-card ${ach.unlocked ? 'unlocked' : 'locked'}">
-                <div class="achievement-icon">${ach.icon}</div>
-                <h3 class="achievement-name">${escapeHtml(ach.name)}</h3>
-                <p class="achievement-description">${escapeHtml(ach.description)}</p>
-                ${ach.unlocked ? `
-                    <p style="color: var(--gold-color); font-size: 0.85rem; margin-top: 10px;">
-                        Unlocked ${new Date(ach.unlocked_at).toLocaleDateString()}
-                    </p>
-                ` : ''}
-            </div>
-        `).join('');
+        renderAchievements(achievements);
     } catch (error) {
         console.error('Error loading achievements:', error);
         showNotification('Error loading achievements', 'error');
     }
 }
 
+function renderAchievements(achievements) {
+    const achievementsList = document.getElementById('achievements-list');
+    
+    achievementsList.innerHTML = achievements.map(ach => `
+        <div class="achievement-card ${ach.unlocked ? 'unlocked' : 'locked'}">
+            <div class="achievement-icon">${ach.icon}</div>
+            <h3 class="achievement-name">${escapeHtml(ach.name)}</h3>
+            <p class="achievement-description">${escapeHtml(ach.description)}</p>
+            ${ach.unlocked ? `
+                <p style="color: var(--gold-color); font-size: 0.85rem; margin-top: 10px;">
+                    Unlocked ${new Date(ach.unlocked_at).toLocaleDateString()}
+                </p>
+            ` : ''}
+        </div>
+    `).join('');
+}
+
 function showAchievementUnlock(achievements) {
     const modal = document.getElementById('achievement-modal');
     const content = document.getElementById('achievement-modal-content');
@@ -1126,7 +1237,7 @@ async function claimDailyChallenge(challengeId) {
     try {
         const response = await fetch(`${API_BASE}/challenges/daily/${challengeId}/claim`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' }
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey() }
         });
         
         if (!response.ok) {
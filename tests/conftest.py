@@ -0,0 +1,37 @@
+"""
+Shared fixtures: every test gets its own freshly initialized database file
+and a test client logged in as the demo user (id 1, character 1)
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set before app.py is imported: it initializes the database on import
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='quest_master_test_'), 'quest_master.db'))
+
+import app as app_module
+import database as db
+import password_hashing
+
+# Cheap hashes so tests that register users stay fast
+password_hashing.configure(method='pbkdf2:sha256:1')
+
+@pytest.fixture
+def app(tmp_path):
+    db.configure_storage(str(tmp_path / 'quest_master.db'))
+    db.init_db()
+    app_module.app.config['TESTING'] = True
+    return app_module.app
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['character_id'] = 1
+    return client
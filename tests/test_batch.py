@@ -0,0 +1,36 @@
+"""
+/api/batch sub-requests keep their request state apart from the outer request's
+"""
+import database as db
+import metrics
+
+def batch_requests_counted():
+    return sum(value for name, labels, value in metrics.snapshot()
+               if name == 'http_requests_total' and labels['route'] == '/api/batch')
+
+def test_batch_reports_its_own_trace(app, client, monkeypatch):
+    monkeypatch.setattr(db, 'DB_TRACE', True)
+    monkeypatch.setitem(app.config, 'DB_TRACE_HEADERS', True)
+
+    response = client.post('/api/batch', json={'requests': [
+        {'method': 'POST', 'path': '/api/quests', 'body': {'title': 'Batched'}},
+        {'method': 'GET', 'path': '/api/character'},
+    ]})
+
+    assert response.status_code == 200
+    assert int(response.headers['X-DB-Statements']) > 0
+    assert float(response.headers['X-DB-Time']) >= 0
+    assert response.headers['X-DB-Repeated'].isdigit()
+    assert db.current_trace() is None
+
+    # A following request counts only its own statements
+    single = client.get('/api/character')
+    assert int(single.headers['X-DB-Statements']) < int(response.headers['X-DB-Statements'])
+    assert db.current_trace() is None
+
+def test_batch_is_recorded_in_metrics(client):
+    before = batch_requests_counted()
+    response = client.post('/api/batch', json={'requests': [{'method': 'GET', 'path': '/api/character'}]})
+    assert response.status_code == 200
+    assert batch_requests_counted() == before + 1
+    assert 'route="/api/batch"' in metrics.render()
@@ -0,0 +1,28 @@
+"""
+/api/character answers the same way with or without ?fields
+"""
+import database as db
+
+def test_fields_unknown_name_is_rejected(client):
+    response = client.get('/api/character?fields=name,password_hash')
+    assert response.status_code == 400
+    assert 'password_hash' in response.get_json()['error']
+
+def test_fields_with_stale_session_character(client):
+    with client.session_transaction() as session:
+        session['character_id'] = 999
+    projected = client.get('/api/character?fields=name,level')
+    assert projected.status_code == 200
+    char = db.get_character(1)
+    assert projected.get_json() == {'name': char['name'], 'level': char['level']}
+
+def test_fields_without_any_character(client):
+    conn = db.get_db()
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('DELETE FROM character')
+    conn.commit()
+    conn.close()
+
+    projected = client.get('/api/character?fields=name,level')
+    assert projected.status_code == 200
+    assert projected.get_json()['level'] == 1
@@ -0,0 +1,21 @@
+"""
+Streamed rows encode column values exactly as json.dumps would
+"""
+import json
+
+import pytest
+
+import json_stream
+
+@pytest.mark.parametrize('value', [None, 'quest "one"\n', 'é', 0, -7, 2 ** 70, 1.5, 1e300, True, False])
+def test_encode_value_matches_json_dumps(value):
+    assert json_stream.encode_value(value) == json.dumps(value)
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_encode_value_rejects_non_finite_floats(value):
+    with pytest.raises(ValueError):
+        json_stream.encode_value(value)
+
+def test_encoded_row_is_valid_json():
+    encode = json_stream.row_encoder(['id', 'title', 'xp'])
+    assert json.loads(encode((1, 'Slay', 2.5))) == {'id': 1, 'title': 'Slay', 'xp': 2.5}
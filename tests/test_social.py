@@ -0,0 +1,8 @@
+"""
+Social profile helpers
+"""
+import database_social
+
+def test_weekly_activity_graph_without_weeks(app):
+    assert database_social.get_weekly_activity_graph(1, weeks=0) == []
+    assert len(database_social.get_weekly_activity_graph(1, weeks=2)) == 2
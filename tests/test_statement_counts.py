@@ -0,0 +1,64 @@
+"""
+Statement budgets per endpoint: the character row is read at most once per request
+"""
+import pytest
+
+import database as db
+
+CHARACTER_READ = 'SELECT * FROM character WHERE id = ?'
+
+def character_reads(trace):
+    return trace.counts.get(CHARACTER_READ, 0)
+
+@pytest.fixture
+def rich_client(client):
+    db.update_character(1, gold=10000)
+    # Today's challenges are generated on first use; keep that out of the budgets
+    client.get('/api/challenges/daily')
+    return client
+
+def test_complete_quest(rich_client):
+    quest = rich_client.post('/api/quests', json={'title': 'Budgeted'}).get_json()
+    with db.statement_budget(36, 'POST /api/quests/<id>/complete') as trace:
+        response = rich_client.post(f"/api/quests/{quest['id']}/complete")
+    assert response.status_code == 200
+    assert 'newly_unlocked_achievements' in response.get_json()
+    assert character_reads(trace) == 1
+
+def test_battle(rich_client):
+    with db.statement_budget(26, 'POST /api/battle') as trace:
+        response = rich_client.post('/api/battle', json={'monster_name': 'Goblin', 'monster_level': 1})
+    assert response.status_code == 200
+    assert character_reads(trace) == 1
+
+def test_purchase(rich_client):
+    with db.statement_budget(16, 'POST /api/shop/purchase') as trace:
+        response = rich_client.post('/api/shop/purchase', json={'item_id': 1})
+    assert response.status_code == 200
+    assert response.get_json()['character']['gold'] < 10000
+    assert character_reads(trace) == 1
+
+def test_checkout(rich_client):
+    with db.statement_budget(16, 'POST /api/shop/checkout') as trace:
+        response = rich_client.post('/api/shop/checkout', json={'items': [{'item_id': 1, 'quantity': 2}]})
+    assert response.status_code == 200
+    assert character_reads(trace) == 1
+
+def test_equip_and_unequip(rich_client):
+    inventory_id = rich_client.post('/api/shop/purchase', json={'item_id': 1}).get_json()['inventory_id']
+    with db.statement_budget(8, 'POST /api/inventory/<id>/equip') as trace:
+        assert rich_client.post(f'/api/inventory/{inventory_id}/equip').status_code == 200
+    assert character_reads(trace) == 1
+    with db.statement_budget(8, 'POST /api/inventory/<id>/unequip') as trace:
+        assert rich_client.post(f'/api/inventory/{inventory_id}/unequip').status_code == 200
+    assert character_reads(trace) == 1
+
+def test_stats(client):
+    with db.statement_budget(12, 'GET /api/stats') as trace:
+        assert client.get('/api/stats').status_code == 200
+    assert character_reads(trace) <= 1
+
+def test_character(client):
+    with db.statement_budget(2, 'GET /api/character') as trace:
+        assert client.get('/api/character').status_code == 200
+    assert character_reads(trace) == 1
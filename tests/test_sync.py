@@ -0,0 +1,51 @@
+"""
+/api/sync applies each offline action once, however late the queue is replayed
+"""
+import database as db
+
+def age_applied_requests(seconds):
+    conn = db.get_db()
+    conn.execute("UPDATE applied_request SET created_at = datetime('now', ?)", (f'-{seconds} seconds',))
+    conn.commit()
+    conn.close()
+
+def test_replay_after_idempotency_ttl(client):
+    quest = client.post('/api/quests', json={'title': 'Offline'}).get_json()
+    actions = [{'id': 'offline-1', 'method': 'POST', 'path': f"/api/quests/{quest['id']}/complete"}]
+
+    first = client.post('/api/sync', json={'actions': actions}).get_json()['results'][0]
+    assert first['status'] == 200
+    character = db.get_character(1)
+
+    # Past the Idempotency-Key TTL; another recorded request runs the expiry sweep
+    age_applied_requests(db.IDEMPOTENCY_TTL + 60)
+    db.record_applied_request(1, 'idem:POST /api/quests:other', 201, {})
+
+    replay = client.post('/api/sync', json={'actions': actions}).get_json()['results'][0]
+    assert replay['replayed'] is True
+    assert replay['status'] == 200
+    after = db.get_character(1)
+    assert (after['xp'], after['gold'], after['level']) == (character['xp'], character['gold'], character['level'])
+
+def test_idempotency_keys_still_expire(client):
+    db.record_applied_request(1, 'idem:POST /api/battle:k', 200, {'won': True})
+    age_applied_requests(db.IDEMPOTENCY_TTL + 60)
+    assert db.get_applied_request(1, 'idem:POST /api/battle:k') is None
+
+def test_sync_from_zero_includes_rows_older_than_the_change_log(client):
+    quest = client.post('/api/quests', json={'title': 'Before the log'}).get_json()
+    # As if the quest was written before the change_log triggers existed
+    conn = db.get_db()
+    conn.execute("DELETE FROM change_log WHERE entity = 'quest'")
+    conn.commit()
+    conn.close()
+
+    snapshot = client.get('/api/sync?since=0').get_json()
+    assert snapshot['snapshot'] is True
+    assert quest['id'] in [q['id'] for q in snapshot['quests']]
+    assert snapshot['character']['id'] == 1
+
+    client.post(f"/api/quests/{quest['id']}/complete")
+    delta = client.get(f"/api/sync?since={snapshot['token']}").get_json()
+    assert delta['snapshot'] is False
+    assert [(q['id'], q['completed']) for q in delta['quests']] == [(quest['id'], 1)]
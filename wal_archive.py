@@ -0,0 +1,427 @@
+"""
+WAL Archiver
+Continuous backups: ships committed WAL frames to an archive directory as small
+segments, and restores a base snapshot plus segments up to a point in time.
+Backup I/O follows the write rate instead of the database size.
+
+While WAL_ARCHIVE_DIR is set, app connections run with wal_autocheckpoint=0 and the
+archiver is the only connection that checkpoints. Each pass holds the write lock
+just long enough to copy the frames committed since the last pass and, once the
+WAL has grown, checkpoint it, so a frame is never checkpointed away (and the WAL
+restarted over it) before it has been read. If continuity is ever lost (archiver
+restart, someone else checkpointed) a new generation starts from a fresh snapshot.
+
+Archive layout:
+    <dir>/<generation>/base.db.gz              snapshot the generation starts from
+    <dir>/<generation>/meta.json               written last; marks the generation usable
+    <dir>/<generation>/<seq>-<unix ms>.wal.gz  WAL frames committed after it, in order
+
+Restores are accurate to the archive interval: a segment is stamped when it's shipped.
+
+Usage: python wal_archive.py archive [--dir wal_archive] [--interval 1]
+       python wal_archive.py restore OUTPUT [--dir wal_archive] [--until '2026-10-19 12:30:00']
+       python wal_archive.py list [--dir wal_archive]
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Tuple
+
+import backup_database
+import database
+from database_writer import is_busy_error
+
+WAL_ARCHIVE_DIR = database.WAL_ARCHIVE_DIR or 'wal_archive'
+# Seconds between archive passes (also the restore granularity)
+WAL_ARCHIVE_INTERVAL = float(os.environ.get('WAL_ARCHIVE_INTERVAL', 1.0))
+# Checkpoint once the WAL holds this many frames (SQLite's own autocheckpoint default)
+WAL_ARCHIVE_CHECKPOINT_FRAMES = int(os.environ.get('WAL_ARCHIVE_CHECKPOINT_FRAMES', 1000))
+# Start a new generation (fresh base snapshot) this often, and keep this many
+WAL_ARCHIVE_SNAPSHOT_HOURS = float(os.environ.get('WAL_ARCHIVE_SNAPSHOT_HOURS', 24))
+WAL_ARCHIVE_KEEP_GENERATIONS = int(os.environ.get('WAL_ARCHIVE_KEEP_GENERATIONS', 3))
+
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC_LITTLE_ENDIAN = 0x377f0682
+WAL_MAGIC_BIG_ENDIAN = 0x377f0683
+
+# WAL file format
+def wal_checksum(data: bytes, s0: int, s1: int, big_endian: bool) -> Tuple[int, int]:
+    """Continue SQLite's cumulative WAL checksum over data"""
+    words = struct.unpack(f"{'>' if big_endian else '<'}{len(data) // 4}I", data)
+    for first, second in zip(words[0::2], words[1::2]):
+        s0 = (s0 + first + s1) & 0xFFFFFFFF
+        s1 = (s1 + second + s0) & 0xFFFFFFFF
+    return s0, s1
+
+def read_wal_header(wal) -> Optional[dict]:
+    """Parse and verify a WAL file header; None when there's no valid WAL yet"""
+    wal.seek(0)
+    header = wal.read(WAL_HEADER_SIZE)
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+
+    magic, _, page_size, _, _, _, checksum1, checksum2 = struct.unpack('>8I', header)
+    if magic not in (WAL_MAGIC_LITTLE_ENDIAN, WAL_MAGIC_BIG_ENDIAN):
+        return None
+    big_endian = magic == WAL_MAGIC_BIG_ENDIAN
+    if wal_checksum(header[:24], 0, 0, big_endian) != (checksum1, checksum2):
+        return None
+
+    return {
+        'page_size': page_size,
+        'salt': header[16:24],
+        'checksum': (checksum1, checksum2),
+        'big_endian': big_endian,
+    }
+
+def read_committed_frames(wal, header: dict, offset: int, checksum: Tuple[int, int]) -> Tuple[bytes, int, Tuple[int, int]]:
+    """Read the valid frames after offset up to the last commit frame
+
+    Returns the raw frames, the offset just past them and the running checksum
+    there. Frames stop at the first one with a stale salt or a broken checksum,
+    exactly where SQLite's own recovery would stop.
+    """
+    frame_size = WAL_FRAME_HEADER_SIZE + header['page_size']
+    wal.seek(offset)
+    data = wal.read()
+
+    position = 0
+    committed = 0
+    committed_checksum = checksum
+    while position + frame_size <= len(data):
+        frame_header = data[position:position + WAL_FRAME_HEADER_SIZE]
+        _, commit_size, _, checksum1, checksum2 = struct.unpack('>2I8s2I', frame_header)
+        if frame_header[8:16] != header['salt']:
+            break
+        checksum = wal_checksum(frame_header[:8], *checksum, header['big_endian'])
+        checksum = wal_checksum(data[position + WAL_FRAME_HEADER_SIZE:position + frame_size], *checksum, header['big_endian'])
+        if checksum != (checksum1, checksum2):
+            break
+
+        position += frame_size
+        if commit_size:
+            committed = position
+            committed_checksum = checksum
+
+    return data[:committed], offset + committed, committed_checksum
+
+def salt_follows(previous: bytes, current: bytes) -> bool:
+    """Check whether a WAL header salt comes from exactly one restart after another"""
+    return struct.unpack('>I', current[:4])[0] == (struct.unpack('>I', previous[:4])[0] + 1) & 0xFFFFFFFF
+
+def write_file_durably(path: str, payload: bytes):
+    """Write a file under a temporary name, fsync it, then move it into place"""
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+class ContinuityLost(Exception):
+    """Raised when WAL frames may have been checkpointed before they were archived"""
+
+class WalArchiver:
+    """Ships every committed WAL frame of one database into generations of segments"""
+
+    def __init__(self, db_path: str = database.DATABASE_NAME, archive_dir: str = WAL_ARCHIVE_DIR,
+                 checkpoint_frames: int = WAL_ARCHIVE_CHECKPOINT_FRAMES,
+                 snapshot_hours: float = WAL_ARCHIVE_SNAPSHOT_HOURS,
+                 keep_generations: int = WAL_ARCHIVE_KEEP_GENERATIONS):
+        self.db_path = db_path
+        self.wal_path = db_path + '-wal'
+        self.archive_dir = archive_dir
+        self.checkpoint_frames = checkpoint_frames
+        self.snapshot_hours = snapshot_hours
+        self.keep_generations = keep_generations
+
+        # Holds the write lock during a pass, and stays open so closing app
+        # connections never run the last-connection checkpoint behind our back
+        self.conn = sqlite3.connect(db_path, timeout=database.DB_BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA wal_autocheckpoint=0')
+        # A PASSIVE checkpoint doesn't need the write lock, so it can run while self.conn holds it
+        self.checkpointer = sqlite3.connect(db_path, timeout=database.DB_BUSY_TIMEOUT, isolation_level=None)
+        self.checkpointer.execute('PRAGMA wal_autocheckpoint=0')
+
+        self.generation = None
+        self.generation_started = 0.0
+        self.sequence = 0
+        self.salt = None
+        self.offset = WAL_HEADER_SIZE
+        self.checksum = (0, 0)
+        self.fully_checkpointed = False
+        self.stats = {'generations': 0, 'segments': 0, 'frames': 0, 'bytes': 0, 'checkpoints': 0}
+
+    def close(self):
+        self.conn.close()
+        self.checkpointer.close()
+
+    @contextmanager
+    def write_lock(self):
+        """Block other writers (readers carry on) while the WAL is read and checkpointed"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        finally:
+            self.conn.execute('ROLLBACK')
+
+    def checkpoint(self):
+        """Backfill the WAL into the database file; only call with the write lock held"""
+        busy, frames, backfilled = self.checkpointer.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        # Once everything is backfilled the next writer restarts the WAL with a new salt
+        self.fully_checkpointed = busy == 0 and frames == backfilled
+        self.stats['checkpoints'] += 1
+
+    def start_generation(self):
+        """Take a base snapshot and start archiving the frames written after it"""
+        now = time.time()
+        name = datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        directory = os.path.join(self.archive_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        snapshot = os.path.join(directory, 'base.db.partial')
+
+        try:
+            with self.write_lock():
+                # Everything already in the WAL is part of the snapshot
+                self.salt, self.offset, self.checksum = None, WAL_HEADER_SIZE, (0, 0)
+                if os.path.exists(self.wal_path):
+                    with open(self.wal_path, 'rb') as wal:
+                        header = read_wal_header(wal)
+                        if header is not None:
+                            self.salt, self.checksum = header['salt'], header['checksum']
+                            _, self.offset, self.checksum = read_committed_frames(wal, header, self.offset, self.checksum)
+
+                # One step: writers are blocked anyway, and a stepped copy would restart on nothing
+                backup_database.copy_database(self.db_path, snapshot, pages=-1, pause=0)
+                self.checkpoint()
+
+            backup_database.compress_file(snapshot, os.path.join(directory, 'base.db.gz'))
+            page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+            meta = {'created': now, 'page_size': page_size}
+            write_file_durably(os.path.join(directory, 'meta.json'), json.dumps(meta).encode())
+        finally:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+
+        self.generation = directory
+        self.generation_started = now
+        self.sequence = 0
+        self.stats['generations'] += 1
+        print(f"📦 WAL archive generation {name} started")
+
+        for removed in self.apply_retention():
+            print(f"  Removed old WAL archive generation: {removed}")
+
+    def archive_once(self) -> int:
+        """Ship the frames committed since the last pass; returns how many were shipped"""
+        with self.write_lock():
+            if not os.path.exists(self.wal_path):
+                return 0
+            with open(self.wal_path, 'rb') as wal:
+                header = read_wal_header(wal)
+                if header is None:
+                    return 0
+
+                if header['salt'] != self.salt:
+                    # A restarted WAL is only safe if we had archived and backfilled all of the old
+                    # one, and it restarted once (SQLite bumps salt-1 by one per restart)
+                    if self.salt is not None and not (self.fully_checkpointed and salt_follows(self.salt, header['salt'])):
+                        raise ContinuityLost('WAL restarted before its frames were archived')
+                    self.salt, self.offset, self.checksum = header['salt'], WAL_HEADER_SIZE, header['checksum']
+
+                frames, offset, checksum = read_committed_frames(wal, header, self.offset, self.checksum)
+
+            frame_size = WAL_FRAME_HEADER_SIZE + header['page_size']
+            if frames:
+                self.fully_checkpointed = False
+            if (offset - WAL_HEADER_SIZE) // frame_size >= self.checkpoint_frames:
+                self.checkpoint()
+
+        self.offset, self.checksum = offset, checksum
+        if not frames:
+            return 0
+
+        self.sequence += 1
+        segment = os.path.join(self.generation, f'{self.sequence:010d}-{int(time.time() * 1000)}.wal.gz')
+        payload = gzip.compress(frames, compresslevel=6)
+        write_file_durably(segment, payload)
+
+        count = len(frames) // frame_size
+        self.stats['segments'] += 1
+        self.stats['frames'] += count
+        self.stats['bytes'] += len(payload)
+        return count
+
+    def apply_retention(self) -> list:
+        """Delete the oldest generations beyond keep_generations"""
+        removed = []
+        for generation in list_generations(self.archive_dir)[:-self.keep_generations or None]:
+            if generation['path'] != self.generation:
+                shutil.rmtree(generation['path'])
+                removed.append(os.path.basename(generation['path']))
+        return removed
+
+    def run(self, interval: float = WAL_ARCHIVE_INTERVAL):
+        """Archive forever, starting a new generation on schedule or whenever continuity is lost"""
+        while True:
+            try:
+                if self.generation is None or time.time() - self.generation_started > self.snapshot_hours * 3600:
+                    self.start_generation()
+                self.archive_once()
+            except sqlite3.OperationalError as e:
+                # Writers held the lock past the busy timeout; try again next pass
+                if not is_busy_error(e):
+                    raise
+            except (ContinuityLost, OSError) as e:
+                print(f"WARNING: WAL archive {e}, starting a new generation")
+                self.generation = None
+            time.sleep(interval)
+
+# Restore
+def list_generations(archive_dir: str = WAL_ARCHIVE_DIR) -> list:
+    """Get every complete generation with its segments, oldest first"""
+    generations = []
+    if not os.path.isdir(archive_dir):
+        return generations
+
+    for name in sorted(os.listdir(archive_dir)):
+        path = os.path.join(archive_dir, name)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        segments = []
+        for segment in os.listdir(path):
+            if segment.endswith('.wal.gz'):
+                sequence, archived_ms = segment[:-len('.wal.gz')].split('-')
+                segments.append({'path': os.path.join(path, segment), 'sequence': int(sequence),
+                                 'archived': int(archived_ms) / 1000})
+        segments.sort(key=lambda segment: segment['sequence'])
+        generations.append({'path': path, 'created': meta['created'], 'page_size': meta['page_size'],
+                            'segments': segments})
+    return generations
+
+def apply_segment(db, payload: bytes, page_size: int) -> int:
+    """Write one segment's frames into a database file, a transaction at a time; returns transactions applied"""
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    transactions = 0
+    pending = []
+    for position in range(0, len(payload), frame_size):
+        page_number, commit_size = struct.unpack('>2I', payload[position:position + 8])
+        pending.append((page_number, payload[position + WAL_FRAME_HEADER_SIZE:position + frame_size]))
+        if commit_size:
+            # Later frames for the same page win, just as in the WAL
+            for page_number, page in pending:
+                db.seek((page_number - 1) * page_size)
+                db.write(page)
+            db.truncate(commit_size * page_size)
+            pending = []
+            transactions += 1
+    return transactions
+
+def restore(output_path: str, archive_dir: str = WAL_ARCHIVE_DIR, until: Optional[float] = None) -> dict:
+    """Rebuild the database as of a timestamp (default: the latest archived state)"""
+    if os.path.exists(output_path):
+        raise FileExistsError(f"{output_path} already exists")
+    until = time.time() if until is None else until
+
+    candidates = [generation for generation in list_generations(archive_dir) if generation['created'] <= until]
+    if not candidates:
+        raise FileNotFoundError(f"no WAL archive generation in {archive_dir} covers that time")
+    generation = candidates[-1]
+
+    partial = output_path + '.partial'
+    backup_database.restore_backup(os.path.join(generation['path'], 'base.db.gz'), partial)
+    restored_to = generation['created']
+    segments = 0
+    transactions = 0
+    try:
+        with open(partial, 'r+b') as db:
+            for segment in generation['segments']:
+                if segment['archived'] > until:
+                    break
+                with gzip.open(segment['path'], 'rb') as f:
+                    transactions += apply_segment(db, f.read(), generation['page_size'])
+                segments += 1
+                restored_to = segment['archived']
+
+        integrity = backup_database.check_integrity(partial)
+        if integrity != 'ok':
+            raise RuntimeError(f"integrity check failed on the restored database: {integrity}")
+        os.replace(partial, output_path)
+    finally:
+        for path in (partial, partial + '-wal', partial + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return {
+        'path': output_path,
+        'generation': os.path.basename(generation['path']),
+        'segments': segments,
+        'transactions': transactions,
+        'restored_to': restored_to,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('archive', 'restore', 'list'))
+    parser.add_argument('output', nargs='?', help='database file to restore into')
+    parser.add_argument('--dir', default=WAL_ARCHIVE_DIR)
+    parser.add_argument('--interval', type=float, default=WAL_ARCHIVE_INTERVAL, help='seconds between archive passes')
+    parser.add_argument('--until', help="restore point, 'YYYY-mm-dd HH:MM:SS' local time (default: latest)")
+    args = parser.parse_args()
+
+    if database.DB_SHARDS and args.command == 'archive':
+        print("✗ WAL archiving supports the single-file layout only (DB_SHARDS is set)")
+        raise SystemExit(1)
+    if database.is_memory_storage() and args.command == 'archive':
+        print("✗ WAL archiving needs a database file (DATABASE_PATH is ':memory:')")
+        raise SystemExit(1)
+
+    if args.command == 'archive':
+        archiver = WalArchiver(archive_dir=args.dir)
+        print(f"🗄️  Archiving WAL of {archiver.db_path} to {args.dir} every {args.interval}s")
+        try:
+            archiver.run(args.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            archiver.close()
+            print(f"✓ Archived {archiver.stats['frames']} frames in {archiver.stats['segments']} segments "
+                  f"({archiver.stats['bytes'] / 1024 / 1024:.1f} MB), {archiver.stats['checkpoints']} checkpoints")
+
+    elif args.command == 'restore':
+        if not args.output:
+            parser.error('restore needs an OUTPUT database path')
+        until = datetime.strptime(args.until, '%Y-%m-%d %H:%M:%S').timestamp() if args.until else None
+        try:
+            report = restore(args.output, args.dir, until)
+        except Exception as e:
+            print(f"✗ Restore failed: {e}")
+            raise SystemExit(1)
+        print(f"✓ Restored {report['path']} from generation {report['generation']}")
+        print(f"  {report['segments']} segments, {report['transactions']} transactions, integrity ok")
+        print(f"  State as of {datetime.fromtimestamp(report['restored_to']):%Y-%m-%d %H:%M:%S}")
+
+    else:
+        for generation in list_generations(args.dir):
+            segments = generation['segments']
+            latest = segments[-1]['archived'] if segments else generation['created']
+            size = sum(os.path.getsize(segment['path']) for segment in segments)
+            print(f"{os.path.basename(generation['path'])}  {len(segments):>6} segments  {size / 1024 / 1024:>8.1f} MB  "
+                  f"{datetime.fromtimestamp(generation['created']):%Y-%m-%d %H:%M:%S} -> "
+                  f"{datetime.fromtimestamp(latest):%Y-%m-%d %H:%M:%S}")
+
+if __name__ == '__main__':
+    main()